@@ -0,0 +1,453 @@
+"""HTTP clients for Airtable and Slack, shared by all the requests of a warm container."""
+
+from concurrent import futures
+import contextlib
+import functools
+import heapq
+import importlib
+import itertools
+import logging
+import posixpath
+import threading
+import time
+import urllib.parse
+
+import request_timing
+
+# Airtable accepts at most 10 records in a single create or update request.
+MAX_RECORDS_PER_REQUEST = 10
+# Airtable allows 5 requests per second per base.
+_MAX_REQUESTS_PER_SECOND = 5
+# A few requests can be sent at once, e.g. to read a view while updating items. Airtable does not
+# count them exactly by second, and asks to retry later if there are too many anyway.
+_MAX_BURST_REQUESTS = 2
+# Requests made to answer a user go before the background ones, e.g. bulk updates.
+INTERACTIVE = 0
+BACKGROUND = 1
+# How long to wait before retrying a request that was rejected because of the rate limit or of
+# a server error, when Airtable does not say: it doubles for each retry.
+_RETRY_BACKOFF_SECONDS = 1
+# Users are waiting for interactive requests: there's no point in retrying them for long.
+_MAX_BACKOFF_SECONDS = {INTERACTIVE: 2, BACKGROUND: 30}
+_MAX_CONCURRENT_REQUESTS = 4
+_API_URL = 'https://api.airtable.com/v0/'
+# Slack waits 3 seconds for our responses so there's no point in waiting longer to connect.
+_HTTP_TIMEOUT_SECONDS = (3.05, 10)
+_HTTP_MAX_CONNECTIONS_PER_HOST = _MAX_CONCURRENT_REQUESTS
+_HTTP_MAX_RETRIES = 2
+_HTTP_RETRY_BACKOFF_SECONDS = .3
+
+
+class _LazyModule(object):
+    """A module that is only imported when one of its attributes is first used."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self._name), attribute)
+
+
+# Those modules are slow to import: they are imported on first use to make cold starts faster.
+airtable = _LazyModule('airtable.airtable')  # pylint: disable=invalid-name
+requests = _LazyModule('requests')  # pylint: disable=invalid-name
+
+_HTTP_SESSIONS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+
+def _get_http_session(url):
+    """Get the HTTP session shared by all the requests to the host of the given URL.
+
+    Sessions keep their connections alive, so that a warm container does not need a new TLS
+    handshake for each request.
+    """
+
+    host = urllib.parse.urlsplit(url).netloc
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get(host)
+        if session:
+            return session
+        session = requests.Session()
+        # Only idempotent requests are retried.
+        # Airtable errors are retried by the client, to share the backoff between requests.
+        retry = requests.adapters.Retry(
+            total=_HTTP_MAX_RETRIES, backoff_factor=_HTTP_RETRY_BACKOFF_SECONDS)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=_HTTP_MAX_CONNECTIONS_PER_HOST, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _HTTP_SESSIONS[host] = session
+        return session
+
+
+def post_json(url, payload):
+    """Post a JSON payload, e.g. a Slack message, through the shared HTTP session."""
+
+    with request_timing.span('slack'):
+        response = _get_http_session(url).post(url, json=payload, timeout=_HTTP_TIMEOUT_SECONDS)
+    _count_remote_call('slack', response)
+    return response
+
+
+def _count_remote_call(service, response):
+    body = response.request.body if response.request else None
+    request_timing.add_remote_call(service, len(body or b''), len(response.content or b''))
+
+
+_PRIORITY = threading.local()
+
+
+def _get_priority():
+    return getattr(_PRIORITY, 'value', INTERACTIVE)
+
+
+@contextlib.contextmanager
+def background_priority():
+    """Let the interactive requests go first, for the Airtable requests made in this block."""
+
+    previous_priority = _get_priority()
+    _PRIORITY.value = BACKGROUND
+    try:
+        yield
+    finally:
+        _PRIORITY.value = previous_priority
+
+
+def bind_context(func):
+    """Wrap a function to run it in another thread with the priority and timings of this one."""
+
+    priority = _get_priority()
+    timings = request_timing.current()
+
+    @functools.wraps(func)
+    def _run(*args, **kwargs):
+        _PRIORITY.value = priority
+        try:
+            return request_timing.run_with(timings, func, *args, **kwargs)
+        finally:
+            _PRIORITY.value = INTERACTIVE
+    return _run
+
+
+class _RequestScheduler(object):
+    """Spread the requests to an Airtable base in time so that they stay under its rate limit.
+
+    Each request waits for a token of a bucket that is refilled at the allowed rate. Waiting
+    requests get the tokens by priority, then in order of arrival.
+    """
+
+    def __init__(self, max_requests_per_second, max_burst_requests):
+        self._rate = max_requests_per_second
+        self._capacity = max_burst_requests
+        self._tokens = max_burst_requests
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if now <= self._refilled_at:
+            return
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled_at) * self._rate)
+        self._refilled_at = now
+
+    def acquire(self, priority):
+        """Block until a request can be sent.
+
+        Returns:
+            the number of requests that were already waiting.
+        """
+
+        with self._condition:
+            ticket = (priority, next(self._arrivals))
+            queue_depth = len(self._waiting)
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._waiting[0] != ticket:
+                    # Wait for the requests that go first.
+                    self._condition.wait()
+                    continue
+                delay = max((1 - self._tokens) / self._rate, self._paused_until - now)
+                if delay <= 0:
+                    break
+                self._condition.wait(delay)
+            heapq.heappop(self._waiting)
+            self._tokens -= 1
+            self._condition.notify_all()
+        return queue_depth
+
+    def pause(self, seconds):
+        """Hold all the requests for a while, e.g. when Airtable asks to retry later."""
+
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # Only one request is sent right after the pause, to check whether it's over.
+            self._tokens = 1
+            self._refilled_at = self._paused_until
+            self._condition.notify_all()
+
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def _get_scheduler(base_id):
+    """Get the scheduler shared by all the clients of a base."""
+
+    with _SCHEDULERS_LOCK:
+        if base_id not in _SCHEDULERS:
+            _SCHEDULERS[base_id] = _RequestScheduler(
+                _MAX_REQUESTS_PER_SECOND, _MAX_BURST_REQUESTS)
+        return _SCHEDULERS[base_id]
+
+
+def _get_retry_delay(method, response, retry_count):
+    """Get how long to wait before retrying a failed request, or None if it should not be."""
+
+    status_code = response.status_code
+    # Rejected requests were not run. Other server errors might have run, e.g. a create.
+    if status_code != 429 and (status_code < 500 or method not in ('GET', 'PATCH')):
+        return None
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return _RETRY_BACKOFF_SECONDS * 2 ** retry_count
+
+
+class AirtableClient(object):
+    """A minimal Airtable client that goes through the shared HTTP session.
+
+    Its requests are spread in time to stay under the rate limit of the base, and retried when
+    Airtable rejects them because of the rate limit. It can also create or update several records
+    in a single request.
+    """
+
+    def __init__(self, base_id, api_key):
+        self._base_url = posixpath.join(_API_URL, base_id)
+        self._headers = {'Authorization': 'Bearer {}'.format(api_key)}
+        self._scheduler = _get_scheduler(base_id)
+
+    def _request(self, method, path, params=None, payload=None):
+        url = posixpath.join(self._base_url, path)
+        priority = _get_priority()
+        backoff_seconds = 0
+        for retry_count in itertools.count():
+            with request_timing.span('airtable-wait'):
+                queue_depth = self._scheduler.acquire(priority)
+            request_timing.record_max('airtable-queue-depth', queue_depth)
+            with request_timing.span('airtable-read' if method == 'GET' else 'airtable-write'):
+                response = _get_http_session(url).request(
+                    method, url, params=params, json=payload, headers=self._headers,
+                    timeout=_HTTP_TIMEOUT_SECONDS)
+            _count_remote_call('airtable', response)
+            delay = _get_retry_delay(method, response, retry_count)
+            if delay is None or backoff_seconds + delay > _MAX_BACKOFF_SECONDS[priority]:
+                break
+            logging.warning(
+                'Airtable answered %d, retrying in %.1f seconds.', response.status_code, delay)
+            backoff_seconds += delay
+            self._scheduler.pause(delay)
+        if response.status_code != requests.codes.ok:
+            try:
+                error = response.json().get('error', {})
+            except ValueError:
+                error = {}
+            if not isinstance(error, dict):
+                error = {'type': error}
+            airtable_error = airtable.AirtableError(
+                error_type=error.get('type', str(response.status_code)),
+                message=error.get('message', response.text))
+            airtable_error.status_code = response.status_code
+            raise airtable_error
+        return response.json()
+
+    def get(  # pylint: disable=invalid-name
+            self, table_name, offset=None, view=None, fields=None, filter_by_formula=None,
+            sort_field=None):
+        """Get one page of records of a table.
+
+        Args:
+            table_name: the name of the table.
+            offset: the offset returned with the previous page.
+            view: the name of a view to only get its records, in its order.
+            fields: the names of the fields to get, all of them if not set.
+            filter_by_formula: an Airtable formula to only get the records for which it is true.
+            sort_field: the name of a field to sort the records by, in ascending order.
+        """
+
+        params = {}
+        if offset:
+            params['offset'] = offset
+        if view:
+            params['view'] = view
+        if fields:
+            params['fields[]'] = list(fields)
+        if filter_by_formula:
+            params['filterByFormula'] = filter_by_formula
+        if sort_field:
+            params['sort[0][field]'] = sort_field
+            params['sort[0][direction]'] = 'asc'
+        return self._request('GET', table_name, params=params)
+
+    def iterate(
+            self, table_name, view=None, fields=None, filter_by_formula=None, sort_field=None):
+        """Iterate over all the records of a table, getting the pages one by one."""
+
+        offset = None
+        while True:
+            response = self.get(
+                table_name, offset=offset, view=view, fields=fields,
+                filter_by_formula=filter_by_formula, sort_field=sort_field)
+            for record in response.get('records', []):
+                yield record
+            offset = response.get('offset')
+            if not offset:
+                return
+
+    def create(self, table_name, fields):
+        """Create a record."""
+
+        return self._request('POST', table_name, payload={'fields': fields})
+
+    def batch_create(self, table_name, fields_list):
+        """Create up to 10 records at once.
+
+        Returns:
+            the list of created records, in the same order as the fields.
+        """
+
+        return self._request('POST', table_name, payload={
+            'records': [{'fields': fields} for fields in fields_list],
+        }).get('records', [])
+
+    def update(self, table_name, record_id, fields):
+        """Update partially a record."""
+
+        return self._request(
+            'PATCH', posixpath.join(table_name, record_id), payload={'fields': fields})
+
+    def batch_update(self, table_name, records):
+        """Update partially up to 10 records at once.
+
+        Args:
+            table_name: the name of the table containing the records.
+            records: a list of dicts with the "id" of each record and the "fields" to update.
+        Returns:
+            the list of updated records.
+        """
+
+        return self._request('PATCH', table_name, payload={'records': records}).get('records', [])
+
+
+class _MaybeCreated(object):
+    """A record that might have been created by a request that failed: it is falsy, as None."""
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'MAYBE_CREATED'
+
+
+# Returned instead of the records that might have been created by a request that failed, e.g.
+# because of a timeout: creating them again could duplicate them.
+MAYBE_CREATED = _MaybeCreated()
+
+
+def _is_rejection(error):
+    """Whether Airtable refused a request, so that nothing was written."""
+
+    return getattr(error, 'status_code', requests.codes.bad_request) < 500
+
+
+def create_records(client, table_id, fields_list):
+    """Create many records using as few requests as possible.
+
+    Args:
+        client: the Airtable client to use.
+        table_id: the name of the table to create the records in.
+        fields_list: the fields of each record to create.
+    Returns:
+        the list of created records in the same order as the fields, with None for the records
+        that could not be created and MAYBE_CREATED for the ones that might have been created by
+        a request that failed.
+    """
+
+    records = []
+    for start in range(0, len(fields_list), MAX_RECORDS_PER_REQUEST):
+        batch = fields_list[start:start + MAX_RECORDS_PER_REQUEST]
+        if hasattr(client, 'batch_create'):
+            try:
+                records.extend(client.batch_create(table_id, batch))
+                continue
+            except airtable.AirtableError as error:
+                if not _is_rejection(error):
+                    logging.error('Batch create failed, it might have been created: %s', error)
+                    records.extend([MAYBE_CREATED] * len(batch))
+                    continue
+                # A single bad record fails the whole request: retry one by one to find which.
+                logging.warning('Batch create failed, retrying record by record: %s', error)
+            except requests.RequestException as error:
+                # A timeout does not tell whether the records were created: creating them again
+                # could duplicate them.
+                logging.error('Batch create failed, it might have been created: %s', error)
+                records.extend([MAYBE_CREATED] * len(batch))
+                continue
+        for fields in batch:
+            try:
+                records.append(client.create(table_id, fields))
+            except airtable.AirtableError as error:
+                logging.error('Could not create record: %s', error)
+                records.append(None if _is_rejection(error) else MAYBE_CREATED)
+            except requests.RequestException as error:
+                logging.error('Record create failed, it might have been created: %s', error)
+                records.append(MAYBE_CREATED)
+    return records
+
+
+def update_records(client, table_id, records):
+    """Update partially many records using as few and as concurrent requests as possible.
+
+    Args:
+        client: the Airtable client to use.
+        table_id: the name of the table containing the records.
+        records: a list of dicts with the "id" of each record and the "fields" to update.
+    Returns:
+        a dict of error messages keyed by the IDs of the records that could not be updated.
+    """
+
+    batches = [
+        records[start:start + MAX_RECORDS_PER_REQUEST]
+        for start in range(0, len(records), MAX_RECORDS_PER_REQUEST)]
+    errors = {}
+    update_batch = bind_context(functools.partial(_update_records_batch, client, table_id))
+    with futures.ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_REQUESTS) as executor:
+        for batch_errors in executor.map(update_batch, batches):
+            errors.update(batch_errors)
+    return errors
+
+
+def _update_records_batch(client, table_id, records):
+    if hasattr(client, 'batch_update'):
+        try:
+            client.batch_update(table_id, records)
+            return {}
+        except (airtable.AirtableError, requests.RequestException) as error:
+            if len(records) == 1:
+                logging.error('Could not update record "%s": %s', records[0]['id'], error)
+                return {records[0]['id']: str(error)}
+            # A single bad record fails the whole request: retry one by one to find which.
+            logging.warning('Batch update failed, retrying record by record: %s', error)
+
+    errors = {}
+    for record in records:
+        try:
+            client.update(table_id, record['id'], record['fields'])
+        except (airtable.AirtableError, requests.RequestException) as error:
+            logging.error('Could not update record "%s": %s', record['id'], error)
+            errors[record['id']] = str(error)
+    return errors
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""Test the Airtable and Slack HTTP clients."""
+
+import threading
+import time
+import unittest
+
+from airtable import airtable
+import mock
+import requests
+
+import airtable_client
+import request_timing
+
+
+class AirtableClientTest(unittest.TestCase):
+    """Test the Airtable client."""
+
+    def setUp(self):
+        super(AirtableClientTest, self).setUp()
+        self.client = airtable_client.AirtableClient('retro-base-id', 'api-key')
+        patcher = mock.patch('requests.Session.request')
+        self.mock_request = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_request.return_value.status_code = 200
+
+    def test_create(self):
+        """Create a record."""
+
+        self.mock_request.return_value.json.return_value = {
+            'id': 'rec1', 'fields': {'Object': 'Coffee'}}
+
+        record = self.client.create('Items', {'Object': 'Coffee'})
+
+        self.assertEqual('rec1', record['id'])
+        self.mock_request.assert_called_once()
+        args, kwargs = self.mock_request.call_args
+        self.assertEqual(('POST', 'https://api.airtable.com/v0/retro-base-id/Items'), args)
+        self.assertEqual({'fields': {'Object': 'Coffee'}}, kwargs['json'])
+        self.assertEqual('Bearer api-key', kwargs['headers']['Authorization'])
+        self.assertTrue(kwargs['timeout'])
+
+    def test_iterate_sorted_and_filtered(self):
+        """Records can be filtered by a formula and sorted by a field."""
+
+        self.mock_request.return_value.json.side_effect = [
+            {'records': [{'id': 'rec1', 'fields': {}}], 'offset': 'page2'},
+            {'records': [{'id': 'rec2', 'fields': {}}]},
+        ]
+
+        records = self.client.iterate(
+            'Items', fields=['Object'], filter_by_formula='{Category} = "good"',
+            sort_field='Created At')
+
+        self.assertEqual(['rec1', 'rec2'], [record['id'] for record in records])
+        params = self.mock_request.call_args[1]['params']
+        self.assertEqual({
+            'offset': 'page2',
+            'fields[]': ['Object'],
+            'filterByFormula': '{Category} = "good"',
+            'sort[0][field]': 'Created At',
+            'sort[0][direction]': 'asc',
+        }, params)
+
+    def test_error(self):
+        """Airtable errors are raised."""
+
+        self.mock_request.return_value.status_code = 422
+        self.mock_request.return_value.json.return_value = {'error': {
+            'type': 'INVALID_RECORDS', 'message': 'Too many records'}}
+
+        with self.assertRaises(airtable.AirtableError) as error:
+            self.client.batch_update('Items', [{'id': 'rec1', 'fields': {}}])
+        self.assertEqual('INVALID_RECORDS', error.exception.type)
+        self.assertEqual(422, error.exception.status_code)
+
+    def _respond(self, *statuses):
+        responses = []
+        for status_code, retry_after in statuses:
+            response = mock.MagicMock(status_code=status_code, headers={})
+            if retry_after:
+                response.headers['Retry-After'] = retry_after
+            response.json.return_value = {'id': 'rec1', 'fields': {}}
+            responses.append(response)
+        self.mock_request.side_effect = responses
+
+    def test_retry_rate_limited(self):
+        """Requests rejected because of the rate limit are retried when Airtable says."""
+
+        self._respond((429, '0.01'), (200, None))
+
+        timings = request_timing.start('test')
+        with self.assertLogs(level='WARNING'):
+            record = self.client.create('Items', {'Object': 'Coffee'})
+        request_timing.stop()
+
+        self.assertEqual('rec1', record['id'])
+        self.assertEqual(2, self.mock_request.call_count)
+        self.assertEqual(2, timings.spans['airtable-wait'][1])
+        self.assertEqual({'airtable': 2}, timings.remote_calls)
+        self.assertIn('airtable-queue-depth', timings.max_values)
+
+    def test_no_retry_of_failed_create(self):
+        """A create is not retried after a server error: it might have been done."""
+
+        self._respond((503, None), (200, None))
+
+        with self.assertRaises(airtable.AirtableError):
+            self.client.create('Items', {'Object': 'Coffee'})
+        self.assertEqual(1, self.mock_request.call_count)
+
+    def test_retry_server_error(self):
+        """Reads are retried after a server error."""
+
+        self._respond((502, '0'), (200, None))
+
+        with self.assertLogs(level='WARNING'):
+            self.client.get('Items')
+        self.assertEqual(2, self.mock_request.call_count)
+
+    def test_give_up_when_interactive(self):
+        """Interactive requests are not retried for long, background ones are."""
+
+        self._respond((429, '5'), (200, None))
+        with self.assertRaises(airtable.AirtableError):
+            self.client.get('Items')
+        self.assertEqual(1, self.mock_request.call_count)
+
+        self._respond((429, '5'), (200, None))
+        scheduler_class = airtable_client._RequestScheduler  # pylint: disable=protected-access
+        with mock.patch('time.sleep'), airtable_client.background_priority(), \
+                mock.patch.object(scheduler_class, 'pause') as mock_pause, \
+                self.assertLogs(level='WARNING'):
+            self.client.get('Items')
+        mock_pause.assert_called_once_with(5)
+        self.assertEqual(3, self.mock_request.call_count)
+
+    def test_session_is_shared(self):
+        """The same HTTP session is used for all the requests to a host."""
+
+        # pylint: disable=protected-access
+        session = airtable_client._get_http_session('https://hooks.slack.com/services/A')
+        self.assertIs(
+            session, airtable_client._get_http_session('https://hooks.slack.com/commands/B'))
+        self.assertIsNot(
+            session, airtable_client._get_http_session('https://api.airtable.com/v0/base'))
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    """Test the scheduler of the requests to a base."""
+
+    def test_rate(self):
+        """Requests are spread in time after a small burst."""
+
+        scheduler = airtable_client._RequestScheduler(  # pylint: disable=protected-access
+            max_requests_per_second=50, max_burst_requests=2)
+
+        start = time.monotonic()
+        for unused_index in range(6):
+            scheduler.acquire(airtable_client.INTERACTIVE)
+
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 50)
+
+    def test_priority(self):
+        """Interactive requests go before the background ones that were waiting."""
+
+        scheduler = airtable_client._RequestScheduler(  # pylint: disable=protected-access
+            max_requests_per_second=10, max_burst_requests=1)
+        scheduler.acquire(airtable_client.INTERACTIVE)
+        order = []
+
+        def _acquire(priority):
+            scheduler.acquire(priority)
+            order.append(priority)
+
+        threads = []
+        for priority in (airtable_client.BACKGROUND, airtable_client.INTERACTIVE):
+            thread = threading.Thread(target=_acquire, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            # Wait for the request to be queued.
+            while len(scheduler._waiting) < len(threads):  # pylint: disable=protected-access
+                time.sleep(.001)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([airtable_client.INTERACTIVE, airtable_client.BACKGROUND], order)
+
+
+class CreateRecordsTest(unittest.TestCase):
+    """Test the bulk creates."""
+
+    def test_batches(self):
+        """Records are created 10 by 10, and failing batches are created one by one."""
+
+        client = mock.MagicMock()
+        client.batch_create.side_effect = [
+            [{'id': 'rec{}'.format(i)} for i in range(10)],
+            airtable.AirtableError('INVALID_RECORDS', 'Invalid record'),
+        ]
+
+        def _create(unused_table_name, fields):
+            if fields['Object'] == 'Item #12':
+                raise airtable.AirtableError('INVALID_RECORDS', 'Invalid record')
+            return {'id': 'rec{}'.format(fields['Object'][6:])}
+        client.create.side_effect = _create
+
+        records = airtable_client.create_records(
+            client, 'Items', [{'Object': 'Item #{}'.format(i)} for i in range(13)])
+
+        self.assertEqual(
+            ['rec{}'.format(i) for i in range(12)] + [None],
+            [record and record['id'] for record in records])
+        self.assertEqual(
+            [10, 3], [len(call[0][1]) for call in client.batch_create.call_args_list])
+
+    def test_batch_timeout(self):
+        """A batch that might have been created is not created again one by one."""
+
+        client = mock.MagicMock()
+        client.batch_create.side_effect = requests.Timeout('Read timed out')
+
+        records = airtable_client.create_records(
+            client, 'Items', [{'Object': 'Item #{}'.format(i)} for i in range(3)])
+
+        self.assertEqual([airtable_client.MAYBE_CREATED] * 3, records)
+        self.assertFalse(any(records))
+        client.create.assert_not_called()
+
+    def test_batch_server_error(self):
+        """A batch that failed on the server side is not created again one by one."""
+
+        client = mock.MagicMock()
+        error = airtable.AirtableError('SERVER_ERROR', 'Bad gateway')
+        error.status_code = 502
+        client.batch_create.side_effect = error
+
+        records = airtable_client.create_records(client, 'Items', [{'Object': 'Item #1'}])
+
+        self.assertEqual([airtable_client.MAYBE_CREATED], records)
+        client.create.assert_not_called()
+
+
+class UpdateRecordsTest(unittest.TestCase):
+    """Test the bulk updates."""
+
+    def test_batches(self):
+        """Records are updated 10 by 10."""
+
+        client = mock.MagicMock()
+
+        errors = airtable_client.update_records(
+            client, 'Items', [{'id': 'rec{}'.format(i), 'fields': {}} for i in range(23)])
+
+        self.assertFalse(errors)
+        self.assertEqual(
+            [3, 10, 10],
+            sorted(len(call[0][1]) for call in client.batch_update.call_args_list))
+        client.update.assert_not_called()
+
+    def test_partial_failure(self):
+        """A failing batch is retried record by record to find the failing ones."""
+
+        client = mock.MagicMock()
+        client.batch_update.side_effect = airtable.AirtableError('NOT_FOUND', 'Not found')
+
+        def _update(unused_table_name, record_id, unused_fields):
+            if record_id == 'rec2':
+                raise airtable.AirtableError('NOT_FOUND', 'Not found')
+            return {'id': record_id}
+        client.update.side_effect = _update
+
+        errors = airtable_client.update_records(
+            client, 'Items', [{'id': 'rec{}'.format(i), 'fields': {}} for i in range(4)])
+
+        self.assertEqual(['rec2'], list(errors))
+        self.assertEqual(4, client.update.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""Run the bot's remote calls concurrently from asyncio coroutines, and serve it with ASGI.
+
+The Airtable and Slack clients are blocking, so each call runs in a thread of a shared pool while
+the event loop waits for it: independent calls, e.g. an update and a read of the same base, then
+overlap. Calls to the same base are limited to a few at once, on top of the rate limit of the
+Airtable client.
+
+The Flask app stays the WSGI entry point on AWS Lambda. AsgiAdapter serves it from an ASGI server,
+where each request is handled in a thread of the pool without blocking the others.
+"""
+
+import asyncio
+from concurrent import futures
+import functools
+import io
+import sys
+import threading
+import urllib.parse
+import weakref
+
+import airtable_client
+
+_MAX_THREADS = 16
+# The rate limit of Airtable leaves no room for more concurrent calls to the same base.
+_MAX_CONCURRENT_CALLS_PER_KEY = 4
+_EXECUTOR = futures.ThreadPoolExecutor(max_workers=_MAX_THREADS)
+# The requests served with ASGI have their own threads: they wait for the calls they make.
+_REQUEST_EXECUTOR = futures.ThreadPoolExecutor(max_workers=_MAX_THREADS)
+# Semaphores of each event loop, by key.
+_LIMITS = weakref.WeakKeyDictionary()
+_LIMITS_LOCK = threading.Lock()
+
+
+def run(awaitable):
+    """Run a coroutine until it's done, from blocking code such as a Flask view or a zappa task.
+
+    It runs in a new event loop, so that it can be used from any thread.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(awaitable)
+    finally:
+        loop.close()
+
+
+def _get_limit(loop, key):
+    with _LIMITS_LOCK:
+        limits = _LIMITS.setdefault(loop, {})
+        if key not in limits:
+            limits[key] = asyncio.Semaphore(_MAX_CONCURRENT_CALLS_PER_KEY)
+        return limits[key]
+
+
+async def call(func, *args, limit_key=None, **kwargs):
+    """Run a blocking function in a thread, with the priority and timings of the current request.
+
+    Args:
+        func: the function to run, with its args and kwargs.
+        limit_key: calls with the same key, e.g. to the same Airtable base, are limited to a few
+            at once.
+    """
+
+    loop = asyncio.get_event_loop()
+    bound_func = functools.partial(airtable_client.bind_context(func), *args, **kwargs)
+    if limit_key is None:
+        return await loop.run_in_executor(_EXECUTOR, bound_func)
+    async with _get_limit(loop, limit_key):
+        return await loop.run_in_executor(_EXECUTOR, bound_func)
+
+
+class AsgiAdapter(object):
+    """An ASGI app serving a WSGI app, e.g. a Flask app, in threads."""
+
+    def __init__(self, wsgi_app):
+        self._wsgi_app = wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope "{}".'.format(scope['type']))
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        status, headers, response_body = await asyncio.get_event_loop().run_in_executor(
+            _REQUEST_EXECUTOR, self._run_wsgi_app, _get_wsgi_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response_body})
+
+    def _run_wsgi_app(self, environ):
+        response = {}
+
+        def _start_response(status, headers, unused_exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers]
+
+        chunks = self._wsgi_app(environ, _start_response)
+        try:
+            body = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        return response['status'], response['headers'], body
+
+
+def _get_wsgi_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': urllib.parse.unquote(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = '{},{}'.format(environ[key], value) if key in environ else value
+    return environ
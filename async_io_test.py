@@ -0,0 +1,146 @@
+"""Unit tests for the async_io module."""
+
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+import airtable_client
+import async_io
+import request_timing
+
+
+def _echo_wsgi_app(environ, start_response):
+    if environ['PATH_INFO'] != '/echo':
+        start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+        return [b'Not found']
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [json.dumps({
+        'method': environ['REQUEST_METHOD'],
+        'query': environ['QUERY_STRING'],
+        'content_type': environ['CONTENT_TYPE'],
+        'user_agent': environ['HTTP_USER_AGENT'],
+        'body': environ['wsgi.input'].read().decode('utf-8'),
+    }).encode('utf-8')]
+
+
+class CallTestCase(unittest.TestCase):
+    """Unit tests for the call function."""
+
+    def test_concurrent_calls(self):
+        """Blocking calls overlap, but only a few at once for the same key."""
+
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def _slow_call(index):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(.05)
+            with lock:
+                running['now'] -= 1
+            return index
+
+        async def _call_all(limit_key):
+            return await asyncio.gather(*(
+                async_io.call(_slow_call, index, limit_key=limit_key) for index in range(8)))
+
+        self.assertEqual(list(range(8)), async_io.run(_call_all('base')))
+        self.assertEqual(4, running['max'])
+
+        running['max'] = 0
+        async_io.run(_call_all(None))
+        self.assertEqual(8, running['max'])
+
+    def test_context(self):
+        """Calls keep the priority and the timings of the request."""
+
+        def _get_context():
+            with request_timing.span('remote'):
+                # pylint: disable=protected-access
+                return airtable_client._get_priority()
+
+        timings = request_timing.start('test')
+        try:
+            with airtable_client.background_priority():
+                priority = async_io.run(async_io.call(_get_context))
+        finally:
+            request_timing.stop()
+
+        self.assertEqual(airtable_client.BACKGROUND, priority)
+        self.assertEqual(['remote'], list(timings.spans))
+
+
+class AsgiAdapterTestCase(unittest.TestCase):
+    """Unit tests for the AsgiAdapter class."""
+
+    def setUp(self):
+        super(AsgiAdapterTestCase, self).setUp()
+        self.asgi_app = async_io.AsgiAdapter(_echo_wsgi_app)
+
+    def _call(self, scope, messages):
+        received = list(messages)
+        sent = []
+
+        async def _receive():
+            return received.pop(0)
+
+        async def _send(message):
+            sent.append(message)
+
+        async_io.run(self.asgi_app(scope, _receive, _send))
+        return sent
+
+    def test_http(self):
+        """Requests are served by the WSGI app, including a body sent in several parts."""
+
+        sent = self._call({
+            'type': 'http',
+            'method': 'POST',
+            'path': '/echo',
+            'query_string': b'lang=fr',
+            'headers': [
+                (b'content-type', b'application/x-www-form-urlencoded'),
+                (b'user-agent', b'Slackbot'),
+            ],
+        }, [
+            {'type': 'http.request', 'body': b'text=great%20', 'more_body': True},
+            {'type': 'http.request', 'body': b'coffee'},
+        ])
+
+        self.assertEqual(2, len(sent))
+        self.assertEqual(200, sent[0]['status'])
+        self.assertIn((b'content-type', b'application/json'), sent[0]['headers'])
+        self.assertEqual({
+            'method': 'POST',
+            'query': 'lang=fr',
+            'content_type': 'application/x-www-form-urlencoded',
+            'user_agent': 'Slackbot',
+            'body': 'text=great%20coffee',
+        }, json.loads(sent[1]['body'].decode('utf-8')))
+
+    def test_not_found(self):
+        """The status of the WSGI app is kept."""
+
+        sent = self._call(
+            {'type': 'http', 'method': 'GET', 'path': '/missing'},
+            [{'type': 'http.request'}])
+
+        self.assertEqual(404, sent[0]['status'])
+
+    def test_lifespan(self):
+        """The server can start and stop the app."""
+
+        sent = self._call(
+            {'type': 'lifespan'},
+            [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        self.assertEqual(
+            ['lifespan.startup.complete', 'lifespan.shutdown.complete'],
+            [message['type'] for message in sent])
+
+
+if __name__ == '__main__':
+    unittest.main()
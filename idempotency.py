@@ -0,0 +1,119 @@
+"""Answer the retries of a request with the response to its first attempt.
+
+Slack retries a request when it does not get an answer within 3 seconds, so a slow command
+could otherwise be run several times. Responses are kept in memory, so only the retries that
+reach the same container are caught.
+"""
+
+import collections
+import functools
+import logging
+import threading
+import time
+
+import flask
+
+
+class _Entry(object):
+
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+        self.response = None
+        self.done = threading.Event()
+
+
+class ResponseCache(object):
+    """Responses to recent requests, keyed by an identity of the request."""
+
+    def __init__(self, ttl_seconds, max_entries):
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # Entries are ordered by expiry, as they all have the same TTL.
+        while self._entries and next(iter(self._entries.values())).expires_at <= now:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute, wait_seconds):
+        """Get the response to a request, only computing it if it was not done yet.
+
+        Args:
+            key: the identity of the request, the same for all its retries.
+            compute: a function to compute the response.
+            wait_seconds: how long to wait for the response if another attempt of the same
+                request is computing it.
+        Returns:
+            the response, or None if another attempt is still computing it.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(now + self._ttl_seconds)
+                self._entries[key] = entry
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                is_first_attempt = True
+            else:
+                is_first_attempt = False
+
+        if not is_first_attempt:
+            if not entry.done.wait(wait_seconds):
+                return None
+            if entry.response is not None:
+                return entry.response
+            # The first attempt failed: try again.
+            return self.get_or_compute(key, compute, wait_seconds)
+
+        try:
+            entry.response = compute()
+        finally:
+            if entry.response is None:
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+            entry.done.set()
+        return entry.response
+
+
+def answer_retries_once(cache, get_request_key, response_if_in_flight, wait_seconds):
+    """Answer the retries of the requests to a Flask view with the response to their first attempt.
+
+    Args:
+        cache: the ResponseCache keeping the responses.
+        get_request_key: a function to get the identity of the current request, or None if it
+            cannot be identified.
+        response_if_in_flight: the response to retries while the first attempt is still running.
+        wait_seconds: how long a retry waits for the first attempt.
+    """
+
+    def _decorator(view):
+        @functools.wraps(view)
+        def _view():
+            key = get_request_key()
+            if not key:
+                return view()
+            request = flask.request
+            retry_number = request.headers.get('X-Slack-Retry-Num')
+            if retry_number:
+                logging.info(
+                    'Slack retry #%s of %s: %s', retry_number, request.path,
+                    request.headers.get('X-Slack-Retry-Reason'))
+            frozen_response = cache.get_or_compute(
+                key, lambda: _freeze_response(view()), wait_seconds)
+            if frozen_response is None:
+                return response_if_in_flight()
+            data, status, mimetype = frozen_response
+            return flask.Response(data, status=status, mimetype=mimetype)
+        return _view
+    return _decorator
+
+
+def _freeze_response(view_response):
+    # Each attempt gets its own copy of the response, as the timing headers are added to it.
+    response = flask.current_app.make_response(view_response)
+    return response.get_data(), response.status_code, response.mimetype
@@ -0,0 +1,82 @@
+"""Unit tests for the idempotency module."""
+
+import threading
+import unittest
+
+import mock
+
+import idempotency
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Unit tests for the ResponseCache class."""
+
+    def setUp(self):
+        super(ResponseCacheTestCase, self).setUp()
+        self.cache = idempotency.ResponseCache(ttl_seconds=60, max_entries=3)
+
+    def test_compute_once(self):
+        """The response to a request is only computed once."""
+
+        compute = mock.MagicMock(return_value='response')
+
+        self.assertEqual('response', self.cache.get_or_compute('key', compute, 1))
+        self.assertEqual('response', self.cache.get_or_compute('key', compute, 1))
+        compute.assert_called_once_with()
+
+    def test_retry_while_in_flight(self):
+        """A retry waits for the first attempt, or gives up if it is too slow."""
+
+        first_attempt_started = threading.Event()
+        first_attempt_may_finish = threading.Event()
+
+        def _compute_slowly():
+            first_attempt_started.set()
+            first_attempt_may_finish.wait()
+            return 'first response'
+
+        responses = []
+        first_attempt = threading.Thread(
+            target=lambda: responses.append(
+                self.cache.get_or_compute('key', _compute_slowly, 1)))
+        first_attempt.start()
+        first_attempt_started.wait()
+
+        compute = mock.MagicMock(return_value='second response')
+        self.assertIsNone(self.cache.get_or_compute('key', compute, 0.01))
+
+        first_attempt_may_finish.set()
+        self.assertEqual('first response', self.cache.get_or_compute('key', compute, 1))
+        first_attempt.join()
+        self.assertEqual(['first response'], responses)
+        self.assertFalse(compute.called)
+
+    def test_recompute_after_failure(self):
+        """A request is computed again if its first attempt failed."""
+
+        with self.assertRaises(ValueError):
+            self.cache.get_or_compute('key', mock.MagicMock(side_effect=ValueError), 1)
+
+        self.assertEqual('response', self.cache.get_or_compute('key', lambda: 'response', 1))
+
+    @mock.patch('time.monotonic')
+    def test_expire(self, mock_monotonic):
+        """Responses are dropped when they are too old or too many."""
+
+        mock_monotonic.return_value = 1000
+        self.cache.get_or_compute('old', lambda: 'old response', 1)
+        mock_monotonic.return_value = 1050
+        for index in range(2):
+            self.cache.get_or_compute(index, lambda: 'response', 1)
+        self.assertEqual('old response', self.cache.get_or_compute('old', lambda: 'new', 1))
+
+        mock_monotonic.return_value = 1070
+        self.assertEqual('new response', self.cache.get_or_compute(
+            'old', lambda: 'new response', 1))
+
+        self.cache.get_or_compute(3, lambda: 'response', 1)
+        self.assertEqual('new', self.cache.get_or_compute(0, lambda: 'new', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""Render the retrospective items for Slack."""
+
+import collections
+
+# A section of the list of items: its title, the name of its items in the review button, and the
+# color of its attachments.
+_Section = collections.namedtuple('_Section', ('title', 'review_name', 'color'))
+# The sections in the order they are shown.
+_SECTIONS = (
+    _Section('Good', 'Good', 'good'),
+    _Section('Bad', 'Bad', 'danger'),
+    _Section('Try', 'Try', 'warning'),
+    _Section('Try We Committed To', 'Completed Try', 'warning'),
+)
+_GOOD_SECTION, _BAD_SECTION, _TRY_TO_REVIEW_SECTION, _TRY_TO_COMPLETE_SECTION = range(
+    len(_SECTIONS))
+
+# An item parsed from its record, with the index of its section in _SECTIONS.
+Item = collections.namedtuple(
+    'Item', ('id', 'category', 'object', 'committed', 'completed', 'reviewed', 'section'))
+
+
+def parse_item(record):
+    """Parse the record of an item, as read from the storage."""
+
+    fields = record['fields']
+    category = fields.get('Category')
+    committed = bool(fields.get('Committed ?'))
+    if category == 'good':
+        section = _GOOD_SECTION
+    elif category == 'bad':
+        section = _BAD_SECTION
+    elif committed:
+        section = _TRY_TO_COMPLETE_SECTION
+    else:
+        section = _TRY_TO_REVIEW_SECTION
+    return Item(
+        id=record['id'], category=category, object=fields.get('Object'), committed=committed,
+        completed=bool(fields.get('Completed At')), reviewed=bool(fields.get('Reviewed At')),
+        section=section)
+
+
+def get_attachments(records, show_review):
+    """Get the Slack message attachments to show items by section, with their actions.
+
+    Args:
+        records: the records of the items, in the order to show them in each section.
+        show_review: whether to add a button to mark the items of each section as reviewed.
+    """
+
+    items_by_section = [[] for unused_section in _SECTIONS]
+    for record in records:
+        item = parse_item(record)
+        items_by_section[item.section].append(item)
+
+    attachments = []
+    for section_index, items in enumerate(items_by_section):
+        if not items:
+            continue
+        section = _SECTIONS[section_index]
+        attachments.append({'title': section.title, 'color': section.color})
+        attachments.extend(_get_item_attachment(item) for item in items)
+        callback_ids = [
+            item.id for item in items
+            if section_index != _TRY_TO_COMPLETE_SECTION or item.completed]
+        if not show_review or not callback_ids:
+            continue
+        attachments.append({
+            'callback_id': ','.join(callback_ids),
+            'attachment_type': 'default',
+            'actions': [{
+                'name': 'new',
+                'text': f'✅ Mark {section.review_name.lower()} items as read',
+                'type': 'button',
+                'value': section.review_name,
+            }],
+        })
+    return attachments
+
+
+def get_item_attachment(record, show_emoji_and_no_actions=False):
+    """Generates how the retrospective item will be shown in Slack.
+
+    Use show_emoji_and_no_actions to show the new state of the items without allowing more
+    actions on it.
+    """
+
+    return _get_item_attachment(parse_item(record), show_emoji_and_no_actions)
+
+
+def _get_item_attachment(item, show_emoji_and_no_actions=False):
+    emoji = ''
+    actions = []
+
+    if item.category == 'try':
+        if item.completed:
+            # Nothing more to do if it's completed.
+            emoji = '✅ '
+        elif item.committed:
+            # If the team committed to do it, it's now time to do it.
+            emoji = '💪 '
+            actions = [{
+                'name': 'complete',
+                'text': '✅ Mark as complete',
+                'type': 'button',
+                'value': '1',
+            }]
+        else:
+            # If it's not committed, the team can decide to commit to do it.
+            actions = [{
+                'name': 'commit',
+                'text': '💪 Commit to do it',
+                'type': 'button',
+                'value': '1',
+            }]
+
+    if show_emoji_and_no_actions:
+        actions = []
+    else:
+        emoji = ''
+
+    attachment = {
+        'text': emoji + item.object,
+        'color': _SECTIONS[item.section].color,
+    }
+    if actions:
+        attachment.update({
+            'callback_id': item.id,
+            'attachment_type': 'default',
+            'actions': actions,
+        })
+    return attachment
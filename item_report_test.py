@@ -0,0 +1,54 @@
+"""Unit tests for the item_report module."""
+
+import unittest
+
+import item_report
+
+
+def _record(item_id, category, item_object, **fields):
+    return {'id': item_id, 'fields': dict(fields, Category=category, Object=item_object)}
+
+
+class ItemReportTestCase(unittest.TestCase):
+    """Unit tests for the rendering of items."""
+
+    def test_parse_item(self):
+        """Items are parsed with their section."""
+
+        item = item_report.parse_item(_record(
+            'rec1', 'try', 'More coffee', **{'Committed ?': True, 'Completed At': '2018-10-17'}))
+
+        self.assertEqual(
+            item_report.Item(
+                id='rec1', category='try', object='More coffee', committed=True,
+                completed=True, reviewed=False, section=3),
+            item)
+
+    def test_sections(self):
+        """Items are shown by section, in their order within each section."""
+
+        attachments = item_report.get_attachments([
+            _record('rec1', 'try', 'Committed', **{'Committed ?': True}),
+            _record('rec2', 'bad', 'Rain'),
+            _record('rec3', 'try', 'New'),
+            _record('rec4', 'good', 'Sun'),
+            _record('rec5', 'bad', 'Wind'),
+            _record('rec6', 'try', 'Done', **{'Committed ?': True, 'Completed At': '2018-10-17'}),
+        ], show_review=True)
+
+        self.assertEqual(
+            ['Good', 'Sun', 'rec4',
+             'Bad', 'Rain', 'Wind', 'rec2,rec5',
+             'Try', 'New', 'rec3',
+             'Try We Committed To', 'Committed', 'Done', 'rec6'],
+            [attachment.get('title') or attachment.get('text') or attachment['callback_id']
+             for attachment in attachments])
+        self.assertEqual(
+            'Completed Try', attachments[-1]['actions'][0]['value'])
+        self.assertEqual(
+            ['good', 'good', 'danger', 'danger', 'danger'],
+            [attachment['color'] for attachment in attachments[:6] if 'color' in attachment])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,14 @@ find -name "*.py" | grep -v _pb2.py$ | xargs pycodestyle --config="$DIRNAME/.pyc
 echo "Running pylint..."
 find -name "*.py" | grep -v _pb2.py$ | xargs pylint --load-plugins pylint_quotes || EXIT=$?
 
+echo "Measuring import time..."
+python -c 'import time; start = time.monotonic(); import slack_retro_bot_to_airtable; print("Imported in {:.3f}s".format(time.monotonic() - start))' || EXIT=$?
+
 echo "Running tests..."
 nosetests $@ || EXIT=$?
 
+# Only reported: their times depend on the machine.
+echo "Running benchmarks..."
+python slack_retro_bot_to_airtable_benchmark.py || echo "Some benchmarks are behind their baselines."
+
 exit $EXIT
@@ -0,0 +1,155 @@
+"""Render the moods of the team, as sent to Typeform, for Slack."""
+
+import collections
+import logging
+import textwrap
+
+_MOOD_REPORT_HEADER = ':mag: Dear team, here is the weekly check in of this week :mag_right:\n\n'
+_MOOD_SECTION_TEMPLATE = textwrap.dedent('''\
+    *{name}*
+    • _Feeling_
+    {feelings}{feeling_free_text}
+    • _Work at Bayes_
+    {work_status}{work_status_free_text}
+
+    ''')
+_MOOD_TREND_HEADER = ':chart_with_upwards_trend: How the team felt over the last sprints\n\n'
+_MOOD_TREND_SECTION_TEMPLATE = textwrap.dedent('''\
+    *{sprint}* ({responses} responses)
+    • _Feeling_ {feelings}
+    • _Work at Bayes_ {work_status}
+
+    ''')
+
+_MOOD_EMOJIS = {
+    "I'm super happy and energized": ':star-struck:',
+    "I'm happy": ':hugging_face:',
+    "I'm doing well": ':relaxed:',
+    "I'm ok": ':no_mouth:',
+    "I'm ok (not much to say)": ':no_mouth:',
+    "I don't know": ':face_with_rolling_eyes:',
+    "I'm a bit unhappy": ':confused:',
+    "I'm annoyed": ':triumph:',
+    "I'm not doing well": ':white_frowning_face:',
+    "I'm feeling super down": ':cry:',
+    "I'm worried": ':fearful:',
+    "I'm super upset": ':face_with_symbols_on_mouth:',
+    "I'm tired": ':persevere:',
+    'I feel inspired': ':star-struck:',
+    "I'm feeling very productive": ':muscle:',
+    'I feel excited': ':stuck_out_tongue:',
+    "I'm doing a good job": ':relaxed:',
+    'I feel lost': ':thinking_face:',
+    "I'm bored": ':sleeping:',
+    "I'm blocked": ':hand:',
+    'I am quite productive': ':nerd_face:',
+    'There is too much on my plate': ':exploding_head:',
+    "I don't think I am working on the right thing": ':face_with_monocle:',
+    "I don't feel focused": ':zany_face:',
+}
+
+# A mood parsed from its record: the name of the person, the sentences they picked for their
+# feeling and their work status, and the free texts.
+MoodEntry = collections.namedtuple('MoodEntry', (
+    'name', 'feelings', 'feeling_free_text', 'work_status', 'work_status_free_text'))
+
+
+def iterate_messages(moods, max_length):
+    """Iterate over the messages of the mood report, each one shorter than max_length.
+
+    Messages are only split between people, unless a person's section is too long by itself. Use
+    None for max_length to get the whole report in one message.
+    """
+
+    return iterate_section_messages((format_section(record) for record in moods), max_length)
+
+
+def iterate_section_messages(sections, max_length):
+    """Iterate over the messages of a mood report made of sections formatted beforehand."""
+
+    message = _MOOD_REPORT_HEADER
+    has_sections = False
+    for section in sections:
+        has_sections = True
+        if max_length and len(message) + len(section) > max_length:
+            yield message
+            message = ''
+            while len(section) > max_length:
+                yield section[:max_length]
+                section = section[max_length:]
+        message += section
+    if not has_sections:
+        yield 'No mood items for this week yet.'
+        return
+    if message:
+        yield message
+
+
+def parse_mood(record):
+    """Parse the record of a mood, as read from the storage."""
+
+    fields = record['fields']
+    return MoodEntry(
+        name=fields.get('Name'),
+        feelings=_split_sentences(fields.get('How are you feeling at Bayes', '')),
+        feeling_free_text=fields.get('Feeling at bayes free text', ''),
+        work_status=_split_sentences(fields.get('How is your work going', '')),
+        work_status_free_text=fields.get('How is your work going free text', ''))
+
+
+def _split_sentences(sentences):
+    return tuple(sentences.split(', \n'))
+
+
+def format_section(record):
+    """Format the section of the mood report for a single person, from the record of their mood."""
+
+    mood = parse_mood(record)
+    feelings = '\n'.join(_with_emoji_prefix(feeling) for feeling in mood.feelings)
+    if not feelings:
+        feelings = '\t_No feeling emojis selected_'
+    feeling_free_text = mood.feeling_free_text
+    if feeling_free_text:
+        feeling_free_text = '\n> ' + feeling_free_text
+    work_status = '\n'.join(_with_emoji_prefix(status) for status in mood.work_status)
+    if not work_status:
+        work_status = '\t_No work status emojis selected_'
+    work_status_free_text = mood.work_status_free_text
+    if work_status_free_text:
+        work_status_free_text = '\n> ' + work_status_free_text
+    return _MOOD_SECTION_TEMPLATE.format(
+        name=mood.name,
+        feelings=feelings, feeling_free_text=feeling_free_text,
+        work_status=work_status, work_status_free_text=work_status_free_text)
+
+
+def format_trend(aggregates):
+    """Format the aggregated moods of the last sprints, from the oldest to the newest."""
+
+    return _MOOD_TREND_HEADER + ''.join(
+        _MOOD_TREND_SECTION_TEMPLATE.format(
+            sprint=aggregate.sprint, responses=aggregate.responses,
+            feelings=_format_sentence_counts(aggregate.feelings) or '_None_',
+            work_status=_format_sentence_counts(aggregate.work_status) or '_None_')
+        for aggregate in aggregates)
+
+
+def _format_sentence_counts(counts):
+    """Format the counts of mood sentences as emojis, the most frequent first."""
+
+    counts_by_emoji = collections.Counter()
+    for sentence, count in counts.items():
+        counts_by_emoji[_MOOD_EMOJIS.get(sentence, '"{}"'.format(sentence))] += count
+    return ' '.join(
+        '{} {}'.format(emoji, count)
+        for emoji, count in sorted(counts_by_emoji.items(), key=lambda item: (-item[1], item[0])))
+
+
+def _with_emoji_prefix(sentence):
+    """Prepends with an emoji if one is found."""
+    try:
+        emoji = _MOOD_EMOJIS[sentence]
+    except KeyError:
+        logging.warning('Missing an emoji for sentence "%s".', sentence)
+        return sentence
+    return f'{emoji} {sentence}'
@@ -0,0 +1,86 @@
+"""The sections of the weekly mood report, formatted as the moods are submitted.
+
+The sections are kept in a local SQLite database, so that the weekly report only joins them
+instead of reading and formatting all the moods of the week. They only cover the moods received
+by the bot's webhook, and are best effort: the report reads the moods again if the IDs of their
+records are not exactly the ones of the moods created in the week.
+"""
+
+import collections
+import datetime
+import logging
+import sqlite3
+import threading
+
+import request_timing
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sections (
+        token TEXT PRIMARY KEY,
+        record_id TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        section TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sections_by_date ON sections (created_at);
+'''
+# The report covers the moods of the last week, as the "Current View" of the Moods table.
+_CURRENT_DAYS = 7
+
+
+def get_week_start():
+    """Get the start of the week covered by the report, as an ISO 8601 time in UTC."""
+
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=_CURRENT_DAYS)
+    return since.isoformat(timespec='milliseconds') + 'Z'
+
+
+class MoodSections(object):
+    """The formatted sections of the moods of a tenant, by submission."""
+
+    def __init__(self, path):
+        # The connection is shared by the threads of the container, one query at a time.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def _query(self, query, params=()):
+        with request_timing.span('mood-sections'), self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def close(self):
+        """Close the database, once the sections are dropped."""
+
+        with self._lock:
+            self._connection.close()
+
+    def has_submission(self, token):
+        """Whether the section of a submission was already added, e.g. for a retried webhook."""
+
+        return bool(self._query('SELECT 1 FROM sections WHERE token = ?', (token,)))
+
+    def add_section(self, token, record_id, created_at, section):
+        """Add the section of a submitted mood, and forget the ones of the previous weeks."""
+
+        try:
+            with request_timing.span('mood-sections'), self._lock, self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO sections (token, record_id, created_at, section) '
+                    'VALUES (?, ?, ?, ?)', (token, record_id, created_at, section))
+                self._connection.execute(
+                    'DELETE FROM sections WHERE created_at < ?', (get_week_start(),))
+        except sqlite3.Error as error:
+            logging.warning('Could not add the section of a mood: %s', error)
+
+    def get_sections(self, since):
+        """Get the sections of the moods created since a time, in the order they were submitted.
+
+        Returns:
+            a dict of the sections keyed by the IDs of the records of their moods.
+        """
+
+        return collections.OrderedDict(
+            (row['record_id'], row['section']) for row in self._query(
+                'SELECT record_id, section FROM sections WHERE created_at >= ? '
+                'ORDER BY created_at, rowid', (since,)))
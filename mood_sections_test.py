@@ -0,0 +1,46 @@
+"""Unit tests for the mood_sections module."""
+
+import datetime
+import unittest
+
+import mood_sections
+
+
+def _days_ago(days):
+    return (datetime.datetime.utcnow() - datetime.timedelta(days=days)).isoformat() + 'Z'
+
+
+class MoodSectionsTestCase(unittest.TestCase):
+    """Unit tests for the MoodSections class."""
+
+    def setUp(self):
+        super(MoodSectionsTestCase, self).setUp()
+        self.sections = mood_sections.MoodSections(':memory:')
+
+    def test_last_week(self):
+        """Only the sections of the last week are kept, in the order of submission."""
+
+        self.sections.add_section('token1', 'rec1', _days_ago(10), 'Old\n')
+        self.sections.add_section('token2', 'rec2', _days_ago(1), 'Pascal\n')
+        self.sections.add_section('token3', 'rec3', _days_ago(2), 'Cyrille\n')
+
+        self.assertEqual(
+            [('rec3', 'Cyrille\n'), ('rec2', 'Pascal\n')],
+            list(self.sections.get_sections(mood_sections.get_week_start()).items()))
+        self.assertEqual(['rec2'], list(self.sections.get_sections(_days_ago(1.5))))
+        self.assertFalse(self.sections.has_submission('token1'))
+        self.assertTrue(self.sections.has_submission('token2'))
+
+    def test_same_submission(self):
+        """A submission that is added again replaces its section."""
+
+        self.sections.add_section('token1', 'rec1', _days_ago(1), 'Pascal\n')
+        self.sections.add_section('token1', 'rec1', _days_ago(1), 'Pascal again\n')
+
+        self.assertEqual(
+            ['Pascal again\n'],
+            list(self.sections.get_sections(mood_sections.get_week_start()).values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""Measure where the time goes while handling a request.
+
+The time spent in each phase (Airtable reads and writes, Slack posts, rendering) is added up in
+spans, the remote calls are counted, and the maximum of some values, e.g. queue depths, is kept.
+When the request is done, all of this is logged as a single JSON line, so that it can be read with
+`zappa tail`, and the spans can be sent back as a Server-Timing HTTP header.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+_CURRENT = threading.local()
+
+
+class Timings(object):
+    """Spans and counters of a single request."""
+
+    def __init__(self, name):
+        self.name = name
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self.spans = collections.OrderedDict()
+        self.remote_calls = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.max_values = {}
+
+    def add_span(self, name, seconds):
+        """Add some time spent in the given phase."""
+
+        with self._lock:
+            duration, count = self.spans.get(name, (0, 0))
+            self.spans[name] = (duration + seconds, count + 1)
+
+    def add_remote_call(self, service, bytes_sent=0, bytes_received=0):
+        """Count a call to a remote service."""
+
+        with self._lock:
+            self.remote_calls[service] += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def record_max(self, name, value):
+        """Keep the maximum of a value observed during the request."""
+
+        with self._lock:
+            self.max_values[name] = max(value, self.max_values.get(name, value))
+
+    def get_total_seconds(self):
+        """Time spent since the start of the request."""
+
+        return time.monotonic() - self._start
+
+    def as_dict(self):
+        """All the measures, as a dict ready to be logged."""
+
+        with self._lock:
+            return {
+                'name': self.name,
+                'total_ms': round(self.get_total_seconds() * 1000, 1),
+                'spans_ms': {
+                    name: round(duration * 1000, 1) for name, (duration, unused_count)
+                    in self.spans.items()},
+                'remote_calls': dict(self.remote_calls),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'max_values': dict(self.max_values),
+            }
+
+    def get_server_timing_header(self):
+        """Format the spans for a Server-Timing HTTP header."""
+
+        with self._lock:
+            metrics = [
+                '{};dur={:.1f};desc="{} calls"'.format(name, duration * 1000, count)
+                for name, (duration, count) in self.spans.items()]
+        metrics.append('total;dur={:.1f}'.format(self.get_total_seconds() * 1000))
+        return ', '.join(metrics)
+
+
+def start(name):
+    """Start measuring a new request in the current thread."""
+
+    _CURRENT.timings = Timings(name)
+    return _CURRENT.timings
+
+
+def stop():
+    """Stop measuring the current request, and log its measures."""
+
+    timings = current()
+    if not timings:
+        return None
+    _CURRENT.timings = None
+    logging.info('Request timings: %s', json.dumps(timings.as_dict(), sort_keys=True))
+    return timings
+
+
+def current():
+    """The measures of the request handled by the current thread, if any."""
+
+    return getattr(_CURRENT, 'timings', None)
+
+
+def run_with(timings, func, *args, **kwargs):
+    """Run a function in another thread, counting its measures in the given request."""
+
+    _CURRENT.timings = timings
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _CURRENT.timings = None
+
+
+@contextlib.contextmanager
+def span(name):
+    """Measure the time spent in a block of code."""
+
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        timings = current()
+        if timings:
+            timings.add_span(name, time.monotonic() - start_time)
+
+
+def add_remote_call(service, bytes_sent=0, bytes_received=0):
+    """Count a call to a remote service in the current request."""
+
+    timings = current()
+    if timings:
+        timings.add_remote_call(service, bytes_sent, bytes_received)
+
+
+def record_max(name, value):
+    """Keep the maximum of a value observed during the current request."""
+
+    timings = current()
+    if timings:
+        timings.record_max(name, value)
+
+
+def instrumented(func):
+    """Measure a function that is run out of any request, e.g. a scheduled or async task."""
+
+    @functools.wraps(func)
+    def _instrumented(*args, **kwargs):
+        if current():
+            # Already measured as part of a request.
+            return func(*args, **kwargs)
+        start(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stop()
+
+    return _instrumented
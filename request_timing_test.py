@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Test the measures of where the time goes while handling a request."""
+
+from concurrent import futures
+import json
+import unittest
+
+import request_timing
+
+
+class RequestTimingTest(unittest.TestCase):
+    """Test the request timings."""
+
+    def tearDown(self):
+        request_timing.stop()
+        super(RequestTimingTest, self).tearDown()
+
+    def test_spans(self):
+        """Time spent in the same phase is added up."""
+
+        timings = request_timing.start('test')
+        with request_timing.span('airtable-read'):
+            pass
+        with request_timing.span('render'):
+            pass
+        with request_timing.span('airtable-read'):
+            pass
+
+        self.assertEqual(['airtable-read', 'render'], list(timings.spans))
+        self.assertEqual(2, timings.spans['airtable-read'][1])
+        self.assertRegex(
+            timings.get_server_timing_header(),
+            r'^airtable-read;dur=[0-9.]+;desc="2 calls", render;dur=[0-9.]+;desc="1 calls", '
+            r'total;dur=[0-9.]+$')
+
+    def test_no_request(self):
+        """Measures out of a request are ignored."""
+
+        with request_timing.span('render'):
+            request_timing.add_remote_call('slack', 10, 20)
+        self.assertIsNone(request_timing.current())
+
+    def test_other_threads(self):
+        """Measures from other threads can be added to the request."""
+
+        timings = request_timing.start('test')
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(
+                lambda unused_index: request_timing.run_with(
+                    timings, request_timing.add_remote_call, 'airtable', 10, 100),
+                range(5)))
+
+        self.assertEqual({'airtable': 5}, timings.remote_calls)
+        self.assertEqual(50, timings.bytes_sent)
+        self.assertEqual(500, timings.bytes_received)
+
+    def test_instrumented(self):
+        """Functions run out of a request are measured on their own."""
+
+        @request_timing.instrumented
+        def _send_report():
+            request_timing.add_remote_call('slack')
+            return 'sent'
+
+        with self.assertLogs(level='INFO') as logs:
+            self.assertEqual('sent', _send_report())
+
+        self.assertEqual(1, len(logs.output), msg=logs.output)
+        timings = json.loads(logs.output[0].split('Request timings: ', 1)[1])
+        self.assertEqual('_send_report', timings['name'])
+        self.assertEqual({'slack': 1}, timings['remote_calls'])
+        self.assertIsNone(request_timing.current())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+"""Export all the retrospective items or moods to a file, e.g. for an analytics warehouse.
+
+The records are read page by page in the order of their creation time, and written as they come
+as JSON lines or CSV rows, so that the memory used does not grow with the history. The progress
+is saved in a cursor file next to the output: an export that was interrupted resumes where it
+stopped when it is run again with the same arguments. A lock file next to the output prevents two
+exports from writing the same file at once.
+
+To export from the base or database set in the env variables of the bot:
+    python retro_export.py Items items.jsonl
+    python retro_export.py Moods moods.csv --format csv --since 2018-10-01T00:00:00.000Z
+"""
+
+import argparse
+import csv
+import datetime
+import fcntl
+import json
+import logging
+import os
+
+import storage
+import tenants
+
+FORMATS = ('jsonl', 'csv')
+# How often the progress is saved, in records.
+_CURSOR_INTERVAL = 500
+# The formats accepted for the time to export the records since, from a day to a millisecond.
+_SINCE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def validate_since(since):
+    """Check the time to export the records since, an ISO 8601 time in UTC or an empty string.
+
+    Returns:
+        the time, unchanged.
+    Raises:
+        ValueError: if it is not such a time.
+    """
+
+    if not since:
+        return since
+    for since_format in _SINCE_FORMATS:
+        try:
+            datetime.datetime.strptime(since, since_format)
+        except ValueError:
+            continue
+        return since
+    raise ValueError('"{}" is not an ISO time in UTC, e.g. 2018-10-01T00:00:00.000Z.'.format(since))
+
+
+def get_cursor_path(output_path):
+    """Get the path of the file keeping the progress of an export."""
+
+    return output_path + '.cursor'
+
+
+def _read_cursor(cursor_path):
+    try:
+        with open(cursor_path, encoding='utf-8') as cursor_file:
+            return json.load(cursor_file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_cursor(cursor_path, cursor):
+    # Replace the cursor at once, so that it is never left half written.
+    with open(cursor_path + '.tmp', 'w', encoding='utf-8') as cursor_file:
+        json.dump(cursor, cursor_file)
+    os.replace(cursor_path + '.tmp', cursor_path)
+
+
+def _create_writer(output, table, output_format, write_header):
+    if output_format == 'jsonl':
+        return lambda record: output.write(
+            json.dumps(record, ensure_ascii=False, sort_keys=True) + '\n')
+    writer = csv.DictWriter(
+        output, ('id',) + storage.TABLE_FIELDS[table], extrasaction='ignore')
+    if write_header:
+        writer.writeheader()
+    return lambda record: writer.writerow(dict(record['fields'], id=record['id']))
+
+
+def export(retro_storage, table, output_path, output_format='jsonl', since=''):
+    """Export the records of a table to a file, resuming the previous export if it was interrupted.
+
+    Args:
+        retro_storage: the storage to read the records from.
+        table: the name of the table, one of storage.TABLE_FIELDS.
+        output_path: the path of the file to write.
+        output_format: the format of the file, one of FORMATS.
+        since: an ISO 8601 time in UTC to only export the records created at or after it, e.g. the
+            last creation time returned by the previous export, or an empty string for all.
+    Returns:
+        the number of exported records, and the creation time of the last one.
+    Raises:
+        ValueError: if the arguments are wrong, or if another export to the same file is running or
+            was interrupted.
+    """
+
+    if table not in storage.TABLE_FIELDS:
+        raise ValueError('Unknown table "{}".'.format(table))
+    if output_format not in FORMATS:
+        raise ValueError('Unknown format "{}".'.format(output_format))
+    validate_since(since)
+    # The lock is released when the file is closed, even if the process is killed.
+    with open(output_path + '.lock', 'a', encoding='utf-8') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as error:
+            raise ValueError('Another export to "{}" is running.'.format(output_path)) from error
+        return _export(retro_storage, table, output_path, output_format, since)
+
+
+def _export(retro_storage, table, output_path, output_format, since):
+    cursor_path = get_cursor_path(output_path)
+    cursor = _read_cursor(cursor_path)
+    if cursor and (cursor['table'], cursor['format'], cursor['since']) != (
+            table, output_format, since):
+        raise ValueError('Another export to "{}" was interrupted, use other arguments or files.'
+                         .format(output_path))
+    if not cursor:
+        cursor = {
+            'table': table, 'format': output_format, 'since': since,
+            'count': 0, 'offset': 0, 'created_at': None, 'ids': [],
+        }
+    # Records created at the same time as the last saved one might have been exported already.
+    exported_ids = set(cursor['ids'])
+
+    with open(output_path, 'r+' if cursor['offset'] else 'w', encoding='utf-8', newline='') \
+            as output:
+        # Drop what was written after the cursor was saved: it will be written again.
+        output.seek(cursor['offset'])
+        output.truncate()
+        write = _create_writer(output, table, output_format, write_header=not cursor['offset'])
+        records = retro_storage.iterate_records_created_since(
+            table, since if cursor['created_at'] is None else cursor['created_at'])
+        for record in records:
+            if record['id'] in exported_ids:
+                continue
+            write(record)
+            created_at = record['fields'].get('Created At', '')
+            if created_at != cursor['created_at']:
+                cursor['created_at'] = created_at
+                cursor['ids'] = []
+            cursor['ids'].append(record['id'])
+            cursor['count'] += 1
+            if not cursor['count'] % _CURSOR_INTERVAL:
+                output.flush()
+                cursor['offset'] = output.tell()
+                _write_cursor(cursor_path, cursor)
+
+    if os.path.exists(cursor_path):
+        os.remove(cursor_path)
+    return cursor['count'], cursor['created_at']
+
+
+def main(string_args=None):
+    """Export a table of a storage set in the env variables of the bot."""
+
+    parser = argparse.ArgumentParser(description='Export the retrospective items or moods.')
+    parser.add_argument('table', choices=list(storage.TABLE_FIELDS))
+    parser.add_argument('output', help='Path of the file to write.')
+    parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    parser.add_argument(
+        '--since', default='', type=validate_since,
+        help='Only export the records created at or after this time.')
+    parser.add_argument(
+        '--tenant', default=tenants.DEFAULT_TENANT_ID,
+        help='ID of the tenant to export, see RETRO_TENANTS in the README.')
+    args = parser.parse_args(string_args)
+
+    logging.basicConfig(level=logging.INFO)
+    # Imported here, as the bot imports this module.
+    import slack_retro_bot_to_airtable  # pylint: disable=import-outside-toplevel
+    retro_storage = slack_retro_bot_to_airtable.get_storage(args.tenant)
+    count, last_created_at = export(retro_storage, args.table, args.output, args.format, args.since)
+    logging.info(
+        'Exported %d records to "%s", use --since %s for the next ones.',
+        count, args.output, last_created_at or args.since or '""')
+
+
+if __name__ == '__main__':
+    main()
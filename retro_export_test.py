@@ -0,0 +1,136 @@
+"""Unit tests for the retro_export module."""
+
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+import mock
+
+import retro_export
+import storage
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class ExportTestCase(unittest.TestCase):
+    """Unit tests for the export function."""
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.storage = storage.SqliteStorage(':memory:')
+        for index, created_at in enumerate((
+                '2018-10-09T10:00:00.000Z', '2018-10-10T10:00:00.000Z',
+                '2018-10-10T10:00:00.000Z', '2018-10-11T10:00:00.000Z',
+                '2018-10-12T10:00:00.000Z')):
+            self.storage.create_item({
+                'Category': 'good',
+                'Object': 'Item {}'.format(index),
+                'Created At': created_at,
+            })
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.output_path = os.path.join(folder.name, 'items.jsonl')
+
+    def _read_objects(self):
+        with open(self.output_path, encoding='utf-8') as output:
+            return [json.loads(line)['fields']['Object'] for line in output]
+
+    def test_jsonl(self):
+        """All the records are written as JSON lines."""
+
+        self.assertEqual(
+            (5, '2018-10-12T10:00:00.000Z'),
+            retro_export.export(self.storage, 'Items', self.output_path))
+
+        self.assertEqual(['Item {}'.format(index) for index in range(5)], self._read_objects())
+        self.assertFalse(os.path.exists(retro_export.get_cursor_path(self.output_path)))
+
+    def test_csv(self):
+        """Records are written as CSV rows with all the fields of their table."""
+
+        self.storage.create_mood({'Name': 'Pascal, "the cat"', 'Created At': '2018-10-17'})
+
+        retro_export.export(self.storage, 'Moods', self.output_path, output_format='csv')
+
+        with open(self.output_path, encoding='utf-8', newline='') as output:
+            rows = list(csv.DictReader(output))
+        self.assertEqual(1, len(rows))
+        self.assertEqual('Pascal, "the cat"', rows[0]['Name'])
+        self.assertEqual(['id'] + list(storage.TABLE_FIELDS['Moods']), list(rows[0]))
+
+    def test_since(self):
+        """Only the records created since a time are exported."""
+
+        self.assertEqual(
+            (2, '2018-10-12T10:00:00.000Z'),
+            retro_export.export(
+                self.storage, 'Items', self.output_path, since='2018-10-11T10:00:00.000Z'))
+
+        self.assertEqual(['Item 3', 'Item 4'], self._read_objects())
+
+    def test_invalid_since(self):
+        """The time to export the records since must be an ISO time."""
+
+        self.assertEqual('2018-10-11', retro_export.validate_since('2018-10-11'))
+        self.assertEqual(
+            '2018-10-11T10:00:00Z', retro_export.validate_since('2018-10-11T10:00:00Z'))
+        for since in ('yesterday', '2018-10-11") OR TRUE()', '2018-10-11T10:00:00+02:00'):
+            with self.assertRaises(ValueError, msg=since):
+                retro_export.export(self.storage, 'Items', self.output_path, since=since)
+        self.assertFalse(os.path.exists(self.output_path))
+
+    def test_running(self):
+        """Two exports cannot write the same file at once."""
+
+        iterate_records = self.storage.iterate_records_created_since
+
+        def _export_meanwhile(table, created_at):
+            with self.assertRaises(ValueError):
+                retro_export.export(self.storage, 'Items', self.output_path)
+            return iterate_records(table, created_at)
+
+        with mock.patch.object(
+                self.storage, 'iterate_records_created_since', side_effect=_export_meanwhile):
+            self.assertEqual(
+                (5, '2018-10-12T10:00:00.000Z'),
+                retro_export.export(self.storage, 'Items', self.output_path))
+
+    @mock.patch(retro_export.__name__ + '._CURSOR_INTERVAL', 2)
+    def test_resume(self):
+        """An interrupted export resumes after the last saved record, without duplicates."""
+
+        iterate_records = self.storage.iterate_records_created_since
+
+        def _interrupt_after_3_records(table, created_at):
+            for index, record in enumerate(iterate_records(table, created_at)):
+                if index == 3:
+                    raise _Interrupted()
+                yield record
+
+        with mock.patch.object(
+                self.storage, 'iterate_records_created_since',
+                side_effect=_interrupt_after_3_records):
+            with self.assertRaises(_Interrupted):
+                retro_export.export(self.storage, 'Items', self.output_path)
+        # The third record was written after the last save of the cursor.
+        self.assertEqual(['Item 0', 'Item 1', 'Item 2'], self._read_objects())
+
+        with self.assertRaises(ValueError):
+            retro_export.export(self.storage, 'Items', self.output_path, output_format='csv')
+        with mock.patch.object(
+                self.storage, 'iterate_records_created_since',
+                wraps=self.storage.iterate_records_created_since) as mock_iterate:
+            self.assertEqual(
+                (5, '2018-10-12T10:00:00.000Z'),
+                retro_export.export(self.storage, 'Items', self.output_path))
+
+        mock_iterate.assert_called_once_with('Items', '2018-10-10T10:00:00.000Z')
+        self.assertEqual(['Item {}'.format(index) for index in range(5)], self._read_objects())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+"""Import retrospective items from a CSV or JSON lines file, e.g. from another retrospective tool.
+
+The file is read as a stream and its items are created by batches, e.g. 10 per Airtable request
+under the rate limit of the base. The items are normalized as with the "/retro good" command, and
+those that are already in the current sprint, or earlier in the file, are skipped.
+
+Each row or line has the fields of an item: "Category" (good, bad or try) and "Object", and
+optionally "Creator", "Created At", "Committed ?", "Completed At" and "Reviewed At". Other fields,
+e.g. the "id" of an export, are ignored. Lines of a JSON lines file that are not JSON objects are
+reported with their line number and skipped as invalid.
+
+To import in the base or database set in the env variables of the bot:
+    python retro_import.py items.csv --dry-run
+    python retro_import.py items.jsonl
+"""
+
+import argparse
+import collections
+import csv
+import datetime
+import itertools
+import json
+import logging
+
+import airtable_client
+import storage
+import tenants
+
+FORMATS = ('jsonl', 'csv')
+_CATEGORIES = ('good', 'bad', 'try')
+# How many items are created between two progress reports.
+_CHUNK_SIZE = 100
+_TRUE_VALUES = ('1', 'true', 'yes', 'checked', 'x')
+
+# The counts of the rows of an import: read, created (or to create in a dry run), skipped as
+# duplicates, skipped as invalid, and that could not be created.
+ImportReport = collections.namedtuple(
+    'ImportReport', ('read', 'created', 'duplicates', 'invalid', 'failed'))
+
+
+def _iterate_json_rows(input_file):
+    """Iterate over the objects of a JSON lines file, with None for the invalid lines."""
+
+    for line_number, line in enumerate(input_file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            logging.warning('Line %d is not valid JSON: %s', line_number, error)
+            yield None
+            continue
+        if not isinstance(row, dict):
+            logging.warning('Line %d is not a JSON object.', line_number)
+            yield None
+            continue
+        yield row
+
+
+def _iterate_rows(input_file, input_format):
+    if input_format == 'csv':
+        return csv.DictReader(input_file)
+    return _iterate_json_rows(input_file)
+
+
+def _get_item_fields(row, now):
+    """Get the normalized fields of an item from a row, or None if it is not a valid item."""
+
+    category = (row.get('Category') or '').strip()
+    item_object = ' '.join((row.get('Object') or '').split())
+    if category.lower() not in _CATEGORIES or not item_object:
+        return None
+    category, item_object = storage.normalize_new_item(category, item_object)
+    fields = {
+        'Category': category,
+        'Object': item_object,
+        'Created At': row.get('Created At') or now,
+    }
+    for field in ('Creator', 'Completed At', 'Reviewed At'):
+        if row.get(field):
+            fields[field] = row[field]
+    committed = row.get('Committed ?')
+    if isinstance(committed, str):
+        committed = committed.strip().lower() in _TRUE_VALUES
+    if committed:
+        fields['Committed ?'] = True
+    return fields
+
+
+@airtable_client.background_priority()
+def import_items(retro_storage, input_file, input_format='csv', dry_run=False):
+    """Import the items of a file in a storage.
+
+    Its requests let the ones of the bot's commands go first.
+
+    Args:
+        retro_storage: the storage to create the items in.
+        input_file: the file to read, opened in text mode.
+        input_format: the format of the file, one of FORMATS.
+        dry_run: whether to only count the items, without creating them.
+    Returns:
+        an ImportReport.
+    """
+
+    if input_format not in FORMATS:
+        raise ValueError('Unknown format "{}".'.format(input_format))
+    now = datetime.datetime.utcnow().isoformat(timespec='milliseconds') + 'Z'
+    # The keys of the current items, built once instead of a query per item.
+    current_keys = {
+        storage.normalize_item_key(item['fields'].get('Category', ''), item['fields'].get(
+            'Object', ''))
+        for item in retro_storage.iterate_current_items()}
+    report = ImportReport(read=0, created=0, duplicates=0, invalid=0, failed=0)
+
+    rows = _iterate_rows(input_file, input_format)
+    while True:
+        chunk = list(itertools.islice(rows, _CHUNK_SIZE))
+        if not chunk:
+            return report
+        fields_list = []
+        for row in chunk:
+            fields = row and _get_item_fields(row, now)
+            if not fields:
+                report = report._replace(invalid=report.invalid + 1)
+                continue
+            if not fields.get('Reviewed At'):
+                # As with the bot, only the current items are checked for duplicates.
+                key = storage.normalize_item_key(fields['Category'], fields['Object'])
+                if key in current_keys:
+                    report = report._replace(duplicates=report.duplicates + 1)
+                    continue
+                current_keys.add(key)
+            fields_list.append(fields)
+
+        created_count = len(fields_list)
+        if fields_list and not dry_run:
+            created_count = sum(1 for record in retro_storage.create_items(fields_list) if record)
+        report = report._replace(
+            read=report.read + len(chunk), created=report.created + created_count,
+            failed=report.failed + len(fields_list) - created_count)
+        logging.info(
+            'Read %d rows: %d %s, %d duplicates, %d invalid, %d failed.', report.read,
+            report.created, 'to create' if dry_run else 'created', report.duplicates,
+            report.invalid, report.failed)
+
+
+def main(string_args=None):
+    """Import the items of a file in a storage set in the env variables of the bot."""
+
+    parser = argparse.ArgumentParser(description='Import retrospective items.')
+    parser.add_argument('input', help='Path of the file to read.')
+    parser.add_argument(
+        '--format', choices=FORMATS,
+        help='Format of the file, guessed from its extension by default.')
+    parser.add_argument(
+        '--dry-run', action='store_true', help='Only count the items that would be created.')
+    parser.add_argument(
+        '--tenant', default=tenants.DEFAULT_TENANT_ID,
+        help='ID of the tenant to import to, see RETRO_TENANTS in the README.')
+    args = parser.parse_args(string_args)
+
+    logging.basicConfig(level=logging.INFO)
+    # Imported here, as the bot checks its env variables when it is imported.
+    import slack_retro_bot_to_airtable  # pylint: disable=import-outside-toplevel
+    retro_storage = slack_retro_bot_to_airtable.get_storage(args.tenant)
+    input_format = args.format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    with open(args.input, encoding='utf-8', newline='') as input_file:
+        report = import_items(retro_storage, input_file, input_format, dry_run=args.dry_run)
+    logging.info('Done: %s', report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Unit tests for the retro_import module."""
+
+import io
+import json
+import unittest
+
+import mock
+
+import airtable_client
+import retro_import
+import storage
+
+
+class ImportTestCase(unittest.TestCase):
+    """Unit tests for the import_items function."""
+
+    def setUp(self):
+        super(ImportTestCase, self).setUp()
+        self.storage = storage.SqliteStorage(':memory:')
+        self.storage.create_item({'Category': 'try', 'Object': 'More coffee'})
+        self.storage.create_item({
+            'Category': 'good',
+            'Object': 'Reviewed',
+            'Reviewed At': '2018-10-10T10:00:00.000Z',
+        })
+
+    def _get_items(self):
+        return sorted(
+            (item['fields']['Category'], item['fields']['Object'])
+            for item in self.storage.iterate_current_items())
+
+    def test_csv(self):
+        """Items are normalized as with the bot, and other fields are ignored."""
+
+        input_file = io.StringIO(
+            'id,Category,Object,Creator,Committed ?\n'
+            'rec1,Good,the   retro bot,pascal,\n'
+            'rec2,TRY,ask for help,,checked\n')
+
+        self.assertEqual(
+            retro_import.ImportReport(read=2, created=2, duplicates=0, invalid=0, failed=0),
+            retro_import.import_items(self.storage, input_file, 'csv'))
+
+        self.assertEqual(
+            [('good', 'The retro bot'), ('try', 'Ask for help'), ('try', 'More coffee')],
+            self._get_items())
+        committed = [
+            item['fields']['Object'] for item in self.storage.iterate_current_items()
+            if item['fields'].get('Committed ?')]
+        self.assertEqual(['Ask for help'], committed)
+
+    def test_duplicates(self):
+        """Items already in the sprint, or earlier in the file, are skipped."""
+
+        input_file = io.StringIO('\n'.join(json.dumps(row) for row in (
+            {'Category': 'try', 'Object': 'more  COFFEE'},
+            {'Category': 'good', 'Object': 'Reviewed'},
+            {'Category': 'bad', 'Object': 'Meetings'},
+            {'Category': 'bad', 'Object': 'MEETINGS '},
+            {'Category': 'bad', 'Object': 'Old meetings', 'Reviewed At': '2018-10-10'},
+            {'Category': 'bad', 'Object': 'Old meetings', 'Reviewed At': '2018-10-10'},
+        )))
+
+        self.assertEqual(
+            retro_import.ImportReport(read=6, created=4, duplicates=2, invalid=0, failed=0),
+            retro_import.import_items(self.storage, input_file, 'jsonl'))
+
+        self.assertEqual(
+            [('bad', 'Meetings'), ('good', 'Reviewed'), ('try', 'More coffee')],
+            self._get_items())
+
+    def test_invalid(self):
+        """Rows without a known category or an object are skipped."""
+
+        input_file = io.StringIO(
+            'Category,Object\n'
+            'great,Pizzas\n'
+            'good,  \n'
+            'bad,Rain\n')
+
+        self.assertEqual(
+            retro_import.ImportReport(read=3, created=1, duplicates=0, invalid=2, failed=0),
+            retro_import.import_items(self.storage, input_file))
+
+    def test_invalid_json(self):
+        """Lines that are not JSON objects are reported and skipped."""
+
+        input_file = io.StringIO(
+            '{"Category": "good", "Object": "Pizzas"}\n'
+            '{"Category": "good",\n'
+            '["bad", "Rain"]\n'
+            '\n'
+            '{"Category": "bad", "Object": "Rain"}\n')
+
+        with self.assertLogs(level='WARNING') as logs:
+            report = retro_import.import_items(self.storage, input_file, 'jsonl')
+
+        self.assertEqual(
+            retro_import.ImportReport(read=4, created=2, duplicates=0, invalid=2, failed=0),
+            report)
+        self.assertEqual(
+            ['Line 2 is not valid JSON', 'Line 3 is not a JSON object.'],
+            [message.split(':')[2] for message in logs.output])
+
+    def test_background_priority(self):
+        """The items are imported with a background priority."""
+
+        priorities = []
+
+        def _create_items(fields_list):
+            priorities.append(airtable_client._get_priority())  # pylint: disable=protected-access
+            return [{'id': 'rec1'}] * len(fields_list)
+
+        with mock.patch.object(self.storage, 'create_items', side_effect=_create_items):
+            retro_import.import_items(self.storage, io.StringIO('Category,Object\ngood,Pizzas\n'))
+
+        self.assertEqual([airtable_client.BACKGROUND], priorities)
+
+    def test_dry_run(self):
+        """Nothing is created in a dry run."""
+
+        input_file = io.StringIO('Category,Object\ngood,Pizzas\ntry,More coffee\n')
+
+        self.assertEqual(
+            retro_import.ImportReport(read=2, created=1, duplicates=1, invalid=0, failed=0),
+            retro_import.import_items(self.storage, input_file, dry_run=True))
+
+        self.assertEqual([('try', 'More coffee')], self._get_items())
+
+    @mock.patch(retro_import.__name__ + '._CHUNK_SIZE', 2)
+    def test_batches(self):
+        """Items are created by chunks, and the failed ones are counted."""
+
+        input_file = io.StringIO(
+            'Category,Object\n' + ''.join('good,Item {}\n'.format(index) for index in range(5)))
+
+        with mock.patch.object(
+                self.storage, 'create_items',
+                side_effect=[[{'id': 'rec1'}, None], [{'id': 'rec3'}, {'id': 'rec4'}],
+                             [{'id': 'rec5'}]]) as mock_create_items:
+            self.assertEqual(
+                retro_import.ImportReport(read=5, created=4, duplicates=0, invalid=0, failed=1),
+                retro_import.import_items(self.storage, input_file))
+
+        self.assertEqual([2, 2, 1], [
+            len(call[0][0]) for call in mock_create_items.call_args_list])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""A full-text index of all the retrospective items, including the reviewed ones.
+
+The index is an inverted index in a local SQLite database: the words of each item's object point
+to the item, with its category and creator as facets to narrow a search. It is kept up to date
+incrementally: only the items created since the last indexed one are read from the storage, in
+the order of their creation.
+"""
+
+import re
+import sqlite3
+import threading
+import unicodedata
+
+import request_timing
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS indexed_items (
+        id TEXT PRIMARY KEY,
+        category TEXT NOT NULL,
+        object TEXT NOT NULL,
+        creator TEXT,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS indexed_items_by_date ON indexed_items (created_at);
+    CREATE TABLE IF NOT EXISTS postings (
+        word TEXT NOT NULL,
+        item_id TEXT NOT NULL,
+        PRIMARY KEY (word, item_id)
+    ) WITHOUT ROWID;
+    -- To replace the words of an item that is indexed again.
+    CREATE INDEX IF NOT EXISTS postings_by_item ON postings (item_id);
+'''
+# Items are indexed by transactions of this size, so that an interrupted catch up is not lost.
+_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    """Split a text in words to index or to search, ignoring case and accents."""
+
+    text = unicodedata.normalize('NFKD', text.lower())
+    return sorted({
+        word for word in re.findall(r'\w+', ''.join(
+            char for char in text if not unicodedata.combining(char)))})
+
+
+class SearchIndex(object):
+    """An inverted index of the retrospective items of a storage."""
+
+    def __init__(self, path):
+        # The connection is shared by the threads of the container, one query at a time.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # Held while catching up, so that concurrent searches do not read the same items twice.
+        self._update_lock = threading.Lock()
+        self._is_updated = False
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def _query(self, query, params=()):
+        with request_timing.span('search-index'), self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def close(self):
+        """Close the database, once the index is dropped."""
+
+        with self._lock:
+            self._connection.close()
+
+    def _get_last_created_at(self):
+        return self._query('SELECT MAX(created_at) FROM indexed_items')[0][0] or ''
+
+    def is_cold(self):
+        """Whether the index was never built: the first update reads all the items."""
+
+        return not self._is_updated and not self._get_last_created_at()
+
+    def update(self, item_storage):
+        """Index the items that were created in the storage since the last update.
+
+        Returns:
+            the number of items that were read from the storage.
+        """
+
+        with self._update_lock:
+            # Items created at the same time as the last indexed one are indexed again, so that
+            # none of them is missed.
+            records = item_storage.iterate_items_created_since(self._get_last_created_at())
+            count = 0
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= _BATCH_SIZE:
+                    self._index_records(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._index_records(batch)
+                count += len(batch)
+            self._is_updated = True
+            return count
+
+    def _index_records(self, records):
+        records = [record for record in records if record['fields'].get('Created At')]
+        with request_timing.span('search-index'), self._lock, self._connection:
+            self._connection.executemany(
+                'DELETE FROM postings WHERE item_id = ?', [(record['id'],) for record in records])
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO indexed_items (id, category, object, creator, created_at) '
+                'VALUES (?, ?, ?, ?, ?)', [
+                    (
+                        record['id'],
+                        record['fields'].get('Category', '').lower(),
+                        record['fields'].get('Object', ''),
+                        record['fields'].get('Creator'),
+                        record['fields']['Created At'],
+                    )
+                    for record in records])
+            self._connection.executemany(
+                'INSERT INTO postings (word, item_id) VALUES (?, ?)', [
+                    (word, record['id'])
+                    for record in records
+                    for word in tokenize(record['fields'].get('Object', ''))])
+
+    def search(self, text, category=None, creator=None, limit=20):
+        """Find the items that have all the words of a text in their object.
+
+        Args:
+            text: the words to look for, in any order.
+            category: only find the items of this category.
+            creator: only find the items created by this user name, ignoring case.
+            limit: the maximum number of items to return.
+        Returns:
+            a tuple with the most recent matching items as records, and the number of matching
+            items by category.
+        """
+
+        words = tokenize(text)
+        if not words:
+            return [], {}
+        conditions = ''
+        params = list(words)
+        if category:
+            conditions += ' AND item.category = ?'
+            params.append(category.lower())
+        if creator:
+            conditions += ' AND item.creator = ? COLLATE NOCASE'
+            params.append(creator)
+        params.append(len(words))
+        # The items that have all the words, using the postings of each word.
+        matches = (
+            'SELECT item.* FROM postings JOIN indexed_items AS item ON item.id = postings.item_id '
+            'WHERE postings.word IN ({}){} '
+            'GROUP BY postings.item_id HAVING COUNT(*) = ?').format(
+                ', '.join('?' * len(words)), conditions)
+
+        rows = self._query(
+            'SELECT * FROM ({}) ORDER BY created_at DESC LIMIT ?'.format(matches),
+            params + [limit])
+        counts = self._query(
+            'SELECT category, COUNT(*) AS count FROM ({}) GROUP BY category'.format(matches),
+            params)
+        return [_row_to_record(row) for row in rows], {
+            row['category']: row['count'] for row in counts}
+
+
+def _row_to_record(row):
+    fields = {
+        'Category': row['category'],
+        'Object': row['object'],
+        'Created At': row['created_at'],
+    }
+    if row['creator']:
+        fields['Creator'] = row['creator']
+    return {'id': row['id'], 'fields': fields}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Test the search index of the retrospective items."""
+
+import unittest
+
+import search_index
+import storage
+
+
+class SearchIndexTest(unittest.TestCase):
+    """Test the search index."""
+
+    def setUp(self):
+        super(SearchIndexTest, self).setUp()
+        self.storage = storage.SqliteStorage(':memory:')
+        self.index = search_index.SearchIndex(':memory:')
+
+    def _create_item(self, category, item_object, creator, created_at):
+        return self.storage.create_item({
+            'Category': category,
+            'Object': item_object,
+            'Creator': creator,
+            'Created At': created_at,
+        })
+
+    def _search(self, text, **kwargs):
+        return [item['fields']['Object'] for item in self.index.search(text, **kwargs)[0]]
+
+    def test_tokenize(self):
+        """Words are found whatever their case and accents."""
+
+        self.assertEqual(
+            ['cafe', 'etait', 'froid', 'le'],
+            search_index.tokenize('Le café était froid, le café!'))
+
+    def test_incremental_update(self):
+        """Only the items created since the last update are read again."""
+
+        self._create_item('good', 'The coffee', 'pascal', '2018-10-09T10:00:00.000Z')
+        self._create_item('bad', 'The tea', 'cyrille', '2018-10-10T10:00:00.000Z')
+        self.assertTrue(self.index.is_cold())
+        self.assertEqual(2, self.index.update(self.storage))
+        self.assertFalse(self.index.is_cold())
+
+        self._create_item('try', 'More coffee', 'pascal', '2018-10-17T10:00:00.000Z')
+        # The last indexed item is read again, in case others were created at the same time.
+        self.assertEqual(2, self.index.update(self.storage))
+
+        items, counts = self.index.search('coffee')
+        self.assertEqual(
+            ['More coffee', 'The coffee'], [item['fields']['Object'] for item in items])
+        self.assertEqual({'good': 1, 'try': 1}, counts)
+
+    def test_search(self):
+        """Items must have all the words, and match the facets."""
+
+        self._create_item('good', 'The coffee was great', 'pascal', '2018-10-09T10:00:00.000Z')
+        self._create_item('bad', 'The coffee was cold', 'Cyrille', '2018-10-10T10:00:00.000Z')
+        self._create_item('bad', 'Cold tea', 'cyrille', '2018-10-11T10:00:00.000Z')
+        self.index.update(self.storage)
+
+        self.assertEqual(['The coffee was cold'], self._search('COLD coffee'))
+        self.assertEqual(['Cold tea', 'The coffee was cold'], self._search('cold'))
+        self.assertEqual(['The coffee was great'], self._search('coffee', category='Good'))
+        self.assertEqual(['The coffee was cold'], self._search('coffee', creator='CYRILLE'))
+        self.assertEqual(['Cold tea'], self._search('cold', limit=1))
+        self.assertEqual([], self._search('chocolate'))
+        self.assertEqual([], self._search('!!!'))
+
+
+if __name__ == '__main__':
+    unittest.main()
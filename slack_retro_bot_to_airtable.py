@@ -1,99 +1,302 @@
 """Integration to send Slack messages when new code reviews are sent in Reviewable."""
 
+import asyncio
+import collections
+import functools
+import importlib
 import json
 import logging
 import os
 import re
 from datetime import datetime
-import textwrap
+import tempfile
+import time
 
-from itertools import groupby
-import requests
-
-from airtable import airtable
 from flask import abort, Flask, request, Response
-from zappa.async import task
+
+import airtable_client
+import async_io
+import idempotency
+import item_report
+import mood_report
+import mood_sections
+import request_timing
+import retro_export
+import search_index
+import sprint_stats
+import storage
+import tenants
+import typeform
+import unit_of_work
+import write_queue
 
 app = Flask(__name__)  # pylint: disable=invalid-name
+# The same app for an ASGI server, e.g. "uvicorn slack_retro_bot_to_airtable:asgi_app".
+asgi_app = async_io.AsgiAdapter(app)  # pylint: disable=invalid-name
+
+
+def _task(func):
+    """Same as zappa's @task decorator, but zappa is only imported when the task is run.
+
+    The zappa.async module imports boto3 which is slow, and only needed to run tasks.
+    """
+
+    @functools.wraps(func)
+    def _run_task(*args, **kwargs):
+        zappa_async = importlib.import_module('zappa.async')
+        return zappa_async.task(func)(*args, **kwargs)
+
+    # When the task is received, zappa runs it through this attribute.
+    _run_task.sync = request_timing.instrumented(func)
+    return _run_task
+
 
 _GOOD_CMDS = ('good',)
 _BAD_CMDS = ('bad',)
 _TRY_CMDS = ('try',)
 _MOOD_CMDS = ('mood',)
+_SEARCH_CMDS = ('search',)
+_STATS_CMDS = ('stats',)
+_EXPORT_CMDS = ('export',)
 _CATEGORY_CMDS = _GOOD_CMDS + _BAD_CMDS + _TRY_CMDS
 _NEW_CMDS = ('new',)
 _LIST_CMDS = ('list',)
 _HELP_CMDS = ('help', '?')
-_ALL_CMDS = _CATEGORY_CMDS + _NEW_CMDS + _LIST_CMDS + _MOOD_CMDS + _HELP_CMDS
-
-# We use an int as a first letter to sort the sections, it will be hidden later.
-_GOOD_TITLE = '1 Good'
-_BAD_TITLE = '2 Bad'
-_TRY_TO_REVIEW_TITLE = '3 Try'
-_TRY_TO_COMPLETE_TITLE = '4 Try We Committed To'
-_COLORS_BY_TITLE = {
-    _GOOD_TITLE: 'good',
-    _BAD_TITLE: 'danger',
-    _TRY_TO_REVIEW_TITLE: 'warning',
-    _TRY_TO_COMPLETE_TITLE: 'warning',
-}
+_ALL_CMDS = _CATEGORY_CMDS + _NEW_CMDS + _LIST_CMDS + _MOOD_CMDS + _SEARCH_CMDS + _STATS_CMDS + \
+    _EXPORT_CMDS + _HELP_CMDS
+# Commands that wait for Airtable before responding.
+_AIRTABLE_CMDS = _CATEGORY_CMDS + _LIST_CMDS + _MOOD_CMDS + _SEARCH_CMDS
 
 _BOT_NAME = 'Retrospective Bot'
 
 _SLACK_RETRO_TOKEN = os.getenv('SLACK_RETRO_TOKEN')
+# Slack gives up on a command after 3 seconds. Commands that are expected to take longer than
+# their latency budget, e.g. "list=1.5,mood=0", get an immediate answer and the actual response
+# is sent later. Commands without a budget are always answered synchronously.
+_SLACK_COMMAND_LATENCY_BUDGETS = os.getenv('SLACK_COMMAND_LATENCY_BUDGETS', '')
 _SLACK_WEBHOOK_URL = os.getenv('SLACK_WEBHOOK_URL')
 _AIRTABLE_RETRO_BASE_ID = os.getenv('AIRTABLE_RETRO_BASE_ID')
 _AIRTABLE_RETRO_API_KEY = os.getenv('AIRTABLE_RETRO_API_KEY')
-_AIRTABLE_RETRO_ITEMS_TABLE_ID = 'Items'
-_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW = 'Current View'
-_AIRTABLE_MOOD_ITEMS_TABLE_ID = 'Moods'
-_AIRTABLE_MOOD_ITEMS_CURRENT_VIEW = 'Current View'
-
-_MOOD_EMOJIS = {
-    "I'm super happy and energized": ':star-struck:',
-    "I'm happy": ':hugging_face:',
-    "I'm doing well": ':relaxed:',
-    "I'm ok": ':no_mouth:',
-    "I'm ok (not much to say)": ':no_mouth:',
-    "I don't know": ':face_with_rolling_eyes:',
-    "I'm a bit unhappy": ':confused:',
-    "I'm annoyed": ':triumph:',
-    "I'm not doing well": ':white_frowning_face:',
-    "I'm feeling super down": ':cry:',
-    "I'm worried": ':fearful:',
-    "I'm super upset": ':face_with_symbols_on_mouth:',
-    "I'm tired": ':persevere:',
-    'I feel inspired': ':star-struck:',
-    "I'm feeling very productive": ':muscle:',
-    'I feel excited': ':stuck_out_tongue:',
-    "I'm doing a good job": ':relaxed:',
-    'I feel lost': ':thinking_face:',
-    "I'm bored": ':sleeping:',
-    "I'm blocked": ':hand:',
-    'I am quite productive': ':nerd_face:',
-    'There is too much on my plate': ':exploding_head:',
-    "I don't think I am working on the right thing": ':face_with_monocle:',
-    "I don't feel focused": ':zany_face:',
-}
+# A local SQLite database to use instead of Airtable.
+_RETRO_SQLITE_PATH = os.getenv('RETRO_SQLITE_PATH')
+# A folder shared by the containers to queue the new items before they are created in Airtable,
+# see README.
+_RETRO_WRITE_QUEUE_FOLDER = os.getenv('RETRO_WRITE_QUEUE_FOLDER')
+# How long to wait for more new items before creating them in Airtable in a single request.
+_WRITE_QUEUE_FLUSH_DELAY_SECONDS = .5
+# Slack retries a request for a few minutes, the responses to the first attempts are kept a bit
+# longer.
+_SLACK_RETRY_TTL_SECONDS = 600
+_SLACK_RETRY_MAX_RESPONSES = 1000
+# A retry waits for the first attempt to finish, but must still answer within Slack's 3 seconds.
+_SLACK_RETRY_WAIT_SECONDS = 2.5
+# A local folder to keep the search index of the items, see README.
+_RETRO_SEARCH_INDEX_FOLDER = os.getenv('RETRO_SEARCH_INDEX_FOLDER')
+_SEARCH_MAX_RESULTS = 20
+# A local folder to keep the stats of the items by sprint, see README.
+_RETRO_STATS_FOLDER = os.getenv('RETRO_STATS_FOLDER')
+_STATS_SPRINTS = 6
+_STATS_TOP_CREATORS = 5
+# A local folder to write the exports of the items and moods, see README.
+_RETRO_EXPORT_FOLDER = os.getenv('RETRO_EXPORT_FOLDER')
+# The secret of the Typeform webhook that sends the moods, see README.
+_TYPEFORM_SECRET = os.getenv('TYPEFORM_SECRET')
+# A local folder to keep the sections of the weekly mood report, see README.
+_RETRO_MOOD_SECTIONS_FOLDER = os.getenv('RETRO_MOOD_SECTIONS_FOLDER')
+# Config of the Slack teams that do not use the values above, see README.
+_RETRO_TENANTS = os.getenv('RETRO_TENANTS')
+# Only the storages of the most recently active tenants are kept in memory.
+_MAX_ACTIVE_TENANTS = int(os.getenv('RETRO_MAX_ACTIVE_TENANTS', '20'))
+
+# Slack truncates longer messages.
+_SLACK_MAX_MESSAGE_LENGTH = 4000
+# A quarter of weekly check ins.
+_MOOD_TREND_SPRINTS = 13
+
+
+def _parse_latency_budgets(budgets):
+    """Parse latency budgets in seconds by command, such as "list=1.5,mood=0"."""
+
+    latency_budgets = {}
+    for budget in budgets.split(','):
+        if not budget.strip():
+            continue
+        try:
+            command_action, seconds = budget.split('=')
+            latency_budgets[command_action.strip().lower()] = float(seconds)
+        except ValueError:
+            logging.warning('Invalid latency budget "%s", should be like "list=1.5".', budget)
+    return latency_budgets
+
+
+_COMMAND_LATENCY_BUDGETS = _parse_latency_budgets(_SLACK_COMMAND_LATENCY_BUDGETS)
+# Moving average of the time it took to run each command in this container.
+_COMMAND_LATENCY_ESTIMATES = {}
+_COMMAND_LATENCY_SMOOTHING = .3
+# Consecutive deferrals of each command in this container. The deferred commands run in other
+# containers: one in a few is run here anyway, to measure it again and to read the items.
+_COMMAND_DEFERRALS = collections.Counter()
+_MAX_CONSECUTIVE_DEFERRALS = 3
+
+
+class _Tenant(object):
+    """The resources used to serve a tenant: its storage and the caches that go with it."""
+
+    def __init__(self, config):
+        self.config = config
+        self.storage = _create_storage(config)
+        # Without a folder, the index is built again by each new container.
+        self.search_index = search_index.SearchIndex(os.path.join(
+            _RETRO_SEARCH_INDEX_FOLDER, _get_tenant_file_name(config) + '.search.sqlite',
+        ) if _RETRO_SEARCH_INDEX_FOLDER else ':memory:')
+        # Without a folder, each container would only count its own writes: no stats.
+        self.stats = sprint_stats.SprintStats(os.path.join(
+            _RETRO_STATS_FOLDER, _get_tenant_file_name(config) + '.stats.sqlite',
+        )) if _RETRO_STATS_FOLDER else None
+        # The serialized responses of "/retro list" by category, with the version of their items.
+        self.list_responses = {}
+        # Without a folder, each container would only have the sections of the moods it received:
+        # the report reads all the moods.
+        self.mood_sections = mood_sections.MoodSections(os.path.join(
+            _RETRO_MOOD_SECTIONS_FOLDER, _get_tenant_file_name(config) + '.moods.sqlite',
+        )) if _RETRO_MOOD_SECTIONS_FOLDER else None
+
+    def close(self):
+        """Release the resources of a tenant that is not active anymore."""
+
+        self.storage.close()
+        self.search_index.close()
+        if self.stats:
+            self.stats.close()
+        if self.mood_sections:
+            self.mood_sections.close()
+
+
+def _create_storage(config):
+    if config.sqlite_path:
+        return storage.SqliteStorage(config.sqlite_path)
+    airtable_storage = storage.AirtableStorage(airtable_client.AirtableClient(
+        config.airtable_base_id, config.airtable_api_key))
+    if not _RETRO_WRITE_QUEUE_FOLDER:
+        return airtable_storage
+    return write_queue.WriteBehindStorage(
+        airtable_storage,
+        os.path.join(_RETRO_WRITE_QUEUE_FOLDER, _get_tenant_file_name(config) + '.sqlite'),
+        schedule_flush=lambda: _async_flush_write_queue(config.tenant_id))
+
+
+@_task
+def _async_flush_write_queue(tenant_id):
+    # Wait for the items added at the same time, to create them in a single request.
+    time.sleep(_WRITE_QUEUE_FLUSH_DELAY_SECONDS)
+    _get_tenant(tenant_id).storage.flush()
+
+
+def _get_tenant_file_name(config):
+    return re.sub(r'\W', '_', config.tenant_id) or 'default'
+
+
+def _get_tenant(tenant_id):
+    return _TENANT_POOL.get(tenant_id)
+
+
+def get_storage(tenant_id=tenants.DEFAULT_TENANT_ID):
+    """Get the storage of a tenant, e.g. for the command line tools."""
+
+    if tenant_id not in _TENANTS:
+        raise KeyError('Unknown tenant "{}", check the env variables.'.format(tenant_id))
+    return _get_tenant(tenant_id).storage
+
+
+def _get_limit_key(config):
+    """Get the key limiting the concurrent calls to the storage of a tenant."""
+
+    return config.sqlite_path or config.airtable_base_id
+
+
+def _find_tenant(team_id, channel_id, token):
+    """Find the tenant serving a Slack channel, and check that the request comes from its team."""
+
+    tenant_id = tenants.find_tenant_id(_TENANTS, team_id, channel_id)
+    if tenant_id is None or _TENANTS[tenant_id].slack_token != token:
+        abort(401)
+    return _get_tenant(tenant_id)
+
+
+_TENANT_POOL = tenants.LruPool(
+    lambda tenant_id: _Tenant(_TENANTS[tenant_id]), _MAX_ACTIVE_TENANTS, close=_Tenant.close)
 
 _MISSING_ENV_VARIABLES = []
 if not _SLACK_RETRO_TOKEN:
     _MISSING_ENV_VARIABLES.append('SLACK_RETRO_TOKEN')
-if not _AIRTABLE_RETRO_BASE_ID:
+if not _AIRTABLE_RETRO_BASE_ID and not _RETRO_SQLITE_PATH:
     _MISSING_ENV_VARIABLES.append('AIRTABLE_RETRO_BASE_ID')
-if not _AIRTABLE_RETRO_API_KEY:
+if not _AIRTABLE_RETRO_API_KEY and not _RETRO_SQLITE_PATH:
     _MISSING_ENV_VARIABLES.append('AIRTABLE_RETRO_API_KEY')
 if not _SLACK_WEBHOOK_URL:
     _MISSING_ENV_VARIABLES.append('SLACK_WEBHOOK_URL')
-if _MISSING_ENV_VARIABLES:
-    _STEPS_TO_FINISH_SETUP = \
-        'Need to setup the following AWS Lambda function env variables:\n{}'.format(
-            _MISSING_ENV_VARIABLES)
-    _AIRTABLE_CLIENT = None
+try:
+    _TENANTS = tenants.parse_registry(_RETRO_TENANTS, {
+        'slack_token': _SLACK_RETRO_TOKEN,
+        'slack_webhook_url': _SLACK_WEBHOOK_URL,
+        'airtable_base_id': _AIRTABLE_RETRO_BASE_ID,
+        'airtable_api_key': _AIRTABLE_RETRO_API_KEY,
+        'sqlite_path': _RETRO_SQLITE_PATH,
+        'typeform_secret': _TYPEFORM_SECRET,
+    })
+except ValueError as registry_error:
+    _TENANTS = {}
+    _STEPS_TO_FINISH_SETUP = 'Need to fix the RETRO_TENANTS env variable: {}'.format(
+        registry_error)
 else:
-    _STEPS_TO_FINISH_SETUP = None
-    _AIRTABLE_CLIENT = airtable.Airtable(
-        _AIRTABLE_RETRO_BASE_ID, _AIRTABLE_RETRO_API_KEY)
+    if _TENANTS:
+        _STEPS_TO_FINISH_SETUP = None
+    else:
+        _STEPS_TO_FINISH_SETUP = \
+            'Need to setup the following AWS Lambda function env variables:\n{}'.format(
+                _MISSING_ENV_VARIABLES)
+if _RETRO_WRITE_QUEUE_FOLDER and not _STEPS_TO_FINISH_SETUP and os.path.commonpath([
+        os.path.realpath(_RETRO_WRITE_QUEUE_FOLDER), os.path.realpath(tempfile.gettempdir()),
+]) == os.path.realpath(tempfile.gettempdir()):
+    # Each container has its own temp folder: the queued items would be lost with it.
+    _STEPS_TO_FINISH_SETUP = \
+        'Need to set RETRO_WRITE_QUEUE_FOLDER to a folder shared by all the containers, ' \
+        'e.g. an EFS volume, not in {}.'.format(tempfile.gettempdir())
+
+
+_SLACK_RESPONSES = idempotency.ResponseCache(_SLACK_RETRY_TTL_SECONDS, _SLACK_RETRY_MAX_RESPONSES)
+
+
+def _get_slash_command_key():
+    form = request.form
+    if not form.get('trigger_id'):
+        return None
+    return 'command', form.get('token'), form.get('team_id'), form['trigger_id']
+
+
+def _get_button_click_key():
+    try:
+        slack_button_click = json.loads(request.form['payload'])
+    except (KeyError, ValueError):
+        return None
+    if not slack_button_click.get('action_ts'):
+        return None
+    return (
+        'button', slack_button_click.get('token'), slack_button_click.get('team', {}).get('id'),
+        slack_button_click.get('callback_id'), slack_button_click['action_ts'])
+
+
+@app.before_request
+def _start_request_timing():
+    request_timing.start(request.path)
+
+
+@app.after_request
+def _stop_request_timing(response):
+    timings = request_timing.stop()
+    if timings:
+        response.headers['Server-Timing'] = timings.get_server_timing_header()
+    return response
 
 
 @app.route('/')
@@ -110,6 +313,10 @@ def index():
 
 
 @app.route('/handle_slack_command', methods=['POST'])
+@idempotency.answer_retries_once(
+    _SLACK_RESPONSES, _get_slash_command_key,
+    lambda: _format_json_response('⏳ Still working on it...', in_channel=False),
+    _SLACK_RETRY_WAIT_SECONDS)
 def handle_slack_command():
     """Receives a Slack webhook notification and handles it to update Airtable."""
 
@@ -117,9 +324,10 @@ def handle_slack_command():
         return _STEPS_TO_FINISH_SETUP, 200
 
     slack_notification = request.form
-    # Verify that the request is authorized.
-    if slack_notification['token'] != _SLACK_RETRO_TOKEN:
-        abort(401)
+    # Verify that the request is authorized, and find which base to use.
+    tenant = _find_tenant(
+        slack_notification.get('team_id'), slack_notification.get('channel_id'),
+        slack_notification['token'])
 
     # Get the user name.
     user_name = slack_notification['user_name']
@@ -146,25 +354,31 @@ def handle_slack_command():
     # If the command does not exist, show help.
     if command_action not in _ALL_CMDS:
         command_action = _HELP_CMDS[0]
+    request_timing.current().name = 'command {}'.format(command_action)
 
     # Call different actions:
-    # /retro good, /retro bad, /retro try
-    if command_action in _CATEGORY_CMDS:
-        category = command_action
-        item_object = command_params
-        response = _add_retrospective_item_and_get_response(
-            category, item_object, user_name)
+    # /retro good, /retro bad, /retro try, /retro list, /retro mood, /retro search, /retro stats
+    if command_action in _AIRTABLE_CMDS:
+        if _should_defer_command(tenant, command_action):
+            _async_respond_to_command(
+                tenant.config.tenant_id, response_url, command_action, command_params, user_name)
+            if command_action in _CATEGORY_CMDS:
+                # The item is added by another container: read the items again to list it.
+                tenant.storage.expire_items()
+            return _format_json_response('⏳ Working on it...', in_channel=False)
+        if command_action in _LIST_CMDS:
+            return _get_list_json_response(tenant, command_action, command_params, user_name)
+        response = _run_command(tenant, command_action, command_params, user_name)
         return _format_json_response(response)
 
-    # /retro list
-    if command_action in _LIST_CMDS:
-        response = _get_retrospective_items_response(command_params)
-        return _format_json_response(response)
+    # /retro stats
+    if command_action in _STATS_CMDS:
+        return _format_json_response(_get_retrospective_stats_response(tenant))
 
-    # /retro mood
-    if command_action in _MOOD_CMDS:
-        response = _get_retrospective_mood_response()
-        return _format_json_response(response)
+    # /retro export
+    if command_action in _EXPORT_CMDS:
+        response = _export_and_get_response(tenant, response_url, command_params)
+        return _format_json_response(response, in_channel=False)
 
     # /retro new
     if command_action in _NEW_CMDS:
@@ -173,7 +387,7 @@ def handle_slack_command():
             response = 'Oops, did you mean "/retro good {}"?'.format(
                 item_object)
         else:
-            response = _mark_retrospective_items_as_reviewed(response_url)
+            response = _mark_retrospective_items_as_reviewed(tenant, response_url)
         return _format_json_response(response)
 
     # /retro help
@@ -185,6 +399,12 @@ def handle_slack_command():
             '*{command} list* to see the different lists saved for the current sprint',
             '*{command} list <good/bad/try>* to see one of the lists saved for the current sprint',
             '*{command} mood* to see the mood of everyone as sent to Typeform during this sprint',
+            '*{command} mood trend* to see how the team felt over the last sprints',
+            '*{command} search <words>* to find the items of all sprints with these words, '
+            'optionally with *category:<good/bad/try>* or *creator:<name>*',
+            '*{command} stats* to see the items and the "try" completion of the last sprints',
+            '*{command} export <items/moods> [csv] [<since ISO time>]* to export all of them to '
+            'a file',
             '*{command} new* to start a fresh list for the new scrum sprint',
             '*{command} help* to see this message',
         ]).format(command=slash_command)
@@ -193,6 +413,9 @@ def handle_slack_command():
 
 
 @app.route('/handle_slack_button_click', methods=['POST'])
+# Leave the message as is until the first click is handled.
+@idempotency.answer_retries_once(
+    _SLACK_RESPONSES, _get_button_click_key, lambda: ('', 200), _SLACK_RETRY_WAIT_SECONDS)
 def handle_slack_button_click():
     """Receives a Slack webhook notification and handles it to update Airtable."""
 
@@ -200,13 +423,16 @@ def handle_slack_button_click():
         return _STEPS_TO_FINISH_SETUP, 200
 
     slack_button_click = json.loads(request.form['payload'])
-    # Verify that the request is authorized.
-    if slack_button_click['token'] != _SLACK_RETRO_TOKEN:
-        abort(401)
+    # Verify that the request is authorized, and find which base to use.
+    tenant = _find_tenant(
+        slack_button_click.get('team', {}).get('id'),
+        slack_button_click.get('channel', {}).get('id'),
+        slack_button_click['token'])
 
     item_id = slack_button_click['callback_id']
     response_url = slack_button_click['response_url']
     action = slack_button_click['actions'][0]
+    request_timing.current().name = 'button {}'.format(action['name'])
 
     new_fields = {}
     if action['name'] == 'commit':
@@ -215,7 +441,20 @@ def handle_slack_button_click():
         new_fields['Completed At'] = _now()
 
     if new_fields:
-        item = _AIRTABLE_CLIENT.update(_AIRTABLE_RETRO_ITEMS_TABLE_ID, item_id, new_fields)
+        try:
+            item = tenant.storage.update_item(item_id, new_fields)
+        except storage.StorageError as error:
+            logging.error('Could not update item %s: %s', item_id, error)
+            # Keep the message and its buttons, so that the click can be tried again.
+            response = dict(_get_response_dict(
+                'Sorry, but *{}* was unable to update this item: {}'.format(_BOT_NAME, error),
+                in_channel=False), replace_original=False)
+            return Response(json.dumps(response), status=200, mimetype='application/json')
+        if tenant.stats and action['name'] == 'commit':
+            tenant.stats.commit_try(_now())
+        elif tenant.stats:
+            tenant.stats.complete_try(
+                item['fields'].get('Created At'), new_fields['Completed At'])
 
     message = slack_button_click['original_message']
     attachment = next(
@@ -225,16 +464,143 @@ def handle_slack_button_click():
     if action['name'] == 'new':
         item_ids = item_id.split(',')
         attachment['text'] = _mark_retrospective_items_as_reviewed(
-            response_url, item_ids, action['value'])
+            tenant, response_url, item_ids, action['value'])
         attachment['actions'] = []
     else:
         # Update attachment for the item.
         attachment.update(
-            _get_retrospective_item_attachment(item, show_emoji_and_no_actions=True))
+            item_report.get_item_attachment(item, show_emoji_and_no_actions=True))
 
     return Response(json.dumps(message), status=200, mimetype='application/json')
 
 
+@app.route('/handle_mood_submission', methods=['POST'])
+def handle_mood_submission():
+    """Receives a mood submitted to Typeform, and formats its section of the weekly report."""
+
+    if _STEPS_TO_FINISH_SETUP:
+        return _STEPS_TO_FINISH_SETUP, 200
+
+    # Verify that the request comes from the form of the tenant.
+    tenant_id = request.args.get('tenant', tenants.DEFAULT_TENANT_ID)
+    config = _TENANTS.get(tenant_id)
+    if not config or not typeform.is_signed(
+            config.typeform_secret, request.get_data(), request.headers.get('Typeform-Signature')):
+        abort(401)
+    try:
+        submission = typeform.parse_submission(request.get_json(force=True, silent=True))
+    except ValueError as error:
+        return str(error), 400
+    request_timing.current().name = 'mood submission'
+
+    tenant = _get_tenant(tenant_id)
+    try:
+        # Typeform sends a submission again if it was not acknowledged in time, maybe to another
+        # container: the submission time tells it apart.
+        if (tenant.mood_sections and tenant.mood_sections.has_submission(submission.token)) or \
+                tenant.storage.has_mood(submission.fields):
+            return '', 200
+        mood = tenant.storage.create_mood(submission.fields)
+    except storage.StorageError as error:
+        logging.error('Could not create the mood of tenant "%s": %s', tenant_id, error)
+        # Typeform sends it again later.
+        return 'Could not save the mood.', 503
+    if tenant.mood_sections:
+        with request_timing.span('render'):
+            section = mood_report.format_section({'fields': submission.fields})
+        tenant.mood_sections.add_section(
+            submission.token, mood['id'], submission.fields['Created At'], section)
+    return '', 200
+
+
+def _run_command(tenant, command_action, command_params, user_name):
+    """Run one of the commands that need Airtable, and keep track of its latency."""
+
+    start = time.monotonic()
+    try:
+        # /retro good, /retro bad, /retro try
+        if command_action in _CATEGORY_CMDS:
+            category = command_action
+            item_object = command_params
+            return _add_retrospective_item_and_get_response(
+                tenant, category, item_object, user_name)
+
+        # /retro list
+        if command_action in _LIST_CMDS:
+            return _get_retrospective_items_response(tenant, command_params)
+
+        # /retro search
+        if command_action in _SEARCH_CMDS:
+            return _search_retrospective_items_response(tenant, command_params)
+
+        # /retro mood trend
+        if command_params.strip().lower() == 'trend':
+            return _get_retrospective_mood_trend_response(tenant)
+
+        # /retro mood
+        return _get_retrospective_mood_response(tenant)
+    finally:
+        _record_command_latency(command_action, time.monotonic() - start)
+
+
+def _get_list_json_response(tenant, command_action, command_params, user_name):
+    """Get the response of "/retro list", rendered again only if the items have changed."""
+
+    start = time.monotonic()
+    # Read before the items, so that a write while they are rendered is not missed.
+    version = tenant.storage.get_items_version()
+    cached = tenant.list_responses.get(command_params)
+    if version is not None and cached and cached[0] == version:
+        _record_command_latency(command_action, time.monotonic() - start)
+        response_json = cached[1]
+    else:
+        response = _run_command(tenant, command_action, command_params, user_name)
+        with request_timing.span('render'):
+            response_json = json.dumps(_get_response_dict(response)).encode('utf-8')
+        if version is not None and command_params in ('',) + _CATEGORY_CMDS:
+            tenant.list_responses[command_params] = (version, response_json)
+    return Response(response_json, status=200, mimetype='application/json')
+
+
+def _record_command_latency(command_action, seconds):
+    previous = _COMMAND_LATENCY_ESTIMATES.get(command_action)
+    if previous is None:
+        _COMMAND_LATENCY_ESTIMATES[command_action] = seconds
+    else:
+        _COMMAND_LATENCY_ESTIMATES[command_action] = \
+            previous + _COMMAND_LATENCY_SMOOTHING * (seconds - previous)
+
+
+def _should_defer_command(tenant, command_action):
+    """Whether the command is expected to take longer than its latency budget."""
+
+    if command_action in _SEARCH_CMDS and tenant.search_index.is_cold():
+        # Building the index reads all the items, far longer than Slack waits.
+        return True
+    budget = _COMMAND_LATENCY_BUDGETS.get(command_action)
+    if budget is None:
+        return False
+    estimate = _COMMAND_LATENCY_ESTIMATES.get(command_action)
+    if estimate is None:
+        # First time in this container: it's fast only if the items are already in memory.
+        is_slow = command_action not in _CATEGORY_CMDS + _LIST_CMDS or \
+            not tenant.storage.is_fast()
+    else:
+        is_slow = estimate > budget
+    if not is_slow or _COMMAND_DEFERRALS[command_action] >= _MAX_CONSECUTIVE_DEFERRALS:
+        _COMMAND_DEFERRALS[command_action] = 0
+        return False
+    _COMMAND_DEFERRALS[command_action] += 1
+    return True
+
+
+@_task
+def _async_respond_to_command(
+        tenant_id, response_url, command_action, command_params, user_name):
+    response = _run_command(_get_tenant(tenant_id), command_action, command_params, user_name)
+    return airtable_client.post_json(response_url, _get_response_dict(response))
+
+
 def _get_command_action_and_params(command_text):
     """Parse the passed string for a command action and parameters."""
 
@@ -244,7 +610,7 @@ def _get_command_action_and_params(command_text):
     return command_action, command_params
 
 
-def _add_retrospective_item_and_get_response(category, item_object, user_name):
+def _add_retrospective_item_and_get_response(tenant, category, item_object, user_name):
     """Set the retrospective item for the passed parameters and return the approriate responses."""
 
     # Reject attempts to set reserved terms.
@@ -255,44 +621,41 @@ def _add_retrospective_item_and_get_response(category, item_object, user_name):
     if not item_object:
         return 'Oops, you forgot to tell what was *{}*!'.format(category)
 
-    item_object = item_object[0].upper() + item_object[1:]
-    category = category.lower()
+    category, item_object = storage.normalize_new_item(category, item_object)
 
-    existing_item = _AIRTABLE_CLIENT.get(
-        _AIRTABLE_RETRO_ITEMS_TABLE_ID,
-        view=_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW,
-        filter_by_formula='AND(Category = {}, Object = {})'.format(
-            json.dumps(category), json.dumps(item_object)),
-    ).get('records')
-    if existing_item:
+    if tenant.storage.has_item(category, item_object):
         return 'This retrospective item has already been added!'
 
-    item_airtable_record = _AIRTABLE_CLIENT.create(_AIRTABLE_RETRO_ITEMS_TABLE_ID, {
-        'Category': category.lower(),
-        'Object': item_object,
-        'Creator': user_name,
-        'Created At': _now(),
-    })
-    if not item_airtable_record:
-        return 'Sorry, but *{}* was unable to save the retrospective item.'.format(_BOT_NAME)
+    try:
+        item_record = tenant.storage.create_item({
+            'Category': category.lower(),
+            'Object': item_object,
+            'Creator': user_name,
+            'Created At': _now(),
+        })
+    except storage.StorageError as error:
+        logging.error('Could not save a retrospective item: %s', error)
+        return 'Sorry, but *{}* was unable to save the retrospective item: {}'.format(
+            _BOT_NAME, error)
+
+    if tenant.stats:
+        tenant.stats.add_item(item_record['fields'])
 
     response = 'New retrospective item:'
-    attachments = _get_retrospective_items_attachments([item_airtable_record], show_review=False)
+    attachments = _get_retrospective_items_attachments([item_record], show_review=False)
     return (response, attachments)
 
 
-def _get_retrospective_items_response(filter_category=None):
+def _get_retrospective_items_response(tenant, filter_category=None):
     """Get all the retrospective item for the current sprint."""
 
     if filter_category and filter_category not in _CATEGORY_CMDS:
         return 'Wrong category "{}", should be {} or empty.'.format(
             filter_category, ', '.join('"{}"'.format(c) for c in _CATEGORY_CMDS))
 
-    items = _AIRTABLE_CLIENT.get(
-        _AIRTABLE_RETRO_ITEMS_TABLE_ID,
-        filter_by_formula='Category = "{}"'.format(filter_category) if filter_category else None,
-        view=_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW,
-    ).get('records')
+    items = [
+        item for item in tenant.storage.iterate_current_items()
+        if not filter_category or item['fields'].get('Category') == filter_category]
     if not items:
         return 'No retrospective items yet.'
 
@@ -301,178 +664,170 @@ def _get_retrospective_items_response(filter_category=None):
     return (response, attachments)
 
 
-def _get_retrospective_mood_response():
-    """Get all the retrospective moods for the current sprint."""
-
-    items = _AIRTABLE_CLIENT.get(
-        _AIRTABLE_MOOD_ITEMS_TABLE_ID,
-        view=_AIRTABLE_MOOD_ITEMS_CURRENT_VIEW
-    ).get('records')
-    if not items:
-        return 'No mood items for this week yet.'
-
-    response = ':mag: Dear team, here is the weekly check in of this week :mag_right:\n\n'
-    for item in items:
-        fields = item['fields']
-        name = fields.get('Name')
-        feelings = '\n'.join(
-            _with_emoji_prefix(feeling)
-            for feeling in fields.get('How are you feeling at Bayes', '').split(', \n'))
-        if not feelings:
-            feelings = '\t_No feeling emojis selected_'
-        feeling_free_text = fields.get('Feeling at bayes free text', '')
-        if feeling_free_text:
-            feeling_free_text = '\n> ' + feeling_free_text
-        work_status = '\n'.join(
-            _with_emoji_prefix(status)
-            for status in fields.get('How is your work going', '').split(', \n'))
-        if not work_status:
-            work_status = '\t_No work status emojis selected_'
-        work_status_free_text = fields.get('How is your work going free text', '')
-        if work_status_free_text:
-            work_status_free_text = '\n> ' + work_status_free_text
-        response += textwrap.dedent('''\
-        *{name}*
-        • _Feeling_
-        {feelings}{feeling_free_text}
-        • _Work at Bayes_
-        {work_status}{work_status_free_text}
-
-        ''').format(
-            name=name,
-            feelings=feelings, feeling_free_text=feeling_free_text,
-            work_status=work_status, work_status_free_text=work_status_free_text)
-    return response
+def _search_retrospective_items_response(tenant, command_params):
+    """Find the items of all sprints that match a search, e.g. "coffee category:good"."""
 
+    words = []
+    facets = {}
+    for param in command_params.split():
+        facet, separator, value = param.partition(':')
+        if separator and facet.lower() in ('category', 'creator') and value:
+            facets[facet.lower()] = value
+        else:
+            words.append(param)
+    if not words:
+        return 'What are you looking for? Try "/retro search <words>".'
 
-def _with_emoji_prefix(sentence):
-    """Prepends with an emoji if one is found."""
+    tenant.search_index.update(tenant.storage)
+    text = ' '.join(words)
+    items, counts = tenant.search_index.search(text, limit=_SEARCH_MAX_RESULTS, **facets)
+    if not items:
+        return 'No retrospective items match "{}".'.format(text)
+    with request_timing.span('render'):
+        lines = ['{} retrospective items match "{}": {}'.format(
+            sum(counts.values()), text, ', '.join(
+                '{} {}'.format(count, category.capitalize())
+                for category, count in sorted(counts.items(), key=_get_category_order)))]
+        for item in items:
+            fields = item['fields']
+            lines.append('• *{}* {} _({}, {})_'.format(
+                fields['Category'].capitalize(), fields['Object'],
+                fields.get('Creator', 'unknown'), fields['Created At'][:10]))
+        return '\n'.join(lines)
+
+
+def _get_category_order(category_count):
+    category = category_count[0]
+    return _CATEGORY_CMDS.index(category) if category in _CATEGORY_CMDS else len(_CATEGORY_CMDS)
+
+
+def _get_retrospective_stats_response(tenant):
+    """Get the stats of the items of the last sprints."""
+
+    if not tenant.stats:
+        return 'Stats are not enabled, set RETRO_STATS_FOLDER to enable them.'
+    report = tenant.stats.get_report(_STATS_SPRINTS, _STATS_TOP_CREATORS)
+    if not report.sprints:
+        return 'No stats yet, they are counted as new items are added.'
+
+    with request_timing.span('render'):
+        return sprint_stats.format_report(report, category_key=_get_category_order)
+
+
+def _export_and_get_response(tenant, response_url, command_params):
+    """Start an export of the items or moods of a tenant to a file of the export folder."""
+
+    if not _RETRO_EXPORT_FOLDER:
+        return 'Exports are not enabled, set RETRO_EXPORT_FOLDER to enable them.'
+    words = command_params.split()
+    table = words.pop(0).capitalize() if words else 'Items'
+    output_format = words.pop(0).lower() if words and words[0].lower() in retro_export.FORMATS \
+        else retro_export.FORMATS[0]
+    since = words.pop(0) if words else ''
+    if table not in storage.TABLE_FIELDS or words:
+        return 'Oops, use *export <items/moods> [csv] [<since ISO time>]*.'
     try:
-        emoji = _MOOD_EMOJIS[sentence]
-    except KeyError:
-        logging.warning('Missing an emoji for sentence "%s".', sentence)
-        return sentence
-    return f'{emoji} {sentence}'
+        retro_export.validate_since(since)
+    except ValueError as error:
+        return 'Oops, {}'.format(error)
+
+    file_name = '{}.{}{}.{}'.format(
+        _get_tenant_file_name(tenant.config), table.lower(),
+        '.since-' + re.sub(r'\W', '-', since) if since else '', output_format)
+    output_path = os.path.join(_RETRO_EXPORT_FOLDER, file_name)
+    _async_export(
+        tenant.config.tenant_id, response_url, table, output_format, since, output_path)
+    return 'Exporting the {} to `{}`...'.format(table.lower(), output_path)
+
+
+@_task
+@airtable_client.background_priority()
+def _async_export(tenant_id, response_url, table, output_format, since, output_path):
+    try:
+        count, last_created_at = retro_export.export(
+            _get_tenant(tenant_id).storage, table, output_path, output_format, since)
+    except (
+            storage.StorageError, airtable_client.requests.RequestException, OSError,
+            ValueError) as error:
+        logging.error('Could not export the %s: %s', table, error)
+        text = 'Sorry, the export stopped: {}\nRun the same command again to resume it.'.format(
+            error)
+    else:
+        text = 'Exported {} {} to `{}`.'.format(count, table.lower(), output_path)
+        if last_created_at:
+            text += ' To export the next ones: *export {} {} {}*'.format(
+                table.lower(), output_format, last_created_at)
+    return airtable_client.post_json(response_url, {'response_type': 'ephemeral', 'text': text})
 
 
-def _get_retrospective_items_attachments(retrospective_items, show_review):
-    """Return Slack message attachements to show the given retrospective items."""
+def _get_retrospective_mood_response(tenant):
+    """Get all the retrospective moods for the current sprint."""
 
-    retrospective_items = sorted(retrospective_items, key=_get_category_title)
-    items_by_category = groupby(retrospective_items, key=_get_category_title)
-    attachments = []
-    for category_title, items_in_category in items_by_category:
-        # Remove starting number and space in the title.
-        title = category_title[2:]
-        callback_ids = []
-        attachments += [{
-            'title': title,
-            'color': _COLORS_BY_TITLE[category_title],
-        }]
-        if category_title == _TRY_TO_COMPLETE_TITLE:
-            title = 'Completed Try'
-        for item in items_in_category:
-            attachments.append(_get_retrospective_item_attachment(item))
-            if category_title != _TRY_TO_COMPLETE_TITLE or item['fields'].get('Completed At'):
-                callback_ids.append(item['id'])
-        if not show_review or not callback_ids:
-            continue
+    return ''.join(_iterate_retrospective_mood_messages(tenant, max_length=None))
 
-        review_actions = [{
-            'name': 'new',
-            'text': f'✅ Mark {title.lower()} items as read',
-            'type': 'button',
-            'value': title,
-        }]
-        attachments.append({
-            'callback_id': ','.join(callback_ids),
-            'attachment_type': 'default',
-            'actions': review_actions,
-        })
-    return attachments
 
+def _iterate_retrospective_mood_messages(tenant, max_length):
+    # The sections of the moods received by the webhook are already formatted, but the moods can
+    # also come from elsewhere, e.g. from the Airtable integration of Typeform.
+    if tenant.mood_sections:
+        since = mood_sections.get_week_start()
+        sections = tenant.mood_sections.get_sections(since)
+        if sections and set(sections) == {
+                mood['id'] for mood in tenant.storage.iterate_records_created_since(
+                    'Moods', since, fields=('Created At',))}:
+            return mood_report.iterate_section_messages(list(sections.values()), max_length)
+    return mood_report.iterate_messages(tenant.storage.iterate_moods(), max_length)
 
-def _get_category_title(item):
-    fields = item['fields']
-    category = fields.get('Category')
-    if category == 'good':
-        return _GOOD_TITLE
-    if category == 'bad':
-        return _BAD_TITLE
-    if fields.get('Committed ?'):
-        return _TRY_TO_COMPLETE_TITLE
-    return _TRY_TO_REVIEW_TITLE
 
+def _get_retrospective_mood_trend_response(tenant):
+    """Get the aggregated moods of the last sprints."""
 
-def _get_retrospective_item_attachment(item, show_emoji_and_no_actions=False):
-    """Generates how the retrospective item will be shown in Slack.
+    try:
+        aggregates = tenant.storage.get_mood_trend(_MOOD_TREND_SPRINTS)
+    except storage.StorageError as error:
+        logging.error('Could not read the mood trend: %s', error)
+        return 'Sorry, but *{}* was unable to read the mood trend: {}'.format(_BOT_NAME, error)
+    if not aggregates:
+        return 'No mood trend yet, it is updated with each weekly check in report.'
+    with request_timing.span('render'):
+        return mood_report.format_trend(aggregates)
 
-    Use show_emoji_and_no_actions to show the new state of the items without allowing more
-    actions on it.
-    """
 
-    fields = item['fields']
-    category = fields.get('Category')
-    emoji = ''
-    actions = []
-
-    if category == 'try':
-        if fields.get('Completed At'):
-            # Nothing more to do if it's completed.
-            emoji = '✅ '
-        elif fields.get('Committed ?'):
-            # If the team committed to do it, it's now time to do it.
-            emoji = '💪 '
-            actions = [{
-                'name': 'complete',
-                'text': '✅ Mark as complete',
-                'type': 'button',
-                'value': '1',
-            }]
-        else:
-            # If it's not committed, the team can decide to commit to do it.
-            actions = [{
-                'name': 'commit',
-                'text': '💪 Commit to do it',
-                'type': 'button',
-                'value': '1',
-            }]
-
-    if show_emoji_and_no_actions:
-        actions = []
-    else:
-        emoji = ''
+def _get_retrospective_items_attachments(retrospective_items, show_review):
+    """Return Slack message attachements to show the given retrospective items."""
 
-    attachment = {
-        'text': emoji + fields.get('Object'),
-        'color': _COLORS_BY_TITLE[_get_category_title(item)],
-    }
-    if actions:
-        attachment.update({
-            'callback_id': item['id'],
-            'attachment_type': 'default',
-            'actions': actions,
-        })
-    return attachment
+    with request_timing.span('render'):
+        return item_report.get_attachments(retrospective_items, show_review)
 
 
-def _mark_retrospective_items_as_reviewed(response_url, item_ids=None, name=None):
+def _mark_retrospective_items_as_reviewed(tenant, response_url, item_ids=None, name=None):
     """Start a new sprint with a new empty retrospective item list."""
 
-    _async_mark_retrospective_items_as_reviewed(response_url, item_ids, name)
+    _async_mark_retrospective_items_as_reviewed(
+        tenant.config.tenant_id, response_url, item_ids, name)
+    # The task usually runs in another container: this one must not list the items anymore, nor
+    # find them as duplicates.
+    tenant.storage.forget_items(item_ids)
     marked = 'these' if name else 'all current'
     return f'Marking {marked} retrospective items as reviewed...'
 
 
-@task
-def _async_mark_retrospective_items_as_reviewed(response_url, item_ids, name):
+@_task
+@airtable_client.background_priority()
+def _async_mark_retrospective_items_as_reviewed(tenant_id, response_url, item_ids, name):
+    return async_io.run(
+        _mark_items_as_reviewed(_get_tenant(tenant_id), response_url, item_ids, name))
+
+
+async def _mark_items_as_reviewed(tenant, response_url, item_ids, name):
+    limit_key = _get_limit_key(tenant.config)
+    work = unit_of_work.UnitOfWork(tenant.storage)
     if item_ids is None:
-        item_ids = [item['id'] for item in _AIRTABLE_CLIENT.get(
-            _AIRTABLE_RETRO_ITEMS_TABLE_ID,
-            view=_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW,
-        ).get('records')]
+        item_ids = [
+            item['id']
+            for item in await async_io.call(work.get_current_items, limit_key=limit_key)]
     if not item_ids:
-        return requests.post(response_url, json={
+        return await async_io.call(airtable_client.post_json, response_url, {
             'response_type': 'in_channel',
             'text': 'All retrospective were already marked as reviewed!',
         })
@@ -485,37 +840,99 @@ def _async_mark_retrospective_items_as_reviewed(response_url, item_ids, name):
     }
 
     for item_id in item_ids:
-        _AIRTABLE_CLIENT.update(
-            _AIRTABLE_RETRO_ITEMS_TABLE_ID, item_id, new_fields)
+        work.update_item(item_id, new_fields)
+    flush = async_io.call(work.flush, limit_key=limit_key)
 
     if is_for_try:
-        remaining_items = _AIRTABLE_CLIENT.get(
-            _AIRTABLE_RETRO_ITEMS_TABLE_ID,
-            view=_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW,
-        ).get('records')
+        # The items that remain are read while the others are updated, if not read already.
+        errors = (await asyncio.gather(
+            flush, async_io.call(work.get_current_items, limit_key=limit_key)))[0]
+        remaining_items = [
+            item for item in work.get_current_items() if not item['fields'].get('Reviewed At')]
+        # The "try" items are reviewed last, this is the end of the sprint's retrospective.
+        if tenant.stats:
+            tenant.stats.end_sprint(new_fields['Reviewed At'])
         attachments = _get_retrospective_items_attachments(remaining_items, show_review=True)
     else:
+        errors = await flush
         attachments = []
 
-    return requests.post(response_url, json={
+    text = (
+        f'{name} items marked as reviewed!'
+        "\nHere are the remaining 'try' items to complete:" if attachments else '')
+    if errors:
+        text += '\n⚠️ {} items could not be marked as reviewed, please try again.'.format(
+            len(errors))
+
+    return await async_io.call(airtable_client.post_json, response_url, {
         'response_type': 'in_channel',
-        'text': (
-            f'{name} items marked as reviewed!'
-            "\nHere are the remaining 'try' items to complete:" if attachments else ''),
+        'text': text,
         'attachments': attachments,
     })
 
 
+async def _for_each_tenant(func, tenant_ids):
+    """Run a blocking function for several tenants at once."""
+
+    await asyncio.gather(*(
+        async_io.call(func, tenant_id, limit_key=_get_limit_key(_TENANTS[tenant_id]))
+        for tenant_id in tenant_ids))
+
+
+@request_timing.instrumented
+@airtable_client.background_priority()
 def send_retro_mood(*unused_args, **unused_kwargs):
-    """Run the retro mood command, to be used in a scheduled task."""
+    """Run the retro mood command for all the tenants, to be used in a scheduled task."""
 
-    response = requests.post(_SLACK_WEBHOOK_URL, json={'text': _get_retrospective_mood_response()})
-    response.raise_for_status()
+    async_io.run(_for_each_tenant(_send_tenant_retro_mood, sorted(_TENANTS)))
+
+
+def _send_tenant_retro_mood(tenant_id):
+    tenant = _get_tenant(tenant_id)
+    try:
+        tenant.storage.update_mood_trend()
+    except storage.StorageError as error:
+        logging.error('Could not update the mood trend of tenant "%s": %s', tenant_id, error)
+    for message in _iterate_retrospective_mood_messages(tenant, _SLACK_MAX_MESSAGE_LENGTH):
+        response = airtable_client.post_json(tenant.config.slack_webhook_url, {'text': message})
+        response.raise_for_status()
+
+
+@request_timing.instrumented
+@airtable_client.background_priority()
+def warm_up(*unused_args, **unused_kwargs):
+    """Prepare the container for the next commands, to be used in a scheduled task."""
+
+    if _STEPS_TO_FINISH_SETUP:
+        return
+    importlib.import_module('zappa.async')
+    # Only the tenants that were recently active: the others would only use memory.
+    active_tenant_ids = [tenant.config.tenant_id for tenant in _TENANT_POOL.values()]
+    if not active_tenant_ids and tenants.DEFAULT_TENANT_ID in _TENANTS:
+        active_tenant_ids = [tenants.DEFAULT_TENANT_ID]
+    async_io.run(_for_each_tenant(_warm_up_tenant, active_tenant_ids))
+
+
+def _warm_up_tenant(tenant_id):
+    tenant = _get_tenant(tenant_id)
+    tenant.storage.warm_up()
+    # Catch up with the new items so that searches do not have to, and build the index once
+    # for all the containers when it is shared.
+    if _RETRO_SEARCH_INDEX_FOLDER or not tenant.search_index.is_cold():
+        tenant.search_index.update(tenant.storage)
 
 
 def _format_json_response(response, in_channel=True):
     """Format response for Slack."""
 
+    with request_timing.span('render'):
+        response_json = json.dumps(_get_response_dict(response, in_channel))
+    return Response(response_json, status=200, mimetype='application/json')
+
+
+def _get_response_dict(response, in_channel=True):
+    """Get the Slack message for a response that is either a text or a (text, attachments)."""
+
     if isinstance(response, str):
         text = response
         attachments = None
@@ -523,15 +940,12 @@ def _format_json_response(response, in_channel=True):
         text = response[0]
         attachments = response[1]
 
-    response_dict = {
+    return {
         'response_type': 'in_channel' if in_channel else 'ephemeral',
         'text': text,
         'attachments': attachments if attachments else []
     }
 
-    response_json = json.dumps(response_dict)
-    return Response(response_json, status=200, mimetype='application/json')
-
 
 def _now():
     return datetime.utcnow().isoformat(timespec='milliseconds') + 'Z'
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""Benchmark the /retro commands against large Airtable bases.
+
+Run it with `python slack_retro_bot_to_airtable_benchmark.py`. It fails if a command makes more
+remote calls, or is much slower, than the baselines stored in benchmark_baselines.json. To store
+new baselines, e.g. after an optimization, run it with UPDATE_BENCHMARK_BASELINES=1.
+
+Airtable is simulated by airtablemock, with an optional latency for each call set in seconds by
+BENCHMARK_AIRTABLE_LATENCY, so the timings mostly measure the bot's own work. The same commands
+are also run against an in-memory SQLite storage.
+"""
+
+import collections
+import datetime
+import json
+import os
+from os import path
+import threading
+import time
+import unittest
+
+import airtablemock
+import mock
+
+import slack_retro_bot_to_airtable
+import tenants
+
+_BASELINES_FILE = path.join(path.dirname(path.abspath(__file__)), 'benchmark_baselines.json')
+_UPDATE_BASELINES = bool(os.getenv('UPDATE_BENCHMARK_BASELINES'))
+_SIMULATED_LATENCY_SECONDS = float(os.getenv('BENCHMARK_AIRTABLE_LATENCY', '0'))
+# Timings are noisy: only fail when a command is much slower than its baseline.
+_LATENCY_TOLERANCE = 3
+_LATENCY_SLACK_SECONDS = .05
+# Airtable returns records by pages of 100.
+_PAGE_SIZE = 100
+
+
+class _CountingAirtable(airtablemock.Airtable):
+    """Airtable mock client that counts and slows down the calls that would be remote."""
+
+    def __init__(self, *args, **kwargs):
+        super(_CountingAirtable, self).__init__(*args, **kwargs)
+        self.calls = 0
+        self.is_counting = True
+        self._lock = threading.Lock()
+
+    def _call(self):
+        if not self.is_counting:
+            return
+        with self._lock:
+            self.calls += 1
+        if _SIMULATED_LATENCY_SECONDS:
+            time.sleep(_SIMULATED_LATENCY_SECONDS)
+
+    def iterate(  # pylint: disable=arguments-differ
+            self, table_name, view=None, fields=(), filter_by_formula=None):
+        self._call()
+        records = super(_CountingAirtable, self).iterate(
+            table_name, view=view, fields=fields, filter_by_formula=filter_by_formula)
+        for index, record in enumerate(records):
+            if index and not index % _PAGE_SIZE:
+                self._call()
+            yield record
+
+    def create(self, table_name, data):
+        self._call()
+        return super(_CountingAirtable, self).create(table_name, data)
+
+    def update(self, table_name, record_id, data):
+        self._call()
+        return super(_CountingAirtable, self).update(table_name, record_id, data)
+
+    def batch_update(self, table_name, records):
+        """Update several records in a single call."""
+
+        self._call()
+        return [
+            super(_CountingAirtable, self).update(table_name, record['id'], record['fields'])
+            for record in records]
+
+
+@mock.patch(slack_retro_bot_to_airtable.__name__ + '._STEPS_TO_FINISH_SETUP', None)
+@mock.patch.dict(slack_retro_bot_to_airtable.__name__ + '._TENANTS', {
+    tenants.DEFAULT_TENANT_ID: tenants.TenantConfig(
+        tenant_id=tenants.DEFAULT_TENANT_ID, slack_token='meowser_token',
+        slack_webhook_url='https://slack/hook', airtable_base_id='retro-base-id',
+        airtable_api_key='api-key'),
+}, clear=True)
+class BenchmarkTest(unittest.TestCase):
+    """Benchmark the /retro commands."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(BenchmarkTest, cls).setUpClass()
+        cls.results = collections.OrderedDict()
+        if path.exists(_BASELINES_FILE):
+            with open(_BASELINES_FILE, encoding='utf-8') as baselines_file:
+                cls.baselines = json.load(baselines_file)
+        else:
+            cls.baselines = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        for name, result in cls.results.items():
+            print('{:<32}{:>6} calls{:>10.1f} ms'.format(name, result['calls'], result['ms']))
+        if _UPDATE_BASELINES:
+            with open(_BASELINES_FILE, 'w', encoding='utf-8') as baselines_file:
+                json.dump(cls.results, baselines_file, indent=2, sort_keys=True)
+                baselines_file.write('\n')
+        super(BenchmarkTest, cls).tearDownClass()
+
+    def setUp(self):
+        super(BenchmarkTest, self).setUp()
+        self.app = slack_retro_bot_to_airtable.app.test_client()
+        airtablemock.clear()
+        self.addCleanup(airtablemock.clear)
+        self.airtable_client = _CountingAirtable('retro-base-id')
+        patcher = mock.patch('airtable_client.AirtableClient', return_value=self.airtable_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # pylint: disable=protected-access
+        slack_retro_bot_to_airtable._TENANT_POOL.clear()
+        self.addCleanup(slack_retro_bot_to_airtable._TENANT_POOL.clear)
+        patcher = mock.patch('requests.Session.post')
+        self.mock_post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Prefix of the names of the results.
+    _storage_name = ''
+
+    def _fill_base(self, size):
+        self.airtable_client.is_counting = False
+        self.airtable_client.create('Items', {'Category': 'old'})
+        airtablemock.create_view('retro-base-id', 'Items', 'Current View', 'Category != "old"')
+        categories = ('good', 'bad', 'try')
+        for index in range(size):
+            category = categories[index % len(categories)]
+            fields = {'Category': category, 'Object': 'Item #{}'.format(index)}
+            if category == 'try' and index % 2:
+                fields['Committed ?'] = True
+                if index % 4 == 1:
+                    fields['Completed At'] = '2018-10-17T10:00:00.000Z'
+            self.airtable_client.create('Items', fields)
+        for index in range(size):
+            self.airtable_client.create('Moods', {
+                'Name': 'Person #{}'.format(index),
+                'How are you feeling at Bayes': "I'm happy, \nI'm tired",
+                'Feeling at bayes free text': 'Nothing to declare',
+                'How is your work going': 'I am quite productive',
+            })
+        airtablemock.create_view('retro-base-id', 'Moods', 'Current View', 'Name != ""')
+        self.airtable_client.is_counting = True
+        self._clear_items_cache()
+
+    def _clear_items_cache(self):
+        # pylint: disable=protected-access
+        slack_retro_bot_to_airtable._get_tenant(
+            tenants.DEFAULT_TENANT_ID).storage.items_cache.clear()
+
+    def _measure(self, name, post):
+        name = self._storage_name + name
+        self.airtable_client.calls = 0
+        self.mock_post.reset_mock()
+        start = time.monotonic()
+        response = post()
+        duration_ms = (time.monotonic() - start) * 1000
+        self.assertEqual(200, response.status_code, msg=response.data)
+        calls = self.airtable_client.calls + self.mock_post.call_count
+        self.results[name] = {'calls': calls, 'ms': round(duration_ms, 1)}
+        baseline = self.baselines.get(name)
+        if _UPDATE_BASELINES or not baseline:
+            return response
+        with self.subTest(name=name):
+            self.assertLessEqual(
+                calls, baseline['calls'], msg='{} makes more remote calls'.format(name))
+            self.assertLessEqual(
+                duration_ms,
+                baseline['ms'] * _LATENCY_TOLERANCE + _LATENCY_SLACK_SECONDS * 1000,
+                msg='{} is slower'.format(name))
+        return response
+
+    def _post_command(self, text):
+        return self.app.post('/handle_slack_command', data={
+            'token': 'meowser_token',
+            'text': text,
+            'user_name': 'retroman',
+            'channel_id': '123456',
+            'command': '/retro',
+            'response_url': 'https://lambda-to-slack.com',
+        })
+
+    def _click_button(self, action, callback_id):
+        return self.app.post('/handle_slack_button_click', data={'payload': json.dumps({
+            'token': 'meowser_token',
+            'callback_id': callback_id,
+            'response_url': 'https://lambda-to-slack.com',
+            'actions': [{'name': action, 'value': 'Good' if action == 'new' else '1'}],
+            'attachment_id': '1',
+            'original_message': {'attachments': [{'id': 1}]},
+        })})
+
+    def _benchmark(self, size):
+        self._fill_base(size)
+
+        self._measure(
+            'good/{}/cold'.format(size), lambda: self._post_command('good The coffee was great'))
+        self._measure(
+            'good/{}/warm'.format(size), lambda: self._post_command('good The tea was great'))
+        self._clear_items_cache()
+        list_response = self._measure(
+            'list/{}/cold'.format(size), lambda: self._post_command('list'))
+        self._measure('list/{}/warm'.format(size), lambda: self._post_command('list'))
+        self._measure('list try/{}'.format(size), lambda: self._post_command('list try'))
+        self._measure('mood/{}'.format(size), lambda: self._post_command('mood'))
+
+        attachments = list_response.json['attachments']
+        commit_id = next(
+            a['callback_id'] for a in attachments
+            if a.get('actions') and a['actions'][0]['name'] == 'commit')
+        complete_id = next(
+            a['callback_id'] for a in attachments
+            if a.get('actions') and a['actions'][0]['name'] == 'complete')
+        good_ids = next(
+            a['callback_id'] for a in attachments
+            if a.get('actions') and a['actions'][0].get('value') == 'Good')
+        self._measure('button commit/{}'.format(size), lambda: self._click_button(
+            'commit', commit_id))
+        self._measure('button complete/{}'.format(size), lambda: self._click_button(
+            'complete', complete_id))
+        self._measure('button new/{}'.format(size), lambda: self._click_button('new', good_ids))
+
+        self._measure('new/{}'.format(size), lambda: self._post_command('new'))
+
+    # As the name of the tests are self-explanatory, we don't need docstrings for them
+    # pylint: disable=missing-docstring
+    def test_100_items(self):
+        self._benchmark(100)
+
+    def test_1000_items(self):
+        self._benchmark(1000)
+
+    def test_10000_items(self):
+        self._benchmark(10000)
+
+
+class SqliteBenchmarkTest(BenchmarkTest):
+    """Benchmark the /retro commands with a SQLite storage."""
+
+    _storage_name = 'sqlite '
+
+    def _benchmark(self, size):
+        config = slack_retro_bot_to_airtable._TENANTS[  # pylint: disable=protected-access
+            tenants.DEFAULT_TENANT_ID]
+        with mock.patch.dict(
+                slack_retro_bot_to_airtable.__name__ + '._TENANTS',
+                {config.tenant_id: config._replace(sqlite_path=':memory:')}):
+            super(SqliteBenchmarkTest, self)._benchmark(size)
+            # Airtable needs a formula that airtablemock does not support to find the new items.
+            self._measure(
+                'search/{}/cold'.format(size), lambda: self._post_command('search item 7'))
+            self._measure(
+                'search/{}/warm'.format(size), lambda: self._post_command('search item 7'))
+
+    def _fill_base(self, size):
+        # pylint: disable=protected-access
+        sqlite_storage = slack_retro_bot_to_airtable._get_tenant(
+            tenants.DEFAULT_TENANT_ID).storage
+        old_item = sqlite_storage.create_item({
+            'Category': 'good', 'Object': 'Old item', 'Created At': '2018-10-01T10:00:00.000Z'})
+        sqlite_storage.update_item(old_item['id'], {'Reviewed At': '2018-10-10T10:00:00.000Z'})
+        categories = ('good', 'bad', 'try')
+        for index in range(size):
+            category = categories[index % len(categories)]
+            fields = {
+                'Category': category,
+                'Object': 'Item #{}'.format(index),
+                'Created At': '2018-10-{:02d}T10:00:00.000Z'.format(index % 28 + 1),
+            }
+            if category == 'try' and index % 2:
+                fields['Committed ?'] = True
+                if index % 4 == 1:
+                    fields['Completed At'] = '2018-10-17T10:00:00.000Z'
+            sqlite_storage.create_item(fields)
+        now = datetime.datetime.utcnow().isoformat(timespec='milliseconds') + 'Z'
+        for index in range(size):
+            sqlite_storage.create_mood({
+                'Name': 'Person #{}'.format(index),
+                'How are you feeling at Bayes': "I'm happy, \nI'm tired",
+                'Feeling at bayes free text': 'Nothing to declare',
+                'How is your work going': 'I am quite productive',
+                'Created At': now,
+            })
+
+    def _clear_items_cache(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""Test the setup, the /retro commands reading the history and the mood webhook, on SQLite."""
+
+import datetime
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from os import environ, path
+
+import mock
+
+import slack_retro_bot_to_airtable
+import tenants
+import typeform_test
+
+_TENANT = tenants.TenantConfig(
+    tenant_id=tenants.DEFAULT_TENANT_ID, slack_token='meowser_token',
+    slack_webhook_url='https://slack/hook', airtable_base_id=None, airtable_api_key=None,
+    sqlite_path=':memory:')
+_MOOD_TENANT = _TENANT._replace(typeform_secret='typeform-secret')
+
+
+@mock.patch(slack_retro_bot_to_airtable.__name__ + '._STEPS_TO_FINISH_SETUP', None)
+@mock.patch.dict(
+    slack_retro_bot_to_airtable.__name__ + '._TENANTS', {_TENANT.tenant_id: _TENANT}, clear=True)
+class TestBotHistory(unittest.TestCase):
+    """Test the /retro commands that read the items of all the sprints."""
+
+    def setUp(self):
+        super(TestBotHistory, self).setUp()
+        self.app = slack_retro_bot_to_airtable.app.test_client()
+        # pylint: disable=protected-access
+        slack_retro_bot_to_airtable._TENANT_POOL.clear()
+        self.addCleanup(slack_retro_bot_to_airtable._TENANT_POOL.clear)
+
+    def _post_command(self, text, slash_command='/retro'):
+        return self.app.post('/handle_slack_command', data={
+            'token': 'meowser_token',
+            'text': text,
+            'user_name': 'retroman',
+            'channel_id': '123456',
+            'command': slash_command,
+            'response_url': 'https://lambda-to-slack.com',
+        })
+
+    def test_click_unknown_item(self):
+        """A click on an item that cannot be updated is answered without changing the message."""
+
+        robo_response = self.app.post('/handle_slack_button_click', data={'payload': json.dumps({
+            'token': 'meowser_token',
+            'callback_id': 'recUnknown',
+            'response_url': 'https://lambda-to-slack.com',
+            'actions': [{'name': 'commit', 'value': '1'}],
+            'attachment_id': '1',
+            'original_message': {'attachments': [{'id': 1}]},
+        })})
+
+        self.assertEqual(200, robo_response.status_code)
+        self.assertFalse(robo_response.json['replace_original'])
+        self.assertIn('was unable to update this item', robo_response.json['text'])
+
+    @mock.patch.dict(
+        slack_retro_bot_to_airtable.__name__ + '._COMMAND_LATENCY_BUDGETS', {'mood': 2})
+    @mock.patch.dict(
+        slack_retro_bot_to_airtable.__name__ + '._COMMAND_LATENCY_ESTIMATES', {'mood': 5})
+    @mock.patch.dict(slack_retro_bot_to_airtable.__name__ + '._COMMAND_DEFERRALS', clear=True)
+    @mock.patch(slack_retro_bot_to_airtable.__name__ + '._async_respond_to_command')
+    def test_deferred_command_measured_again(self, mock_respond):
+        """A command deferred to other containers is run here from time to time."""
+
+        for unused_index in range(3):
+            robo_response = self._post_command(text='mood')
+            self.assertEqual('⏳ Working on it...', robo_response.json['text'])
+        self.assertEqual(3, mock_respond.call_count)
+
+        robo_response = self._post_command(text='mood')
+        self.assertEqual('No mood items for this week yet.', robo_response.json['text'])
+        # pylint: disable=protected-access
+        self.assertLess(slack_retro_bot_to_airtable._COMMAND_LATENCY_ESTIMATES['mood'], 5)
+
+    def test_list_cache(self):
+        """A list is only rendered again when its items have changed."""
+
+        self._post_command(text='The coffee', slash_command='good')
+        first_list = self._post_command(text='list')
+
+        with mock.patch.object(
+                slack_retro_bot_to_airtable.item_report, 'get_attachments') as mock_render:
+            self.assertEqual(first_list.data, self._post_command(text='list').data)
+            mock_render.assert_not_called()
+
+        self._post_command(text='The tea', slash_command='good')
+        self.assertEqual(
+            ['Good', 'The coffee', 'The tea', None],
+            [attachment.get('title') or attachment.get('text')
+             for attachment in self._post_command(text='list').json['attachments']])
+
+    @mock.patch('requests.Session.post')
+    def test_search(self, mock_post):
+        """Items of past sprints can be found by their words, category and creator."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        self._post_command(text='The coffee was cold', slash_command='bad')
+        self._post_command(text='new', slash_command='retro')
+        self._post_command(text='Cold tea', slash_command='bad')
+
+        # The index is built in the background.
+        robo_response = self._post_command(text='search cold', slash_command='retro')
+        self.assertEqual('⏳ Working on it...', robo_response.json['text'])
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+        self.assertEqual([
+            '2 retrospective items match "cold": 2 Bad',
+            '• *Bad* Cold tea _(retroman, {})_'.format(today),
+            '• *Bad* The coffee was cold _(retroman, {})_'.format(today),
+        ], mock_post.call_args[1]['json']['text'].split('\n'))
+
+        robo_response = self._post_command(
+            text='search coffee category:good', slash_command='retro')
+        self.assertIn(
+            '1 retrospective items match "coffee": 1 Good', robo_response.json['text'])
+
+        robo_response = self._post_command(
+            text='search coffee creator:somebody', slash_command='retro')
+        self.assertEqual('No retrospective items match "coffee".', robo_response.json['text'])
+
+    @mock.patch('requests.Session.post')
+    def test_export(self, mock_post):
+        """All the items can be exported to a file, in the background."""
+
+        self.assertIn(
+            'Exports are not enabled',
+            self._post_command(text='export items', slash_command='retro').json['text'])
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        self._post_command(text='new', slash_command='retro')
+        self._post_command(text='Cold tea', slash_command='bad')
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with mock.patch(slack_retro_bot_to_airtable.__name__ + '._RETRO_EXPORT_FOLDER', folder):
+            self.assertEqual(
+                'Oops, use *export <items/moods> [csv] [<since ISO time>]*.',
+                self._post_command(text='export sprints', slash_command='retro').json['text'])
+            self.assertEqual(
+                'Oops, "yesterday" is not an ISO time in UTC, e.g. 2018-10-01T00:00:00.000Z.',
+                self._post_command(
+                    text='export items yesterday', slash_command='retro').json['text'])
+            robo_response = self._post_command(text='export items csv', slash_command='retro')
+
+        output_path = path.join(folder, 'default.items.csv')
+        self.assertEqual(
+            'Exporting the items to `{}`...'.format(output_path), robo_response.json['text'])
+        self.assertTrue(mock_post.call_args[1]['json']['text'].startswith(
+            'Exported 2 items to `{}`.'.format(output_path)))
+        with open(output_path, encoding='utf-8') as output_file:
+            self.assertEqual(3, len(output_file.read().splitlines()))
+
+
+@mock.patch(slack_retro_bot_to_airtable.__name__ + '._STEPS_TO_FINISH_SETUP', None)
+@mock.patch.dict(
+    slack_retro_bot_to_airtable.__name__ + '._TENANTS', {_MOOD_TENANT.tenant_id: _MOOD_TENANT},
+    clear=True)
+class TestMoodSubmission(unittest.TestCase):
+    """Test the webhook receiving the moods submitted to Typeform."""
+
+    def setUp(self):
+        super(TestMoodSubmission, self).setUp()
+        self.app = slack_retro_bot_to_airtable.app.test_client()
+        # pylint: disable=protected-access
+        slack_retro_bot_to_airtable._TENANT_POOL.clear()
+        self.addCleanup(slack_retro_bot_to_airtable._TENANT_POOL.clear)
+
+    def _submit(self, token, name, feelings, submitted_at=None, secret='typeform-secret'):
+        payload = typeform_test.create_payload(token, name, feelings)
+        payload['form_response']['submitted_at'] = \
+            submitted_at or datetime.datetime.utcnow().isoformat() + 'Z'
+        body = json.dumps(payload).encode('utf-8')
+        return self.app.post(
+            '/handle_mood_submission', data=body, content_type='application/json',
+            headers={'Typeform-Signature': typeform_test.sign(secret, body)})
+
+    @mock.patch('requests.Session.post')
+    def test_weekly_report(self, mock_post):
+        """Submitted moods are saved, and the weekly report joins their formatted sections."""
+
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        patcher = mock.patch(
+            slack_retro_bot_to_airtable.__name__ + '._RETRO_MOOD_SECTIONS_FOLDER', folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertEqual(
+            401, self._submit('token1', 'Pascal', ["I'm happy"], secret='wrong').status_code)
+        self.assertEqual(200, self._submit('token1', 'Pascal', ["I'm happy"]).status_code)
+        # Sent again by Typeform.
+        self.assertEqual(200, self._submit('token1', 'Pascal', ["I'm happy"]).status_code)
+        self.assertEqual(200, self._submit('token2', 'Cyrille', ["I'm tired"]).status_code)
+        self.assertEqual(400, self.app.post(
+            '/handle_mood_submission', data=b'{}', content_type='application/json',
+            headers={'Typeform-Signature': typeform_test.sign('typeform-secret', b'{}')},
+        ).status_code)
+
+        retro_storage = slack_retro_bot_to_airtable.get_storage()
+        self.assertEqual(
+            ['Pascal', 'Cyrille'],
+            [mood['fields']['Name'] for mood in retro_storage.iterate_moods()])
+
+        with mock.patch.object(retro_storage, 'iterate_moods') as mock_iterate_moods:
+            slack_retro_bot_to_airtable.send_retro_mood()
+
+        mock_iterate_moods.assert_not_called()
+        text = mock_post.call_args[1]['json']['text']
+        self.assertIn(":hugging_face: I'm happy", text)
+        self.assertLess(text.index('*Pascal*'), text.index('*Cyrille*'))
+
+        # A mood that was not received by the webhook.
+        retro_storage.create_mood({
+            'Name': 'Florian', 'Created At': datetime.datetime.utcnow().isoformat() + 'Z'})
+        slack_retro_bot_to_airtable.send_retro_mood()
+        self.assertIn('*Florian*', mock_post.call_args[1]['json']['text'])
+
+    @mock.patch('requests.Session.post')
+    def test_retry_without_sections(self, mock_post):
+        """Without a folder for the sections, a retried submission is found in the moods."""
+
+        submitted_at = datetime.datetime.utcnow().isoformat() + 'Z'
+        for unused_attempt in range(2):
+            self.assertEqual(
+                200, self._submit('token1', 'Pascal', ["I'm happy"], submitted_at).status_code)
+
+        self.assertEqual(
+            1, len(list(slack_retro_bot_to_airtable.get_storage().iterate_moods())))
+        slack_retro_bot_to_airtable.send_retro_mood()
+        self.assertIn('*Pascal*', mock_post.call_args[1]['json']['text'])
+
+
+class TestSetup(unittest.TestCase):
+    """Test the checks of the env variables."""
+
+    def test_write_queue_in_temp_folder(self):
+        """The write queue must not be in the temp folder of a container."""
+
+        steps = subprocess.check_output(
+            [
+                sys.executable, '-c',
+                'import {0}; print({0}._STEPS_TO_FINISH_SETUP)'.format(
+                    slack_retro_bot_to_airtable.__name__),
+            ],
+            env=dict(
+                environ, SLACK_RETRO_TOKEN='token', SLACK_WEBHOOK_URL='https://slack/hook',
+                RETRO_SQLITE_PATH=':memory:', RETRO_WRITE_QUEUE_FOLDER=tempfile.gettempdir()),
+            cwd=path.dirname(path.abspath(__file__)),
+        ).decode('utf-8')
+
+        self.assertIn('RETRO_WRITE_QUEUE_FOLDER', steps)
+
+
+if __name__ == '__main__':
+    unittest.main()
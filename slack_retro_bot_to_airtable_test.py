@@ -1,18 +1,64 @@
 #!/usr/bin/env python
 """Test /retro commands."""
 
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
 import textwrap
+import time
 import unittest
-from os import environ
+from os import environ, path
 
+from airtable import airtable
 import airtablemock
 import mock
 
+import airtable_client
+import idempotency
 import slack_retro_bot_to_airtable
+import tenants
+
+_TENANT = tenants.TenantConfig(
+    tenant_id=tenants.DEFAULT_TENANT_ID, slack_token='meowser_token',
+    slack_webhook_url='https://slack/hook', airtable_base_id='retro-base-id',
+    airtable_api_key='api-key')
+_RealAirtableClient = airtable_client.AirtableClient
+
+
+class _AirtableWithBatchUpdate(airtablemock.Airtable):
+    """Airtable mock client that also accepts multi-record updates."""
+
+    def __init__(self, *args, **kwargs):
+        super(_AirtableWithBatchUpdate, self).__init__(*args, **kwargs)
+        self.batch_update_sizes = []
+
+    def update(self, table_name, record_id, data):
+        try:
+            return super(_AirtableWithBatchUpdate, self).update(table_name, record_id, data)
+        except KeyError as error:
+            raise airtable.AirtableError(
+                'NOT_FOUND', 'Could not find record {}'.format(record_id)) from error
+
+    def batch_update(self, table_name, records):
+        """Update several records in a single request, all or nothing."""
+
+        if len(records) > 10:
+            raise airtable.AirtableError('INVALID_RECORDS', 'Too many records')
+        self.batch_update_sizes.append(len(records))
+        table = self._table(table_name)
+        missing_ids = [record['id'] for record in records if record['id'] not in table]
+        if missing_ids:
+            raise airtable.AirtableError('NOT_FOUND', 'Could not find records {}'.format(
+                missing_ids))
+        return [self.update(table_name, record['id'], record['fields']) for record in records]
 
 
 @mock.patch(slack_retro_bot_to_airtable.__name__ + '._STEPS_TO_FINISH_SETUP', None)
-@mock.patch(slack_retro_bot_to_airtable.__name__ + '._SLACK_RETRO_TOKEN', 'meowser_token')
+@mock.patch.dict(
+    slack_retro_bot_to_airtable.__name__ + '._TENANTS', {_TENANT.tenant_id: _TENANT}, clear=True)
 class TestBot(unittest.TestCase):
     """Test /retro commands."""
 
@@ -24,16 +70,19 @@ class TestBot(unittest.TestCase):
         self.app = slack_retro_bot_to_airtable.app.test_client()
 
         airtablemock.clear()
-        self.airtable_client = airtablemock.Airtable('retro-base-id')
-        patcher = mock.patch(
-            slack_retro_bot_to_airtable.__name__ + '._AIRTABLE_CLIENT',
-            self.airtable_client)
+        self.airtable_client = _AirtableWithBatchUpdate('retro-base-id')
+        patcher = mock.patch('airtable_client.AirtableClient', return_value=self.airtable_client)
         patcher.start()
+        self.addCleanup(patcher.stop)
+        # pylint: disable=protected-access
+        slack_retro_bot_to_airtable._TENANT_POOL.clear()
+        self.addCleanup(slack_retro_bot_to_airtable._TENANT_POOL.clear)
 
         self.airtable_client.create('Items', {'sprint': 'old'})
         self.airtable_client.create_view('Items', 'Current View', 'sprint != "old"')
         self.airtable_client.create('Moods', {'sprint': 'old'})
         self.airtable_client.create_view('Moods', 'Current View', 'sprint != "old"')
+        airtablemock.create_empty_table('retro-base-id', 'Mood Trend')
 
     def _post_command(self, text, slash_command='/retro'):
 
@@ -130,6 +179,85 @@ class TestBot(unittest.TestCase):
         self.assertEqual('retroman', item['Creator'])
         self.assertEqual(expected_text, item['Object'])
 
+    def test_set_duplicate_retrospective_item(self):
+        """Items differing only by case and spaces are duplicates."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        with mock.patch.object(self.airtable_client, 'iterate') as mock_iterate:
+            robo_response = self._post_command(
+                text='good the  Coffee was GREAT ', slash_command='retro')
+        mock_iterate.assert_not_called()
+
+        self.assertEqual(
+            'This retrospective item has already been added!', robo_response.json['text'])
+        items = self.airtable_client.get('Items', view='Current View')['records']
+        self.assertEqual(1, len(items), msg=items)
+
+    def test_set_retrospective_item_failure(self):
+        """The user is told when an item could not be saved."""
+
+        with mock.patch.object(self.airtable_client, 'create') as mock_create, \
+                self.assertLogs(level='ERROR'):
+            mock_create.side_effect = airtable.AirtableError('SERVICE_UNAVAILABLE', 'Down')
+            robo_response = self._post_command(text='The coffee was great', slash_command='good')
+
+        self.assertRegex(
+            robo_response.json['text'], r'unable to save the retrospective item: .*Down')
+
+    @mock.patch(
+        slack_retro_bot_to_airtable.__name__ + '._SLACK_RESPONSES',
+        idempotency.ResponseCache(ttl_seconds=600, max_entries=10))
+    def test_slack_retry_of_command(self):
+        """A command retried by Slack is only run once."""
+
+        form = {
+            'token': 'meowser_token',
+            'text': 'The coffee was great',
+            'user_name': 'retroman',
+            'channel_id': '123456',
+            'command': 'good',
+            'response_url': 'https://lambda-to-slack.com',
+            'trigger_id': '1234.5678',
+        }
+        first_response = self.app.post('/handle_slack_command', data=form)
+        with self.assertLogs(level='INFO'):
+            retry_response = self.app.post(
+                '/handle_slack_command', data=form,
+                headers={'X-Slack-Retry-Num': '1', 'X-Slack-Retry-Reason': 'http_timeout'})
+
+        self.assertEqual('New retrospective item:', retry_response.json['text'])
+        self.assertEqual(first_response.json, retry_response.json)
+        items = self.airtable_client.get('Items', view='Current View')['records']
+        self.assertEqual(1, len(items))
+
+        other_response = self.app.post(
+            '/handle_slack_command', data=dict(form, trigger_id='1234.9999'))
+        self.assertIn('already', other_response.json['text'])
+
+    def test_set_same_object_in_other_category(self):
+        """The same text can be used in different categories."""
+
+        self._post_command(text='The coffee', slash_command='good')
+        robo_response = self._post_command(text='The coffee', slash_command='bad')
+
+        self.assertEqual('New retrospective item:', robo_response.json['text'])
+
+    def test_duplicate_index_without_cached_records(self):
+        """Duplicates are found even when the view is too big to be cached."""
+
+        with mock.patch.object(
+                # pylint: disable=protected-access
+                slack_retro_bot_to_airtable._get_tenant(_TENANT.tenant_id).storage.items_cache,
+                '_max_records', 0):
+            self._post_command(text='The coffee was great', slash_command='good')
+            with mock.patch.object(self.airtable_client, 'iterate') as mock_iterate:
+                robo_response = self._post_command(
+                    text='The coffee was great', slash_command='good')
+        mock_iterate.assert_not_called()
+
+        self.assertEqual(
+            'This retrospective item has already been added!', robo_response.json['text'])
+
     def test_list(self):
         """ Test getting the list of all items with POST."""
 
@@ -220,6 +348,101 @@ class TestBot(unittest.TestCase):
 
         self.assertEqual(expected_button, good_button)
 
+    def test_list_from_cache(self):
+        """Consecutive commands do not download the current view again, only new items."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        with mock.patch.object(self.airtable_client, 'iterate') as mock_iterate:
+            self._post_command(text='The coffee was bad', slash_command='bad')
+            robo_response = self._post_command(text='list', slash_command='retro')
+            duplicate_response = self._post_command(
+                text='The coffee was bad', slash_command='bad')
+        self.assertEqual(
+            ['AND(Category = "bad", Object = "The coffee was bad")'],
+            [call[1].get('filter_by_formula') for call in mock_iterate.call_args_list])
+
+        self.assertEqual(
+            ['The coffee was great', 'The coffee was bad'],
+            [a['text'] for a in robo_response.json['attachments'] if 'text' in a])
+        self.assertEqual(
+            'This retrospective item has already been added!', duplicate_response.json['text'])
+
+    def test_list_cache_expires(self):
+        """Items added directly in Airtable show up once the cache expires."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        self.airtable_client.create('Items', {'Category': 'bad', 'Object': 'The tea was bad'})
+
+        robo_response = self._post_command(text='list bad', slash_command='retro')
+        self.assertEqual('No retrospective items yet.', robo_response.json['text'])
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 3600):
+            robo_response = self._post_command(text='list bad', slash_command='retro')
+        self.assertEqual(
+            {'color': 'danger', 'text': 'The tea was bad'}, robo_response.json['attachments'][1])
+
+    def test_duplicate_from_other_container(self):
+        """Items added by another container are found as duplicates before the cache expires."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        self.airtable_client.create('Items', {'Category': 'bad', 'Object': 'The tea was bad'})
+
+        robo_response = self._post_command(text='The tea was bad', slash_command='bad')
+        self.assertEqual(
+            'This retrospective item has already been added!', robo_response.json['text'])
+
+    def test_list_many_items(self):
+        """All the pages of the view are read, with only the needed fields."""
+
+        pages = [
+            {
+                'records': [
+                    {'id': 'rec{}'.format(index), 'fields': {
+                        'Category': 'good', 'Object': 'Item #{}'.format(index)}}
+                    for index in range(start, start + 100)],
+                'offset': 'page{}'.format(start + 100),
+            }
+            for start in (0, 100)
+        ]
+        pages[-1].pop('offset')
+        with mock.patch('requests.Session.request') as mock_request, \
+                mock.patch('airtable_client.AirtableClient', new=_RealAirtableClient):
+            mock_request.return_value.status_code = 200
+            mock_request.return_value.json.side_effect = pages
+            robo_response = self._post_command(text='list', slash_command='retro')
+
+        self.assertEqual(2, mock_request.call_count)
+        second_page_params = mock_request.call_args[1]['params']
+        self.assertEqual('page100', second_page_params['offset'])
+        self.assertEqual(
+            ['Category', 'Object', 'Committed ?', 'Completed At'], second_page_params['fields[]'])
+        # Title, 200 items and the review button.
+        self.assertEqual(202, len(robo_response.json['attachments']))
+
+    @mock.patch('requests.Session.post')
+    def test_request_timings(self, mock_post):
+        """The time spent in each phase is logged and sent back in a header."""
+
+        mock_post.return_value.request.body = b'{"text": "Done"}'
+        mock_post.return_value.content = b'ok'
+        self._post_command(text='The coffee was great', slash_command='good')
+
+        with self.assertLogs(level='INFO') as logs:
+            robo_response = self._post_command(text='new', slash_command='retro')
+
+        self.assertRegex(
+            robo_response.headers['Server-Timing'],
+            r'^render;dur=[0-9.]+;desc="2 calls", slack;dur=[0-9.]+;desc="1 calls", '
+            r'total;dur=[0-9.]+$')
+        timings_logs = [log for log in logs.output if 'Request timings' in log]
+        self.assertEqual(1, len(timings_logs), msg=logs.output)
+        timings = json.loads(timings_logs[0].split('Request timings: ', 1)[1])
+        self.assertEqual('command new', timings['name'])
+        self.assertEqual({'slack': 1}, timings['remote_calls'])
+        self.assertEqual(16, timings['bytes_sent'])
+        self.assertEqual(2, timings['bytes_received'])
+        self.assertEqual(['render', 'slack'], sorted(timings['spans_ms']))
+
     def test_list_wrong_category(self):
         """ Test listing by an unknown category."""
 
@@ -236,6 +459,198 @@ class TestBot(unittest.TestCase):
         }
         self.assertEqual(expected_list, robo_response.json)
 
+    @mock.patch('requests.Session.post')
+    @mock.patch.dict(
+        slack_retro_bot_to_airtable.__name__ + '._COMMAND_LATENCY_BUDGETS', {'list': 2})
+    @mock.patch.dict(
+        slack_retro_bot_to_airtable.__name__ + '._COMMAND_LATENCY_ESTIMATES', {}, clear=True)
+    @mock.patch.dict(slack_retro_bot_to_airtable.__name__ + '._COMMAND_DEFERRALS', clear=True)
+    def test_list_deferred_when_cold(self, mock_post):
+        """A slow command is acknowledged at once, and its response is sent afterwards."""
+
+        self.airtable_client.create('Items', {'Category': 'good', 'Object': 'The coffee'})
+
+        robo_response = self._post_command(text='list', slash_command='retro')
+
+        self.assertEqual(
+            {'response_type': 'ephemeral', 'text': '⏳ Working on it...', 'attachments': []},
+            robo_response.json)
+        mock_post.assert_called_once()
+        self.assertEqual('https://lambda-to-slack.com', mock_post.call_args[0][0])
+        deferred_response = mock_post.call_args[1]['json']
+        self.assertEqual('Retrospective items:', deferred_response['text'])
+        self.assertEqual('in_channel', deferred_response['response_type'])
+
+        # Now that the items are in memory, the command is fast enough.
+        robo_response = self._post_command(text='list', slash_command='retro')
+        self.assertEqual('Retrospective items:', robo_response.json['text'])
+        mock_post.assert_called_once()
+
+    @mock.patch('requests.Session.post')
+    @mock.patch.dict(slack_retro_bot_to_airtable.__name__ + '._COMMAND_LATENCY_BUDGETS', {
+        'good': 2, 'mood': 2})
+    @mock.patch.dict(slack_retro_bot_to_airtable.__name__ + '._COMMAND_LATENCY_ESTIMATES', {
+        'good': .5, 'mood': 5})
+    @mock.patch.dict(slack_retro_bot_to_airtable.__name__ + '._COMMAND_DEFERRALS', clear=True)
+    def test_command_deferred_when_slow(self, mock_post):
+        """Only the commands that are slower than their budget are deferred."""
+
+        robo_response = self._post_command(text='good The coffee', slash_command='retro')
+        self.assertEqual('New retrospective item:', robo_response.json['text'])
+
+        robo_response = self._post_command(text='mood', slash_command='retro')
+        self.assertEqual('⏳ Working on it...', robo_response.json['text'])
+        self.assertEqual(
+            'No mood items for this week yet.', mock_post.call_args[1]['json']['text'])
+
+    def test_parse_latency_budgets(self):
+        """Latency budgets are parsed from the environment variable."""
+
+        self.assertEqual(
+            {'list': 1.5, 'mood': 0},
+            slack_retro_bot_to_airtable._parse_latency_budgets(  # pylint: disable=protected-access
+                'list=1.5, Mood=0,wrong'))
+
+    def test_tenants(self):
+        """Each Slack team, or channel, uses its own Airtable base."""
+
+        other_tenants = {
+            'T2': _TENANT._replace(
+                tenant_id='T2', slack_token='team2_token', airtable_base_id='team2-base-id'),
+            'T2/C3': _TENANT._replace(
+                tenant_id='T2/C3', slack_token='team2_token', airtable_base_id='channel3-base-id'),
+        }
+        for base_id in ('team2-base-id', 'channel3-base-id'):
+            client = airtablemock.Airtable(base_id)
+            client.create('Items', {'sprint': 'old'})
+            client.create_view('Items', 'Current View', 'sprint != "old"')
+
+        def _post(text, token='team2_token', team_id='T2', channel_id='C1'):
+            return self.app.post('/handle_slack_command', data={
+                'token': token,
+                'team_id': team_id,
+                'channel_id': channel_id,
+                'text': text,
+                'user_name': 'retroman',
+                'command': '/retro',
+                'response_url': 'https://lambda-to-slack.com',
+            })
+
+        with mock.patch.dict(
+                slack_retro_bot_to_airtable.__name__ + '._TENANTS', other_tenants), \
+                mock.patch('airtable_client.AirtableClient', new=airtablemock.Airtable):
+            self.assertEqual(200, _post('good The coffee').status_code)
+            self.assertEqual(200, _post('good The tea', channel_id='C3').status_code)
+            self.assertEqual(
+                200, _post('good The cake', token='meowser_token', team_id='T1').status_code)
+            self.assertEqual(401, _post('list', token='meowser_token').status_code)
+
+        def _get_objects(base_id):
+            return [
+                item['fields']['Object']
+                for item in airtablemock.Airtable(base_id).iterate('Items', view='Current View')]
+        self.assertEqual(['The coffee'], _get_objects('team2-base-id'))
+        self.assertEqual(['The tea'], _get_objects('channel3-base-id'))
+        self.assertEqual(['The cake'], _get_objects('retro-base-id'))
+
+    @mock.patch('requests.Session.post')
+    def test_sqlite_storage(self, mock_post):
+        """A team can store its items in a SQLite database instead of Airtable."""
+
+        with mock.patch.dict(
+                slack_retro_bot_to_airtable.__name__ + '._TENANTS',
+                {_TENANT.tenant_id: _TENANT._replace(sqlite_path=':memory:')}):
+            self._post_command(text='The coffee was great', slash_command='good')
+            robo_response = self._post_command(text='the coffee  was great', slash_command='good')
+            self.assertEqual(
+                'This retrospective item has already been added!', robo_response.json['text'])
+            self._post_command(text='The tea was bad', slash_command='bad')
+
+            robo_response = self._post_command(text='list', slash_command='retro')
+            self.assertEqual(
+                ['Good', 'The coffee was great', 'Bad', 'The tea was bad'],
+                [a.get('title', a.get('text')) for a in robo_response.json['attachments']
+                 if 'actions' not in a])
+
+            self._post_command(text='new', slash_command='retro')
+            mock_post.assert_called_once()
+            robo_response = self._post_command(text='list', slash_command='retro')
+            self.assertEqual('No retrospective items yet.', robo_response.json['text'])
+
+        self.assertEqual([], self.airtable_client.get('Items', view='Current View')['records'])
+
+    def test_write_queue(self):
+        """New items can be queued locally before being created in Airtable."""
+
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with mock.patch(
+                slack_retro_bot_to_airtable.__name__ + '._RETRO_WRITE_QUEUE_FOLDER', folder), \
+                mock.patch(
+                    slack_retro_bot_to_airtable.__name__ + '._async_flush_write_queue') \
+                as mock_flush:
+            robo_response = self._post_command(text='The coffee was great', slash_command='good')
+            self.assertEqual('New retrospective item:', robo_response.json['text'])
+            self.assertEqual(
+                [], self.airtable_client.get('Items', view='Current View')['records'])
+
+            robo_response = self._post_command(text='the coffee was great', slash_command='good')
+            self.assertEqual(
+                'This retrospective item has already been added!', robo_response.json['text'])
+            robo_response = self._post_command(text='list', slash_command='retro')
+            self.assertEqual(
+                'The coffee was great', robo_response.json['attachments'][1]['text'])
+            # The items are created by a background task.
+            mock_flush.assert_called_once_with(tenants.DEFAULT_TENANT_ID)
+
+            slack_retro_bot_to_airtable.warm_up()
+
+        items = self.airtable_client.get('Items', view='Current View')['records']
+        self.assertEqual(
+            ['The coffee was great'], [item['fields']['Object'] for item in items])
+
+    @mock.patch(slack_retro_bot_to_airtable.__name__ + '._TENANT_POOL._max_size', 1)
+    def test_inactive_tenants_are_dropped(self):
+        """Only the resources of the most recently active tenants are kept."""
+
+        # pylint: disable=protected-access
+        pool = slack_retro_bot_to_airtable._TENANT_POOL
+        tenant = pool.get(_TENANT.tenant_id)
+        with mock.patch.dict(
+                slack_retro_bot_to_airtable.__name__ + '._TENANTS',
+                {'T2': _TENANT._replace(tenant_id='T2')}):
+            pool.get('T2')
+        self.assertIsNot(tenant, pool.get(_TENANT.tenant_id))
+
+    def test_warm_up(self):
+        """The scheduled warm up loads the items in memory."""
+
+        self.airtable_client.create('Items', {'Category': 'good', 'Object': 'The coffee'})
+
+        slack_retro_bot_to_airtable.warm_up()
+
+        with mock.patch.object(self.airtable_client, 'iterate') as mock_iterate:
+            robo_response = self._post_command(text='list', slash_command='retro')
+        mock_iterate.assert_not_called()
+        self.assertEqual('Retrospective items:', robo_response.json['text'])
+
+    def test_import_is_lazy(self):
+        """Slow modules are not imported until they are needed."""
+
+        imported_modules = subprocess.check_output(
+            [
+                sys.executable, '-c',
+                'import sys, {}; print(" ".join(sys.modules))'.format(
+                    slack_retro_bot_to_airtable.__name__),
+            ],
+            env=dict(
+                environ, AIRTABLE_RETRO_BASE_ID='retro-base-id', AIRTABLE_RETRO_API_KEY='key'),
+            cwd=path.dirname(path.abspath(__file__)),
+        ).decode('utf-8').split()
+
+        for module in ('airtable', 'boto3', 'requests', 'zappa'):
+            self.assertNotIn(module, imported_modules)
+
     def test_mood(self):
         """Test listing the mood for everyone."""
 
@@ -267,6 +682,242 @@ class TestBot(unittest.TestCase):
             },
             robo_response.json)
 
+    @mock.patch('requests.Session.post')
+    def test_mark_all_as_reviewed(self, mock_post):
+        """Marking all items as reviewed sends multi-record updates."""
+
+        for index in range(25):
+            self._post_command(text='The coffee was great #{}'.format(index), slash_command='good')
+
+        self._post_command(text='new', slash_command='retro')
+
+        self.assertEqual([10, 10, 5], sorted(self.airtable_client.batch_update_sizes, reverse=True))
+        items = self.airtable_client.get('Items', view='Current View')['records']
+        self.assertEqual(25, len(items))
+        self.assertTrue(all(item['fields'].get('Reviewed At') for item in items))
+        mock_post.assert_called_once()
+        self.assertEqual('https://lambda-to-slack.com', mock_post.call_args[0][0])
+
+    def _click_button(self, action, item_id):
+        return self.app.post('/handle_slack_button_click', data={'payload': json.dumps({
+            'token': 'meowser_token',
+            'callback_id': item_id,
+            'response_url': 'https://lambda-to-slack.com',
+            'actions': [{'name': action, 'value': '1'}],
+            'attachment_id': '1',
+            'original_message': {'attachments': [{'id': 1}]},
+        })})
+
+    @mock.patch('requests.Session.post')
+    def test_stats(self, unused_mock_post):
+        """Stats are counted as items are written, by sprint."""
+
+        self.assertEqual(
+            'Stats are not enabled, set RETRO_STATS_FOLDER to enable them.',
+            self._post_command(text='stats', slash_command='retro').json['text'])
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        patcher = mock.patch(slack_retro_bot_to_airtable.__name__ + '._RETRO_STATS_FOLDER', folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        slack_retro_bot_to_airtable._TENANT_POOL.clear()  # pylint: disable=protected-access
+        self.assertEqual(
+            'No stats yet, they are counted as new items are added.',
+            self._post_command(text='stats', slash_command='retro').json['text'])
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        self._post_command(text='The tea was bad', slash_command='bad')
+        self._post_command(text='More coffee', slash_command='try')
+        self._post_command(text='Less tea', slash_command='try')
+        try_id = next(
+            item['id'] for item in self.airtable_client.get('Items', view='Current View')['records']
+            if item['fields']['Object'] == 'More coffee')
+        self._click_button('commit', try_id)
+        self._post_command(text='new', slash_command='retro')
+        self._click_button('complete', try_id)
+
+        robo_response = self._post_command(text='stats', slash_command='retro')
+
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+        self.assertEqual([
+            ':bar_chart: Stats of the last 2 sprints',
+            '',
+            '• {} → now: no items'.format(today),
+            '• {0} → {0}: 1 good, 1 bad, 2 try'.format(today),
+            '*Top contributors:* retroman (4)',
+            '*Try items:* 1 committed out of 2 (50%), 1 completed (100% of them)',
+            '*Median time to complete a try:* 0.0 days',
+        ], robo_response.json['text'].split('\n'))
+
+    @mock.patch('requests.Session.post')
+    def test_mark_as_reviewed_partial_failure(self, mock_post):
+        """Records that cannot be updated are reported, the others are still updated."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        self._post_command(text='The tea was great', slash_command='good')
+        item_ids = [item['id'] for item in self.airtable_client.get(
+            'Items', view='Current View')['records']]
+
+        robo_response = self.app.post('/handle_slack_button_click', data={'payload': json.dumps({
+            'token': 'meowser_token',
+            'callback_id': ','.join(item_ids + ['recUnknown']),
+            'response_url': 'https://lambda-to-slack.com',
+            'actions': [{'name': 'new', 'value': 'Good'}],
+            'attachment_id': '2',
+            'original_message': {'attachments': [
+                {'id': 1, 'text': 'The coffee was great'},
+                {'id': 2, 'actions': [{'name': 'new'}]},
+            ]},
+        })})
+
+        self.assertEqual(
+            {'id': 2, 'actions': [], 'text': 'Marking these retrospective items as reviewed...'},
+            robo_response.json['attachments'][1])
+        items = self.airtable_client.get('Items', view='Current View')['records']
+        self.assertTrue(all(item['fields'].get('Reviewed At') for item in items))
+        text = mock_post.call_args[1]['json']['text']
+        self.assertIn('1 items could not be marked as reviewed', text)
+
+    def test_review_in_another_container(self):
+        """The items under review are not listed anymore, even before the task has run."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        with mock.patch(slack_retro_bot_to_airtable.__name__ + '.'
+                        '_async_mark_retrospective_items_as_reviewed') as mock_review:
+            self._post_command(text='new', slash_command='retro')
+
+        mock_review.assert_called_once()
+        self.assertEqual(
+            'No retrospective items yet.', self._post_command(text='list').json['text'])
+
+    @mock.patch('requests.Session.post')
+    def test_mark_tries_as_reviewed(self, mock_post):
+        """The items that remain after the review are sent to Slack, without the reviewed ones."""
+
+        self._post_command(text='More coffee', slash_command='try')
+        self._post_command(text='Less tea', slash_command='try')
+        items = self.airtable_client.get('Items', view='Current View')['records']
+        more_coffee_id = next(
+            item['id'] for item in items if item['fields']['Object'] == 'More coffee')
+        self._click_button('commit', more_coffee_id)
+        less_tea_id = next(item['id'] for item in items if item['id'] != more_coffee_id)
+
+        self.app.post('/handle_slack_button_click', data={'payload': json.dumps({
+            'token': 'meowser_token',
+            'callback_id': less_tea_id,
+            'response_url': 'https://lambda-to-slack.com',
+            'actions': [{'name': 'new', 'value': 'Try'}],
+            'attachment_id': '1',
+            'original_message': {'attachments': [{'id': 1, 'actions': [{'name': 'new'}]}]},
+        })})
+
+        message = mock_post.call_args[1]['json']
+        self.assertEqual(
+            "Try items marked as reviewed!\nHere are the remaining 'try' items to complete:",
+            message['text'])
+        self.assertEqual(
+            ['More coffee'],
+            [attachment['text'] for attachment in message['attachments'] if 'text' in attachment])
+
+    @mock.patch(
+        slack_retro_bot_to_airtable.__name__ + '._SLACK_RESPONSES',
+        idempotency.ResponseCache(ttl_seconds=600, max_entries=10))
+    @mock.patch('requests.Session.post')
+    def test_slack_retry_of_button_click(self, mock_post):
+        """A button click retried by Slack only marks the items as reviewed once."""
+
+        self._post_command(text='The coffee was great', slash_command='good')
+        item_ids = [item['id'] for item in self.airtable_client.get(
+            'Items', view='Current View')['records']]
+        form = {'payload': json.dumps({
+            'token': 'meowser_token',
+            'callback_id': ','.join(item_ids),
+            'action_ts': '1234.5678',
+            'response_url': 'https://lambda-to-slack.com',
+            'actions': [{'name': 'new', 'value': 'Good'}],
+            'attachment_id': '1',
+            'original_message': {'attachments': [{'id': 1, 'actions': [{'name': 'new'}]}]},
+        })}
+
+        first_response = self.app.post('/handle_slack_button_click', data=form)
+        with self.assertLogs(level='INFO'):
+            retry_response = self.app.post(
+                '/handle_slack_button_click', data=form, headers={'X-Slack-Retry-Num': '1'})
+
+        self.assertEqual(first_response.json, retry_response.json)
+        self.assertEqual([1], self.airtable_client.batch_update_sizes)
+        mock_post.assert_called_once()
+
+    def test_mood_trend_without_table(self):
+        """Bases that do not have a table for the mood trend get an explanation."""
+
+        airtablemock.clear()
+        with self.assertLogs(level='ERROR'):
+            robo_response = self._post_command(text='mood trend', slash_command='retro')
+
+        self.assertIn('unable to read the mood trend', robo_response.json['text'])
+
+    @mock.patch('requests.Session.post')
+    def test_mood_trend(self, unused_mock_post):
+        """The moods are aggregated by sprint with the weekly report."""
+
+        robo_response = self._post_command(text='mood trend', slash_command='retro')
+        self.assertIn('No mood trend yet', robo_response.json['text'])
+
+        for name, feelings, created_at in (
+                ('Cyrille', "I'm happy", '2018-10-09T10:00:00.000Z'),
+                ('Pascal', "I'm happy, \nI'm ok", '2018-10-16T10:00:00.000Z'),
+                ('Marie', "I'm ok (not much to say), \nI'm happy", '2018-10-17T10:00:00.000Z')):
+            self.airtable_client.create('Moods', {
+                'Name': name,
+                'How are you feeling at Bayes': feelings,
+                'How is your work going': "I'm blocked",
+                'Created At': created_at,
+            })
+        slack_retro_bot_to_airtable.send_retro_mood()
+
+        robo_response = self._post_command(text='mood trend', slash_command='retro')
+        self.assertEqual(textwrap.dedent('''\
+            :chart_with_upwards_trend: How the team felt over the last sprints
+
+            *2018-W41* (1 responses)
+            • _Feeling_ :hugging_face: 1
+            • _Work at Bayes_ :hand: 1
+
+            *2018-W42* (2 responses)
+            • _Feeling_ :hugging_face: 2 :no_mouth: 2
+            • _Work at Bayes_ :hand: 2
+
+            '''), robo_response.json['text'])
+
+    @mock.patch(slack_retro_bot_to_airtable.__name__ + '._SLACK_MAX_MESSAGE_LENGTH', 300)
+    @mock.patch('requests.Session.post')
+    def test_send_mood_in_chunks(self, mock_post):
+        """A long mood report is split between people in several messages."""
+
+        for name in ('Cyrille', 'Pascal', 'Marie', 'Lillie', 'Florian'):
+            self.airtable_client.create('Moods', {
+                'Name': name,
+                'How are you feeling at Bayes': "I'm happy",
+                'How is your work going': 'I am quite productive',
+            })
+
+        slack_retro_bot_to_airtable.send_retro_mood()
+
+        messages = [call[1]['json']['text'] for call in mock_post.call_args_list]
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(len(message), 300)
+            self.assertRegex(message, r'\n\n$')
+        self.assertTrue(messages[0].startswith(':mag: Dear team'))
+        self.assertEqual(
+            ['Cyrille', 'Pascal', 'Marie', 'Lillie', 'Florian'],
+            re.findall(r'^\*(\w+)\*$', ''.join(messages), re.MULTILINE))
+        # pylint: disable=protected-access
+        full_report = slack_retro_bot_to_airtable._get_retrospective_mood_response(
+            slack_retro_bot_to_airtable._get_tenant(_TENANT.tenant_id))
+        self.assertEqual(full_report, ''.join(messages))
+
     # def test_help(self):
     #     """ Test getting the help for the command.
     #     """
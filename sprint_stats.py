@@ -0,0 +1,208 @@
+"""Statistics of the retrospective items by sprint, updated as the bot writes the items.
+
+The counts are kept in a local SQLite database, so that a stats report reads a few rows per sprint
+instead of the whole history of the items. They only cover the items written by the bot since the
+database was created, and are best effort: the bot keeps working if they cannot be updated.
+"""
+
+import collections
+import datetime
+import logging
+import sqlite3
+import threading
+
+import request_timing
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sprints (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        ended_at TEXT
+    );
+    -- Counts of the items by sprint: by "category", by "creator", and of the "try" items that
+    -- were "created", "committed" or "completed".
+    CREATE TABLE IF NOT EXISTS sprint_counts (
+        sprint_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (sprint_id, kind, key)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS completion_times (
+        sprint_id INTEGER NOT NULL,
+        seconds REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS completion_times_by_duration
+        ON completion_times (sprint_id, seconds);
+'''
+
+# The stats of a sprint: its start and end times (None for the current sprint), and its counts of
+# items by category.
+SprintCounts = collections.namedtuple('SprintCounts', ('started_at', 'ended_at', 'categories'))
+# The stats of the last sprints: the SprintCounts of each sprint from the newest to the oldest, the
+# number of items by creator, the number of "try" items created, committed and completed during
+# these sprints, and the median time to complete them in seconds, or None.
+StatsReport = collections.namedtuple('StatsReport', (
+    'sprints', 'creators', 'tries_created', 'tries_committed', 'tries_completed',
+    'median_completion_seconds'))
+
+
+def _parse_time(value):
+    return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+class SprintStats(object):
+    """Counts of the retrospective items of a tenant by sprint."""
+
+    def __init__(self, path):
+        # The connection is shared by the threads of the container, one query at a time.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def _query(self, query, params=()):
+        with request_timing.span('stats'), self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def close(self):
+        """Close the database, once the stats are dropped."""
+
+        with self._lock:
+            self._connection.close()
+
+    def _get_current_sprint_id(self, now):
+        """Get the ID of the current sprint, starting it if needed: to be called with the lock."""
+
+        rows = self._connection.execute(
+            'SELECT id FROM sprints WHERE ended_at IS NULL ORDER BY id DESC LIMIT 1').fetchall()
+        if rows:
+            return rows[0]['id']
+        return self._connection.execute(
+            'INSERT INTO sprints (started_at) VALUES (?)', (now,)).lastrowid
+
+    def _count(self, now, counts, completion_seconds=None):
+        try:
+            with request_timing.span('stats'), self._lock, self._connection:
+                sprint_id = self._get_current_sprint_id(now)
+                for kind, key in counts:
+                    self._connection.execute(
+                        'INSERT OR IGNORE INTO sprint_counts (sprint_id, kind, key, count) '
+                        'VALUES (?, ?, ?, 0)', (sprint_id, kind, key))
+                    self._connection.execute(
+                        'UPDATE sprint_counts SET count = count + 1 '
+                        'WHERE sprint_id = ? AND kind = ? AND key = ?', (sprint_id, kind, key))
+                if completion_seconds is not None:
+                    self._connection.execute(
+                        'INSERT INTO completion_times (sprint_id, seconds) VALUES (?, ?)',
+                        (sprint_id, completion_seconds))
+        except sqlite3.Error as error:
+            logging.warning('Could not update the sprint stats: %s', error)
+
+    def add_item(self, fields):
+        """Count a new item, from its fields in Airtable."""
+
+        category = fields.get('Category', '')
+        counts = [('category', category), ('creator', fields.get('Creator') or '')]
+        if category == 'try':
+            counts.append(('try', 'created'))
+        self._count(fields.get('Created At', ''), counts)
+
+    def commit_try(self, committed_at):
+        """Count a "try" item that the team committed to."""
+
+        self._count(committed_at, [('try', 'committed')])
+
+    def complete_try(self, created_at, completed_at):
+        """Count a "try" item that was completed, with the time it took."""
+
+        seconds = None
+        if created_at:
+            seconds = (_parse_time(completed_at) - _parse_time(created_at)).total_seconds()
+        self._count(completed_at, [('try', 'completed')], completion_seconds=seconds)
+
+    def end_sprint(self, ended_at):
+        """End the current sprint, the next counts are for a new one."""
+
+        try:
+            with request_timing.span('stats'), self._lock, self._connection:
+                sprint_id = self._get_current_sprint_id(ended_at)
+                self._connection.execute(
+                    'UPDATE sprints SET ended_at = ? WHERE id = ?', (ended_at, sprint_id))
+        except sqlite3.Error as error:
+            logging.warning('Could not end the sprint in the stats: %s', error)
+
+    def get_report(self, max_sprints, max_creators):
+        """Get the stats of the last sprints, including the current one."""
+
+        sprints = self._query(
+            'SELECT * FROM sprints ORDER BY id DESC LIMIT ?', (max_sprints,))
+        if not sprints:
+            return StatsReport([], [], 0, 0, 0, None)
+        first_id = sprints[-1]['id']
+
+        counts = collections.defaultdict(collections.Counter)
+        for row in self._query(
+                'SELECT sprint_id, kind, key, count FROM sprint_counts WHERE sprint_id >= ?',
+                (first_id,)):
+            counts[row['sprint_id'], row['kind']][row['key']] += row['count']
+        creators = collections.Counter()
+        tries = collections.Counter()
+        for sprint in sprints:
+            creators.update(counts[sprint['id'], 'creator'])
+            tries.update(counts[sprint['id'], 'try'])
+        # Items without a creator.
+        creators.pop('', None)
+
+        completion_count = self._query(
+            'SELECT COUNT(*) FROM completion_times WHERE sprint_id >= ?', (first_id,))[0][0]
+        median_completion_seconds = None
+        if completion_count:
+            median_completion_seconds = self._query(
+                'SELECT seconds FROM completion_times WHERE sprint_id >= ? '
+                'ORDER BY seconds LIMIT 1 OFFSET ?', (first_id, (completion_count - 1) // 2))[0][0]
+
+        return StatsReport(
+            sprints=[
+                SprintCounts(
+                    sprint['started_at'], sprint['ended_at'], counts[sprint['id'], 'category'])
+                for sprint in sprints],
+            creators=creators.most_common(max_creators),
+            tries_created=tries['created'],
+            tries_committed=tries['committed'],
+            tries_completed=tries['completed'],
+            median_completion_seconds=median_completion_seconds)
+
+
+def format_report(report, category_key=None):
+    """Format the stats of the last sprints as a Slack message.
+
+    Args:
+        report: the StatsReport to format, with at least one sprint.
+        category_key: a function to sort the (category, count) pairs of each sprint.
+    """
+
+    lines = [':bar_chart: Stats of the last {} sprints'.format(len(report.sprints)), '']
+    for sprint in report.sprints:
+        categories = ', '.join(
+            '{} {}'.format(count, category)
+            for category, count in sorted(sprint.categories.items(), key=category_key)
+        ) or 'no items'
+        lines.append('• {} → {}: {}'.format(
+            sprint.started_at[:10], sprint.ended_at[:10] if sprint.ended_at else 'now', categories))
+    if report.creators:
+        lines.append('*Top contributors:* {}'.format(', '.join(
+            '{} ({})'.format(creator, count) for creator, count in report.creators)))
+    lines.append('*Try items:* {} committed out of {} ({}), {} completed ({} of them)'.format(
+        report.tries_committed, report.tries_created,
+        _format_rate(report.tries_committed, report.tries_created), report.tries_completed,
+        _format_rate(report.tries_completed, report.tries_committed)))
+    if report.median_completion_seconds is not None:
+        lines.append('*Median time to complete a try:* {:.1f} days'.format(
+            report.median_completion_seconds / 86400))
+    return '\n'.join(lines)
+
+
+def _format_rate(count, total):
+    return '{:.0%}'.format(count / total) if total else 'n/a'
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Test the stats of the retrospective items by sprint."""
+
+import unittest
+
+import sprint_stats
+
+
+class SprintStatsTest(unittest.TestCase):
+    """Test the sprint stats."""
+
+    def setUp(self):
+        super(SprintStatsTest, self).setUp()
+        self.stats = sprint_stats.SprintStats(':memory:')
+
+    def test_no_stats(self):
+        """There are no sprints before the first item."""
+
+        self.assertEqual(
+            sprint_stats.StatsReport([], [], 0, 0, 0, None),
+            self.stats.get_report(max_sprints=6, max_creators=5))
+
+    def test_report(self):
+        """Items are counted in the sprint during which they are written."""
+
+        self.stats.add_item({
+            'Category': 'good', 'Creator': 'pascal', 'Created At': '2018-10-01T10:00:00.000Z'})
+        self.stats.add_item({
+            'Category': 'try', 'Creator': 'cyrille', 'Created At': '2018-10-02T10:00:00.000Z'})
+        self.stats.add_item({
+            'Category': 'try', 'Creator': 'pascal', 'Created At': '2018-10-03T10:00:00.000Z'})
+        self.stats.commit_try('2018-10-10T10:00:00.000Z')
+        self.stats.end_sprint('2018-10-10T10:00:00.000Z')
+
+        self.stats.add_item({'Category': 'bad', 'Created At': '2018-10-11T10:00:00.000Z'})
+        self.stats.complete_try('2018-10-02T10:00:00.000Z', '2018-10-12T10:00:00.000Z')
+
+        report = self.stats.get_report(max_sprints=6, max_creators=1)
+        self.assertEqual([
+            sprint_stats.SprintCounts('2018-10-11T10:00:00.000Z', None, {'bad': 1}),
+            sprint_stats.SprintCounts(
+                '2018-10-01T10:00:00.000Z', '2018-10-10T10:00:00.000Z', {'good': 1, 'try': 2}),
+        ], report.sprints)
+        self.assertEqual([('pascal', 2)], report.creators)
+        self.assertEqual((2, 1, 1), (
+            report.tries_created, report.tries_committed, report.tries_completed))
+        self.assertEqual(10 * 86400, report.median_completion_seconds)
+
+        report = self.stats.get_report(max_sprints=1, max_creators=5)
+        self.assertEqual(1, len(report.sprints))
+        self.assertEqual([], report.creators)
+        self.assertEqual((0, 0, 1), (
+            report.tries_created, report.tries_committed, report.tries_completed))
+
+    def test_median_completion_time(self):
+        """The median time to complete a "try" item ignores the outliers."""
+
+        for days in (1, 2, 30):
+            self.stats.complete_try(
+                '2018-10-01T10:00:00.000Z', '2018-10-{:02d}T10:00:00.000Z'.format(1 + days))
+
+        report = self.stats.get_report(max_sprints=6, max_creators=5)
+        self.assertEqual(2 * 86400, report.median_completion_seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
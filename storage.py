@@ -0,0 +1,941 @@
+"""Storage of the retrospective items and of the moods.
+
+The bot only needs a few queries, defined by the Storage class. They are implemented on top of an
+Airtable base, so that a team can use Airtable's UI, or on top of a local SQLite database for
+teams that want faster queries.
+
+Records are returned in the same shape for all storages: a dict with the "id" of the record and
+its "fields" keyed by Airtable field names.
+"""
+
+import collections
+import datetime
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+import airtable_client
+import request_timing
+
+_AIRTABLE_RETRO_ITEMS_TABLE_ID = 'Items'
+_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW = 'Current View'
+_AIRTABLE_MOOD_ITEMS_TABLE_ID = 'Moods'
+_AIRTABLE_MOOD_ITEMS_CURRENT_VIEW = 'Current View'
+# One record per sprint with the aggregates of its moods, see README.
+_AIRTABLE_MOOD_TREND_TABLE_ID = 'Mood Trend'
+# Fields that are needed to show the items and the moods, no need to download the others.
+_ITEMS_FIELDS = ('Category', 'Object', 'Committed ?', 'Completed At')
+_SEARCH_FIELDS = ('Category', 'Object', 'Creator', 'Created At')
+_MOODS_FIELDS = (
+    'Name',
+    'How are you feeling at Bayes',
+    'Feeling at bayes free text',
+    'How is your work going',
+    'How is your work going free text',
+)
+# Fields telling the moods apart, e.g. to find a submission that was sent again.
+_MOOD_KEY_FIELDS = ('Name', 'Created At')
+# Fields of the moods whose sentences are counted by sprint, with their SQLite columns.
+_MOOD_TREND_FIELDS = collections.OrderedDict([
+    ('How are you feeling at Bayes', 'feelings'),
+    ('How is your work going', 'work_status'),
+])
+# Typeform joins the sentences of a multiple choice answer.
+_MOOD_SENTENCES_SEPARATOR = ', \n'
+# How long the current view is kept in memory between two requests of a warm container.
+_ITEMS_CACHE_TTL_SECONDS = 300
+# Views bigger than this are not kept in memory.
+_ITEMS_CACHE_MAX_RECORDS = 2000
+# Falsy, returned instead of the records of the items that might have been created by a request
+# that failed: creating them again could duplicate them.
+MAYBE_CREATED = airtable_client.MAYBE_CREATED
+
+# SQLite columns of the Airtable fields.
+_SQLITE_ITEMS_COLUMNS = collections.OrderedDict([
+    ('Category', 'category'),
+    ('Object', 'object'),
+    ('Creator', 'creator'),
+    ('Created At', 'created_at'),
+    ('Committed ?', 'committed'),
+    ('Completed At', 'completed_at'),
+    ('Reviewed At', 'reviewed_at'),
+])
+_SQLITE_MOODS_COLUMNS = collections.OrderedDict([
+    ('Name', 'name'),
+    ('How are you feeling at Bayes', 'feelings'),
+    ('Feeling at bayes free text', 'feelings_free_text'),
+    ('How is your work going', 'work_status'),
+    ('How is your work going free text', 'work_status_free_text'),
+    ('Created At', 'created_at'),
+])
+_SQLITE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS items (
+        id TEXT PRIMARY KEY,
+        category TEXT NOT NULL,
+        object TEXT NOT NULL,
+        object_key TEXT NOT NULL,
+        creator TEXT,
+        created_at TEXT,
+        committed INTEGER,
+        completed_at TEXT,
+        reviewed_at TEXT
+    );
+    -- Duplicates are only looked for in the current items.
+    CREATE INDEX IF NOT EXISTS items_by_object ON items (category, object_key)
+        WHERE reviewed_at IS NULL;
+    CREATE INDEX IF NOT EXISTS items_by_state ON items (reviewed_at, committed, completed_at);
+    CREATE INDEX IF NOT EXISTS items_by_date ON items (created_at);
+    CREATE TABLE IF NOT EXISTS moods (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        feelings TEXT,
+        feelings_free_text TEXT,
+        work_status TEXT,
+        work_status_free_text TEXT,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS moods_by_date ON moods (created_at);
+    -- Aggregates of the moods by sprint, updated with each new mood.
+    CREATE TABLE IF NOT EXISTS mood_sprints (
+        sprint TEXT PRIMARY KEY,
+        responses INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS mood_sentences (
+        sprint TEXT NOT NULL,
+        field TEXT NOT NULL,
+        sentence TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (sprint, field, sentence)
+    );
+'''
+# The mood report is weekly.
+_SQLITE_CURRENT_MOODS_DAYS = 7
+# How many records are read at once when reading a whole SQLite table.
+_SQLITE_PAGE_SIZE = 500
+
+# The tables that can be read whole, with their fields.
+TABLE_FIELDS = collections.OrderedDict([
+    (_AIRTABLE_RETRO_ITEMS_TABLE_ID, tuple(_SQLITE_ITEMS_COLUMNS)),
+    (_AIRTABLE_MOOD_ITEMS_TABLE_ID, tuple(_SQLITE_MOODS_COLUMNS)),
+])
+_SQLITE_TABLES = {
+    _AIRTABLE_RETRO_ITEMS_TABLE_ID: ('items', _SQLITE_ITEMS_COLUMNS),
+    _AIRTABLE_MOOD_ITEMS_TABLE_ID: ('moods', _SQLITE_MOODS_COLUMNS),
+}
+
+
+# The aggregates of the moods of a sprint: the number of responses, and the number of times each
+# sentence was picked for the feeling and the work status.
+MoodAggregate = collections.namedtuple(
+    'MoodAggregate', ('sprint', 'responses', 'feelings', 'work_status'))
+
+
+class StorageError(Exception):
+    """An item could not be written, e.g. because the remote storage is not available."""
+
+
+def normalize_new_item(category, item_object):
+    """Normalize the category and the non-empty object of a new item, as the bot writes them."""
+
+    return category.lower(), item_object[0].upper() + item_object[1:]
+
+
+def normalize_item_key(category, item_object):
+    """Get a key to identify duplicate items, ignoring case and extra spaces."""
+
+    return category.lower(), ' '.join(item_object.lower().split())
+
+
+def get_mood_sprint(created_at):
+    """Get the sprint of a mood from its creation time, e.g. "2018-W42": moods are weekly."""
+
+    year, week, unused_day = datetime.datetime.strptime(created_at[:10], '%Y-%m-%d').isocalendar()
+    return '{}-W{:02d}'.format(year, week)
+
+
+def _split_mood_sentences(answer):
+    return [sentence for sentence in (answer or '').split(_MOOD_SENTENCES_SEPARATOR) if sentence]
+
+
+def _add_mood_to_aggregate(aggregate, fields):
+    aggregate.feelings.update(_split_mood_sentences(fields.get('How are you feeling at Bayes')))
+    aggregate.work_status.update(_split_mood_sentences(fields.get('How is your work going')))
+    return aggregate._replace(responses=aggregate.responses + 1)
+
+
+def _get_item_key(item):
+    fields = item['fields']
+    return normalize_item_key(fields.get('Category', ''), fields.get('Object', ''))
+
+
+class Storage(object):
+    """The queries the bot needs to store its items and moods."""
+
+    def iterate_current_items(self):
+        """Iterate over the items of the current sprint, i.e. that were not reviewed yet."""
+
+        raise NotImplementedError()
+
+    def has_item(self, category, item_object):
+        """Find whether a current item has the same category and object, up to case and spaces."""
+
+        raise NotImplementedError()
+
+    def iterate_items_created_since(self, created_at):
+        """Iterate over all the items created at or after a time, including the reviewed ones.
+
+        Args:
+            created_at: an ISO 8601 time in UTC, or an empty string for all the items.
+        Returns:
+            an iterable of the items in the order of their creation time.
+        """
+
+        raise NotImplementedError()
+
+    def iterate_records_created_since(self, table, created_at, fields=None):
+        """Iterate over all the records of a table created at or after a time.
+
+        Args:
+            table: the name of the table, one of TABLE_FIELDS.
+            created_at: an ISO 8601 time in UTC, or an empty string for all the records.
+            fields: the names of the fields to read, all of them if not set. Other fields might be
+                read as well.
+        Returns:
+            an iterator over the records in the order of their creation time, read page by page.
+        """
+
+        raise NotImplementedError()
+
+    def create_item(self, fields):
+        """Create an item and return its record.
+
+        Raises:
+            StorageError: if the item could not be created.
+        """
+
+        raise NotImplementedError()
+
+    def create_items(self, fields_list):
+        """Create many items.
+
+        Returns:
+            the list of the created records in the same order as the fields, with None for the
+            items that could not be created and MAYBE_CREATED for the ones that might have been.
+        """
+
+        records = []
+        for fields in fields_list:
+            try:
+                records.append(self.create_item(fields))
+            except StorageError as error:
+                logging.error('Could not create item: %s', error)
+                records.append(None)
+        return records
+
+    def update_item(self, item_id, fields):
+        """Update partially an item and return its record.
+
+        Raises:
+            StorageError: if the item could not be updated, e.g. because it does not exist.
+        """
+
+        raise NotImplementedError()
+
+    def update_items(self, records):
+        """Update partially many items.
+
+        Args:
+            records: a list of dicts with the "id" of each item and the "fields" to update.
+        Returns:
+            a dict of error messages keyed by the IDs of the items that could not be updated.
+        """
+
+        raise NotImplementedError()
+
+    def iterate_moods(self):
+        """Iterate over the moods of the current week."""
+
+        raise NotImplementedError()
+
+    def create_mood(self, fields):
+        """Create a mood, e.g. from a form submission, and return its record.
+
+        Raises:
+            StorageError: if the mood could not be created.
+        """
+
+        raise NotImplementedError()
+
+    def has_mood(self, fields):
+        """Whether there is a mood with the same name and creation time.
+
+        Raises:
+            StorageError: if the moods could not be read.
+        """
+
+        # Only the moods created since then are read.
+        return any(_is_same_mood(mood, fields) for mood in self.iterate_records_created_since(
+            _AIRTABLE_MOOD_ITEMS_TABLE_ID, fields.get('Created At', ''), fields=_MOOD_KEY_FIELDS))
+
+    def get_mood_trend(self, max_sprints):
+        """Get the aggregates of the moods of the last sprints, from the oldest to the newest.
+
+        This only reads the aggregates, not the moods themselves.
+
+        Raises:
+            StorageError: if the aggregates could not be read.
+        """
+
+        raise NotImplementedError()
+
+    def update_mood_trend(self):
+        """Add the moods that were created since the last update to the aggregates by sprint.
+
+        Raises:
+            StorageError: if the aggregates could not be updated.
+        """
+
+    def is_fast(self):
+        """Whether the current items can be read without waiting for a remote service."""
+
+        raise NotImplementedError()
+
+    def forget_items(self, item_ids=None):
+        """Drop items, or all of them, from the current items kept in memory.
+
+        This is for items that are modified elsewhere, e.g. reviewed by a task in another container.
+        """
+
+    def expire_items(self):
+        """Read the current items again next time, e.g. while another container adds one."""
+
+    def get_items_version(self):
+        """Get a version of the current items that changes whenever they do.
+
+        Returns:
+            a comparable version, or None if it is unknown, e.g. because the items have to be
+            read again from a remote service.
+        """
+
+        return None
+
+    def warm_up(self):
+        """Prepare for the next queries, e.g. by loading some data in memory."""
+
+    def close(self):
+        """Release the resources of the storage, e.g. its database connection, once dropped."""
+
+
+class _ViewCache(object):
+    """A read-through cache of all the records of an Airtable view.
+
+    It lives as long as the container, so that consecutive commands during a retro meeting do
+    not download the whole view again. The bot's own writes are applied to it directly.
+
+    If an index_key function is given, the cache also keeps an index of the records by this key,
+    even when the view is too big for the records themselves to be cached.
+    """
+
+    def __init__(self, client, table_id, view, fields, ttl_seconds, max_records, index_key=None):
+        self._client = client
+        self._table_id = table_id
+        self._view = view
+        self._fields = fields
+        self._ttl_seconds = ttl_seconds
+        self._max_records = max_records
+        self._index_key = index_key
+        self._records = None
+        self._key_by_id = None
+        self._ids_by_key = None
+        self._expires_at = 0
+        # Counts the bot's own writes, so that a read that overlapped one of them is not kept.
+        self._generation = 0
+        # Changes whenever the records in memory do.
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return time.monotonic() < self._expires_at
+
+    def is_fresh(self):
+        """Whether the records or the index can be used without reading the view again."""
+
+        with self._lock:
+            return (self._records is not None or self._ids_by_key is not None) and \
+                self._is_fresh()
+
+    def _fetch(self):
+        """Stream the records of the view, and keep them in memory once all have been read."""
+
+        with self._lock:
+            generation = self._generation
+        records = collections.OrderedDict()
+        key_by_id = {}
+        for record in _iterate_records(self._client, self._table_id, self._view, self._fields):
+            if records is not None:
+                if len(records) >= self._max_records:
+                    logging.warning(
+                        'View "%s" is too big to be cached: more than %d records.',
+                        self._view, self._max_records)
+                    records = None
+                else:
+                    records[record['id']] = record
+            if self._index_key:
+                key_by_id[record['id']] = self._index_key(record)
+            yield record
+
+        with self._lock:
+            if generation != self._generation:
+                # The view might have been read before a write: its records are outdated.
+                return
+            self._records = records
+            self._version += 1
+            if self._index_key:
+                self._key_by_id = {}
+                self._ids_by_key = collections.defaultdict(set)
+                for record_id, key in key_by_id.items():
+                    self._add_to_index(record_id, key)
+            self._expires_at = time.monotonic() + self._ttl_seconds
+
+    def _add_to_index(self, record_id, key):
+        self._remove_from_index(record_id)
+        self._key_by_id[record_id] = key
+        self._ids_by_key[key].add(record_id)
+
+    def _remove_from_index(self, record_id):
+        key = self._key_by_id.pop(record_id, None)
+        if key is None:
+            return
+        self._ids_by_key[key].discard(record_id)
+        if not self._ids_by_key[key]:
+            del self._ids_by_key[key]
+
+    def get_records(self):
+        """Get all the records of the view, from memory if it's fresh enough.
+
+        Returns:
+            an iterable of records: a list if they are in memory, otherwise a generator that
+            downloads them page by page.
+        """
+
+        with self._lock:
+            if self._records is not None and self._is_fresh():
+                return list(self._records.values())
+        return self._fetch()
+
+    def get_version(self):
+        """Get the version of the records in memory, or None if they have to be read again."""
+
+        with self._lock:
+            if self._records is None or not self._is_fresh():
+                return None
+            return self._version
+
+    def contains_key(self, key):
+        """Check whether a record of the view in memory has the given index key.
+
+        This does not read the view: records added elsewhere since it was read are not found.
+        """
+
+        with self._lock:
+            return self._ids_by_key is not None and self._is_fresh() and key in self._ids_by_key
+
+    def refresh(self):
+        """Read the view again."""
+
+        for unused_record in self._fetch():
+            pass
+
+    def upsert(self, record):
+        """Add or replace a record that was written by the bot and that is in the view."""
+
+        with self._lock:
+            self._generation += 1
+            self._version += 1
+            if self._ids_by_key is not None:
+                self._add_to_index(record['id'], self._index_key(record))
+            if self._records is None:
+                return
+            if record['id'] not in self._records and len(self._records) >= self._max_records:
+                self._records = None
+                return
+            self._records[record['id']] = record
+
+    def remove(self, record_ids):
+        """Remove records that were modified by the bot and are not in the view anymore."""
+
+        with self._lock:
+            self._generation += 1
+            self._version += 1
+            for record_id in record_ids:
+                if self._records is not None:
+                    self._records.pop(record_id, None)
+                if self._ids_by_key is not None:
+                    self._remove_from_index(record_id)
+
+    def remove_all(self):
+        """Remove all the records in memory without reading the view again.
+
+        This is for records that were all modified elsewhere, e.g. by a task in another container.
+        """
+
+        with self._lock:
+            self._generation += 1
+            self._version += 1
+            if self._records is not None:
+                self._records.clear()
+            if self._ids_by_key is not None:
+                self._key_by_id.clear()
+                self._ids_by_key.clear()
+
+    def clear(self):
+        """Forget all the records, the next read will fetch them from Airtable."""
+
+        with self._lock:
+            self._generation += 1
+            self._version += 1
+            self._records = None
+            self._key_by_id = None
+            self._ids_by_key = None
+
+
+def _get_current_moods_start():
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=_SQLITE_CURRENT_MOODS_DAYS)
+    return since.isoformat(timespec='milliseconds') + 'Z'
+
+
+def _is_same_mood(mood, fields):
+    """Whether a mood was sent by the same person at the same time, e.g. the same submission."""
+
+    return all(mood['fields'].get(field) == fields.get(field) for field in _MOOD_KEY_FIELDS)
+
+
+def _iterate_records(client, table_id, view, fields):
+    """Iterate lazily over all the records of a view, following Airtable pagination.
+
+    Only the given fields are downloaded.
+    """
+
+    return client.iterate(table_id, view=view, fields=list(fields))
+
+
+class AirtableStorage(Storage):
+    """Items and moods stored in the "Current View" views of an Airtable base.
+
+    The current items are cached in memory.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.items_cache = _ViewCache(
+            client, _AIRTABLE_RETRO_ITEMS_TABLE_ID, _AIRTABLE_RETRO_ITEMS_CURRENT_VIEW,
+            _ITEMS_FIELDS, ttl_seconds=_ITEMS_CACHE_TTL_SECONDS,
+            max_records=_ITEMS_CACHE_MAX_RECORDS, index_key=_get_item_key)
+
+    def iterate_current_items(self):
+        return self.items_cache.get_records()
+
+    def has_item(self, category, item_object):
+        key = normalize_item_key(category, item_object)
+        if not self.items_cache.is_fresh():
+            # The view has to be read anyway: keep it for the next commands.
+            self.items_cache.refresh()
+            if self.items_cache.is_fresh():
+                return self.items_cache.contains_key(key)
+        elif self.items_cache.contains_key(key):
+            return True
+        # Other containers may have added it since the view was read: look for it as the bot
+        # writes it, without reading the whole view again.
+        return any(self._client.iterate(
+            _AIRTABLE_RETRO_ITEMS_TABLE_ID, view=_AIRTABLE_RETRO_ITEMS_CURRENT_VIEW,
+            fields=['Category'], filter_by_formula='AND(Category = {}, Object = {})'.format(
+                json.dumps(category), json.dumps(item_object))))
+
+    def iterate_items_created_since(self, created_at):
+        formula = 'NOT(IS_BEFORE({{Created At}}, {}))'.format(json.dumps(created_at)) \
+            if created_at else None
+        return self._client.iterate(
+            _AIRTABLE_RETRO_ITEMS_TABLE_ID, fields=_SEARCH_FIELDS, filter_by_formula=formula,
+            sort_field='Created At')
+
+    def iterate_records_created_since(self, table, created_at, fields=None):
+        if table not in TABLE_FIELDS:
+            raise ValueError('Unknown table "{}".'.format(table))
+        formula = 'NOT(IS_BEFORE({{Created At}}, {}))'.format(json.dumps(created_at)) \
+            if created_at else None
+        return self._client.iterate(
+            table, fields=fields and list(fields), filter_by_formula=formula,
+            sort_field='Created At')
+
+    def create_item(self, fields):
+        try:
+            record = self._client.create(_AIRTABLE_RETRO_ITEMS_TABLE_ID, fields)
+        except (airtable_client.airtable.AirtableError,
+                airtable_client.requests.RequestException) as error:
+            raise StorageError('Airtable could not create the item: {}'.format(error)) from error
+        if not record:
+            raise StorageError('Airtable did not return the created item.')
+        self.items_cache.upsert(record)
+        return record
+
+    def create_items(self, fields_list):
+        records = airtable_client.create_records(
+            self._client, _AIRTABLE_RETRO_ITEMS_TABLE_ID, fields_list)
+        for record in records:
+            if record and not record['fields'].get('Reviewed At'):
+                self.items_cache.upsert(record)
+        return records
+
+    def update_item(self, item_id, fields):
+        try:
+            record = self._client.update(_AIRTABLE_RETRO_ITEMS_TABLE_ID, item_id, fields)
+        except (airtable_client.airtable.AirtableError,
+                airtable_client.requests.RequestException) as error:
+            raise StorageError('Airtable could not update the item: {}'.format(error)) from error
+        self._update_cache([record])
+        return record
+
+    def update_items(self, records):
+        errors = airtable_client.update_records(
+            self._client, _AIRTABLE_RETRO_ITEMS_TABLE_ID, records)
+        self._update_cache(record for record in records if record['id'] not in errors)
+        return errors
+
+    def _update_cache(self, records):
+        # Reviewed items are not part of the current view anymore.
+        self.items_cache.remove(
+            record['id'] for record in records if record['fields'].get('Reviewed At'))
+        for record in records:
+            if not record['fields'].get('Reviewed At') and 'Category' in record['fields']:
+                self.items_cache.upsert(record)
+
+    def iterate_moods(self):
+        return _iterate_records(
+            self._client,
+            _AIRTABLE_MOOD_ITEMS_TABLE_ID, _AIRTABLE_MOOD_ITEMS_CURRENT_VIEW, _MOODS_FIELDS)
+
+    def create_mood(self, fields):
+        try:
+            return self._client.create(_AIRTABLE_MOOD_ITEMS_TABLE_ID, fields)
+        except (airtable_client.airtable.AirtableError,
+                airtable_client.requests.RequestException) as error:
+            raise StorageError('Airtable could not create the mood: {}'.format(error)) from error
+
+    def has_mood(self, fields):
+        try:
+            return super(AirtableStorage, self).has_mood(fields)
+        except (airtable_client.airtable.AirtableError,
+                airtable_client.requests.RequestException) as error:
+            raise StorageError('Airtable could not read the moods: {}'.format(error)) from error
+
+    def get_mood_trend(self, max_sprints):
+        try:
+            records = sorted(
+                self._client.iterate(_AIRTABLE_MOOD_TREND_TABLE_ID),
+                key=lambda record: record['fields'].get('Sprint', ''))
+        except (airtable_client.airtable.AirtableError,
+                airtable_client.requests.RequestException) as error:
+            raise StorageError(
+                'Airtable could not read the mood trend: {}'.format(error)) from error
+        return [_airtable_record_to_mood_aggregate(record) for record in records[-max_sprints:]]
+
+    def update_mood_trend(self):
+        """Add the new moods of the current view to the aggregates of the "Mood Trend" table.
+
+        Moods are created by Typeform directly in Airtable, so the new ones are found by their
+        creation time: the aggregates keep the time of the last mood that was added.
+        """
+
+        try:
+            self._update_mood_trend()
+        except (airtable_client.airtable.AirtableError,
+                airtable_client.requests.RequestException) as error:
+            raise StorageError(
+                'Airtable could not update the mood trend: {}'.format(error)) from error
+
+    def _update_mood_trend(self):
+        records_by_sprint = {
+            record['fields'].get('Sprint'): record
+            for record in self._client.iterate(_AIRTABLE_MOOD_TREND_TABLE_ID)}
+        last_created_at = max(
+            (record['fields'].get('Last Created At', '') for record in records_by_sprint.values()),
+            default='')
+
+        aggregates = {}
+        new_last_created_at = {}
+        for mood in _iterate_records(
+                self._client, _AIRTABLE_MOOD_ITEMS_TABLE_ID, _AIRTABLE_MOOD_ITEMS_CURRENT_VIEW,
+                _MOODS_FIELDS + ('Created At',)):
+            created_at = mood['fields'].get('Created At')
+            if not created_at or created_at <= last_created_at:
+                continue
+            sprint = get_mood_sprint(created_at)
+            if sprint not in aggregates:
+                aggregates[sprint] = _airtable_record_to_mood_aggregate(
+                    records_by_sprint.get(sprint, {'fields': {'Sprint': sprint}}))
+            aggregates[sprint] = _add_mood_to_aggregate(aggregates[sprint], mood['fields'])
+            new_last_created_at[sprint] = max(new_last_created_at.get(sprint, ''), created_at)
+
+        for sprint, aggregate in aggregates.items():
+            fields = {
+                'Sprint': sprint,
+                'Responses': aggregate.responses,
+                'Feelings': json.dumps(aggregate.feelings, sort_keys=True),
+                'Work Status': json.dumps(aggregate.work_status, sort_keys=True),
+                'Last Created At': new_last_created_at[sprint],
+            }
+            if sprint in records_by_sprint:
+                self._client.update(
+                    _AIRTABLE_MOOD_TREND_TABLE_ID, records_by_sprint[sprint]['id'], fields)
+            else:
+                self._client.create(_AIRTABLE_MOOD_TREND_TABLE_ID, fields)
+
+    def is_fast(self):
+        return self.items_cache.is_fresh()
+
+    def forget_items(self, item_ids=None):
+        if item_ids is None:
+            self.items_cache.remove_all()
+        else:
+            self.items_cache.remove(item_ids)
+
+    def expire_items(self):
+        self.items_cache.clear()
+
+    def get_items_version(self):
+        return self.items_cache.get_version()
+
+    def warm_up(self):
+        self.items_cache.refresh()
+
+
+class SqliteStorage(Storage):
+    """Items and moods stored in a local SQLite database, indexed for the bot's queries."""
+
+    def __init__(self, path):
+        # The connection is shared by the threads of the container, one query at a time.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # Counts the writes of this connection: the data version of SQLite only counts the others.
+        self._write_count = 0
+        with self._lock, self._connection:
+            self._connection.executescript(_SQLITE_SCHEMA)
+            # Databases created before the aggregates need them for their existing moods, once.
+            if not self._connection.execute('SELECT 1 FROM mood_sprints LIMIT 1').fetchall():
+                for row in self._connection.execute('SELECT * FROM moods').fetchall():
+                    mood = _sqlite_row_to_record(row, _SQLITE_MOODS_COLUMNS)
+                    for query, params in _iterate_mood_trend_updates(mood['fields']):
+                        self._connection.execute(query, params)
+
+    def _query(self, query, params=()):
+        with request_timing.span('sqlite'), self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _write(self, query, params_list):
+        try:
+            with request_timing.span('sqlite'), self._lock, self._connection:
+                self._write_count += 1
+                return [
+                    self._connection.execute(query, params).rowcount for params in params_list]
+        except sqlite3.Error as error:
+            raise StorageError('SQLite could not write: {}'.format(error)) from error
+
+    def _write_all(self, statements):
+        """Run several write queries in a single transaction."""
+
+        try:
+            with request_timing.span('sqlite'), self._lock, self._connection:
+                self._write_count += 1
+                for query, params in statements:
+                    self._connection.execute(query, params)
+        except sqlite3.Error as error:
+            raise StorageError('SQLite could not write: {}'.format(error)) from error
+
+    def iterate_current_items(self):
+        return [
+            _sqlite_row_to_record(row, _SQLITE_ITEMS_COLUMNS)
+            for row in self._query('SELECT * FROM items WHERE reviewed_at IS NULL ORDER BY rowid')]
+
+    def has_item(self, category, item_object):
+        category, object_key = normalize_item_key(category, item_object)
+        return bool(self._query(
+            'SELECT 1 FROM items WHERE category = ? AND object_key = ? AND reviewed_at IS NULL '
+            'LIMIT 1', (category, object_key)))
+
+    def iterate_items_created_since(self, created_at):
+        return [
+            _sqlite_row_to_record(row, _SQLITE_ITEMS_COLUMNS)
+            for row in self._query(
+                'SELECT * FROM items WHERE created_at >= ? ORDER BY created_at', (created_at,))]
+
+    def iterate_records_created_since(self, table, created_at, fields=None):
+        sqlite_table, columns = _SQLITE_TABLES[table]
+        # Records without a creation time come first, as in Airtable.
+        condition, params = ('created_at >= ?', (created_at,)) if created_at else ('1', ())
+        while True:
+            rows = self._query(
+                'SELECT rowid, * FROM {} WHERE {} ORDER BY created_at, rowid LIMIT {}'.format(
+                    sqlite_table, condition, _SQLITE_PAGE_SIZE),
+                params)
+            for row in rows:
+                yield _sqlite_row_to_record(row, columns)
+            if len(rows) < _SQLITE_PAGE_SIZE:
+                return
+            # The next page starts after the last record, using the index of the creation times.
+            last_row = rows[-1]
+            if last_row['created_at'] is None:
+                condition = 'created_at IS NULL AND rowid > ? OR created_at IS NOT NULL'
+                params = (last_row['rowid'],)
+            else:
+                condition = 'created_at > ? OR created_at = ? AND rowid > ?'
+                params = (last_row['created_at'], last_row['created_at'], last_row['rowid'])
+
+    def create_item(self, fields):
+        record_id = _create_record_id()
+        columns = ['id', 'object_key'] + [
+            _SQLITE_ITEMS_COLUMNS[field] for field in fields]
+        values = [record_id, _get_item_key({'fields': fields})[1]] + list(fields.values())
+        self._write(
+            'INSERT INTO items ({}) VALUES ({})'.format(
+                ', '.join(columns), ', '.join('?' * len(columns))),
+            [values])
+        return self._get_item(record_id)
+
+    def create_items(self, fields_list):
+        record_ids = [_create_record_id() for unused_fields in fields_list]
+        # A single transaction for each run of items that have the same fields, so that the items
+        # are still read in the order they were created.
+        failed_ids = set()
+        for fields, records in itertools.groupby(
+                zip(record_ids, fields_list), key=lambda record: tuple(record[1])):
+            values_list = [
+                [record_id, _get_item_key({'fields': item_fields})[1]] + list(item_fields.values())
+                for record_id, item_fields in records]
+            columns = ['id', 'object_key'] + [_SQLITE_ITEMS_COLUMNS[field] for field in fields]
+            try:
+                self._write(
+                    'INSERT INTO items ({}) VALUES ({})'.format(
+                        ', '.join(columns), ', '.join('?' * len(columns))),
+                    values_list)
+            except StorageError as error:
+                logging.error('Could not create items: %s', error)
+                failed_ids.update(values[0] for values in values_list)
+        return [
+            None if record_id in failed_ids else {'id': record_id, 'fields': dict(fields)}
+            for record_id, fields in zip(record_ids, fields_list)]
+
+    def _get_item(self, item_id):
+        rows = self._query('SELECT * FROM items WHERE id = ?', (item_id,))
+        return _sqlite_row_to_record(rows[0], _SQLITE_ITEMS_COLUMNS) if rows else None
+
+    def update_item(self, item_id, fields):
+        errors = self.update_items([{'id': item_id, 'fields': fields}])
+        if errors:
+            raise StorageError(errors[item_id])
+        return self._get_item(item_id)
+
+    def update_items(self, records):
+        errors = {}
+        records_by_fields = collections.defaultdict(list)
+        for record in records:
+            records_by_fields[tuple(record['fields'])].append(record)
+        for fields, same_fields_records in records_by_fields.items():
+            query = 'UPDATE items SET {} WHERE id = ?'.format(
+                ', '.join('{} = ?'.format(_SQLITE_ITEMS_COLUMNS[field]) for field in fields))
+            updated_counts = self._write(query, [
+                list(record['fields'].values()) + [record['id']]
+                for record in same_fields_records])
+            for record, updated_count in zip(same_fields_records, updated_counts):
+                if not updated_count:
+                    errors[record['id']] = 'Could not find record {}'.format(record['id'])
+        return errors
+
+    def iterate_moods(self):
+        return [
+            _sqlite_row_to_record(row, _SQLITE_MOODS_COLUMNS)
+            for row in self._query(
+                'SELECT * FROM moods WHERE created_at >= ? ORDER BY created_at',
+                (_get_current_moods_start(),))]
+
+    def create_mood(self, fields):
+        record_id = _create_record_id()
+        columns = ['id'] + [_SQLITE_MOODS_COLUMNS[field] for field in fields]
+        self._write_all([(
+            'INSERT INTO moods ({}) VALUES ({})'.format(
+                ', '.join(columns), ', '.join('?' * len(columns))),
+            [record_id] + list(fields.values()),
+        )] + list(_iterate_mood_trend_updates(fields)))
+        return {'id': record_id, 'fields': dict(fields)}
+
+    def get_mood_trend(self, max_sprints):
+        sprints = self._query(
+            'SELECT sprint, responses FROM mood_sprints ORDER BY sprint DESC LIMIT ?',
+            (max_sprints,))
+        if not sprints:
+            return []
+        counts = collections.defaultdict(collections.Counter)
+        for row in self._query(
+                'SELECT sprint, field, sentence, count FROM mood_sentences WHERE sprint >= ?',
+                (sprints[-1]['sprint'],)):
+            counts[row['sprint'], row['field']][row['sentence']] = row['count']
+        return [
+            MoodAggregate(
+                sprint=row['sprint'], responses=row['responses'],
+                feelings=counts[row['sprint'], 'feelings'],
+                work_status=counts[row['sprint'], 'work_status'])
+            for row in reversed(sprints)]
+
+    def is_fast(self):
+        return True
+
+    def get_items_version(self):
+        with self._lock:
+            return self._write_count, self._connection.execute('PRAGMA data_version').fetchone()[0]
+
+
+def _airtable_record_to_mood_aggregate(record):
+    fields = record['fields']
+    return MoodAggregate(
+        sprint=fields['Sprint'], responses=fields.get('Responses', 0),
+        feelings=collections.Counter(json.loads(fields.get('Feelings') or '{}')),
+        work_status=collections.Counter(json.loads(fields.get('Work Status') or '{}')))
+
+
+def _iterate_mood_trend_updates(fields):
+    """Iterate over the SQLite queries that add a new mood to the aggregates of its sprint."""
+
+    sprint = get_mood_sprint(fields['Created At'])
+    yield 'INSERT OR IGNORE INTO mood_sprints (sprint, responses) VALUES (?, 0)', (sprint,)
+    yield 'UPDATE mood_sprints SET responses = responses + 1 WHERE sprint = ?', (sprint,)
+    for field, column in _MOOD_TREND_FIELDS.items():
+        for sentence in _split_mood_sentences(fields.get(field)):
+            params = (sprint, column, sentence)
+            yield (
+                'INSERT OR IGNORE INTO mood_sentences (sprint, field, sentence, count) '
+                'VALUES (?, ?, ?, 0)', params)
+            yield (
+                'UPDATE mood_sentences SET count = count + 1 '
+                'WHERE sprint = ? AND field = ? AND sentence = ?', params)
+
+
+def _create_record_id():
+    return 'rec{}'.format(uuid.uuid4().hex[:14])
+
+
+def _sqlite_row_to_record(row, columns):
+    fields = {}
+    for field, column in columns.items():
+        value = row[column]
+        if value is None:
+            continue
+        fields[field] = bool(value) if column == 'committed' else value
+    return {'id': row['id'], 'fields': fields}
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""Test the storages of the items and moods."""
+
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import airtablemock
+import mock
+
+import storage
+
+
+class SqliteStorageTest(unittest.TestCase):
+    """Test the SQLite storage."""
+
+    def setUp(self):
+        super(SqliteStorageTest, self).setUp()
+        self.storage = storage.SqliteStorage(':memory:')
+
+    def test_create_item(self):
+        """Created items are current until they are reviewed."""
+
+        coffee = self.storage.create_item({
+            'Category': 'good', 'Object': 'The coffee', 'Creator': 'retroman'})
+        tea = self.storage.create_item({'Category': 'try', 'Object': 'The tea'})
+
+        self.assertTrue(coffee['id'].startswith('rec'))
+        self.assertEqual(
+            {'Category': 'good', 'Object': 'The coffee', 'Creator': 'retroman'}, coffee['fields'])
+        self.assertEqual([coffee, tea], self.storage.iterate_current_items())
+
+        errors = self.storage.update_items([
+            {'id': coffee['id'], 'fields': {'Reviewed At': '2018-10-17T10:00:00.000Z'}},
+            {'id': 'recUnknown', 'fields': {'Reviewed At': '2018-10-17T10:00:00.000Z'}},
+        ])
+
+        self.assertEqual(['recUnknown'], list(errors))
+        self.assertEqual([tea], self.storage.iterate_current_items())
+
+    def test_create_items(self):
+        """Many items are created at once, in the order of their fields."""
+
+        records = self.storage.create_items([
+            {'Category': 'good', 'Object': 'The coffee'},
+            {'Category': 'try', 'Object': 'The tea', 'Committed ?': True},
+            {'Category': 'bad', 'Object': 'The water'},
+        ])
+
+        self.assertEqual(
+            ['The coffee', 'The tea', 'The water'],
+            [record['fields']['Object'] for record in records])
+        self.assertEqual(records, self.storage.iterate_current_items())
+        self.assertTrue(self.storage.has_item('try', 'the  TEA'))
+
+    def test_update_item(self):
+        """Items can be committed to."""
+
+        item = self.storage.create_item({'Category': 'try', 'Object': 'The tea'})
+
+        item = self.storage.update_item(item['id'], {'Committed ?': True})
+
+        self.assertEqual(
+            {'Category': 'try', 'Object': 'The tea', 'Committed ?': True}, item['fields'])
+        with self.assertRaises(storage.StorageError):
+            self.storage.update_item('recUnknown', {'Committed ?': True})
+
+    def test_items_version(self):
+        """The version of the items changes with each write, including from other connections."""
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        db_path = os.path.join(folder.name, 'retro.sqlite')
+        retro_storage = storage.SqliteStorage(db_path)
+        version = retro_storage.get_items_version()
+        self.assertEqual(version, retro_storage.get_items_version())
+
+        retro_storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        self.assertNotEqual(version, retro_storage.get_items_version())
+
+        version = retro_storage.get_items_version()
+        storage.SqliteStorage(db_path).create_item({'Category': 'good', 'Object': 'The tea'})
+        self.assertNotEqual(version, retro_storage.get_items_version())
+
+    def test_has_item(self):
+        """Duplicates are found among the current items, up to case and spaces."""
+
+        item = self.storage.create_item({'Category': 'good', 'Object': 'The  Coffee'})
+
+        self.assertTrue(self.storage.has_item('good', 'the coffee '))
+        self.assertFalse(self.storage.has_item('bad', 'the coffee'))
+
+        self.storage.update_item(item['id'], {'Reviewed At': '2018-10-17T10:00:00.000Z'})
+        self.assertFalse(self.storage.has_item('good', 'the coffee'))
+
+    def test_moods(self):
+        """Only the moods of the week are listed."""
+
+        now = datetime.datetime.utcnow()
+        for name, days_ago in (('Cyrille', 10), ('Pascal', 1)):
+            self.storage.create_mood({
+                'Name': name,
+                'How are you feeling at Bayes': "I'm happy",
+                'Created At': (now - datetime.timedelta(days=days_ago)).isoformat() + 'Z',
+            })
+
+        self.assertEqual(
+            ['Pascal'], [mood['fields']['Name'] for mood in self.storage.iterate_moods()])
+        pascal_mood = list(self.storage.iterate_moods())[0]
+        self.assertTrue(self.storage.has_mood(pascal_mood['fields']))
+        self.assertFalse(self.storage.has_mood(dict(pascal_mood['fields'], Name='Cyrille')))
+
+    def test_close(self):
+        """The database connection is closed with the storage."""
+
+        self.storage.close()
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.storage.iterate_current_items()
+
+    def test_items_created_since(self):
+        """All the items, even reviewed, can be read in the order of their creation."""
+
+        for index, created_at in enumerate((
+                '2018-10-17T10:00:00.000Z', '2018-10-09T10:00:00.000Z',
+                '2018-10-17T11:00:00.000Z')):
+            item = self.storage.create_item({
+                'Category': 'good', 'Object': 'Item {}'.format(index), 'Created At': created_at})
+        self.storage.update_item(item['id'], {'Reviewed At': '2018-10-18T10:00:00.000Z'})
+
+        self.assertEqual(
+            ['Item 0', 'Item 2'],
+            [item['fields']['Object'] for item in self.storage.iterate_items_created_since(
+                '2018-10-17T10:00:00.000Z')])
+
+    @mock.patch(storage.__name__ + '._SQLITE_PAGE_SIZE', 2)
+    def test_records_created_since(self):
+        """All the records of a table can be read page by page, in the order of their creation."""
+
+        for index, created_at in enumerate((
+                '2018-10-17T10:00:00.000Z', None, '2018-10-09T10:00:00.000Z',
+                '2018-10-17T10:00:00.000Z', None, '2018-10-18T10:00:00.000Z')):
+            fields = {'Category': 'good', 'Object': 'Item {}'.format(index)}
+            if created_at:
+                fields['Created At'] = created_at
+            self.storage.create_item(fields)
+
+        self.assertEqual(
+            ['Item 1', 'Item 4', 'Item 2', 'Item 0', 'Item 3', 'Item 5'],
+            [item['fields']['Object'] for item in self.storage.iterate_records_created_since(
+                'Items', '')])
+        self.assertEqual(
+            ['Item 0', 'Item 3', 'Item 5'],
+            [item['fields']['Object'] for item in self.storage.iterate_records_created_since(
+                'Items', '2018-10-17T10:00:00.000Z')])
+        self.assertEqual([], list(self.storage.iterate_records_created_since('Moods', '')))
+
+    def test_mood_trend(self):
+        """Moods are aggregated by sprint as they are created."""
+
+        for name, created_at, feelings in (
+                ('Cyrille', '2018-10-09T10:00:00.000Z', "I'm happy"),
+                ('Pascal', '2018-10-16T10:00:00.000Z', "I'm happy, \nI'm tired"),
+                ('Marie', '2018-10-17T10:00:00.000Z', "I'm tired")):
+            self.storage.create_mood({
+                'Name': name,
+                'How are you feeling at Bayes': feelings,
+                'How is your work going': 'I feel lost',
+                'Created At': created_at,
+            })
+
+        self.assertEqual(
+            [storage.MoodAggregate(
+                '2018-W42', 2, {"I'm happy": 1, "I'm tired": 2}, {'I feel lost': 2})],
+            self.storage.get_mood_trend(max_sprints=1))
+        self.assertEqual(
+            ['2018-W41', '2018-W42'],
+            [aggregate.sprint for aggregate in self.storage.get_mood_trend(max_sprints=13)])
+
+    def test_mood_trend_of_existing_moods(self):
+        """Databases that have moods but no aggregates yet are aggregated once."""
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'retro.sqlite')
+            sqlite_storage = storage.SqliteStorage(path)
+            sqlite_storage.create_mood({'Name': 'Pascal', 'Created At': '2018-10-16T10:00:00Z'})
+            with sqlite3.connect(path) as connection:
+                connection.executescript('DELETE FROM mood_sprints; DELETE FROM mood_sentences;')
+
+            self.assertEqual(
+                [('2018-W42', 1)],
+                [(aggregate.sprint, aggregate.responses)
+                 for aggregate in storage.SqliteStorage(path).get_mood_trend(max_sprints=13)])
+
+
+class AirtableStorageTest(unittest.TestCase):
+    """Test the Airtable storage."""
+
+    def setUp(self):
+        super(AirtableStorageTest, self).setUp()
+        airtablemock.clear()
+        self.addCleanup(airtablemock.clear)
+        client = airtablemock.Airtable('retro-base-id')
+        client.create('Items', {'Category': 'old'})
+        airtablemock.create_view('retro-base-id', 'Items', 'Current View', 'Category != "old"')
+        self.storage = storage.AirtableStorage(client)
+
+    def test_reviewed_items(self):
+        """Reviewed items are removed from the cached current items without reading them again."""
+
+        item = self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        self.assertTrue(self.storage.has_item('good', 'the coffee'))
+        self.assertTrue(self.storage.is_fast())
+
+        self.assertFalse(self.storage.update_items(
+            [{'id': item['id'], 'fields': {'Reviewed At': '2018-10-17T10:00:00.000Z'}}]))
+
+        self.assertEqual([], list(self.storage.iterate_current_items()))
+        self.assertFalse(self.storage.items_cache.contains_key(('good', 'the coffee')))
+
+    def test_has_item_from_other_container(self):
+        """Items added by another container are found before the cache expires."""
+
+        self.assertFalse(self.storage.has_item('good', 'The coffee'))
+        self.assertTrue(self.storage.is_fast())
+        other_storage = storage.AirtableStorage(airtablemock.Airtable('retro-base-id'))
+        other_storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+
+        self.assertTrue(self.storage.has_item('good', 'The coffee'))
+
+    def test_forget_items(self):
+        """Items modified elsewhere are dropped from memory without reading the view again."""
+
+        coffee = self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        tea = self.storage.create_item({'Category': 'good', 'Object': 'The tea'})
+        list(self.storage.iterate_current_items())
+
+        self.storage.forget_items([coffee['id']])
+        self.assertEqual([tea], list(self.storage.iterate_current_items()))
+
+        self.storage.forget_items()
+        self.assertEqual([], list(self.storage.iterate_current_items()))
+        self.assertTrue(self.storage.is_fast())
+
+        self.storage.expire_items()
+        self.assertFalse(self.storage.is_fast())
+        self.assertEqual(2, len(list(self.storage.iterate_current_items())))
+
+    def test_items_version(self):
+        """The version of the items is only known while they are cached."""
+
+        self.assertIsNone(self.storage.get_items_version())
+        list(self.storage.iterate_current_items())
+        version = self.storage.get_items_version()
+        self.assertIsNotNone(version)
+        self.assertEqual(version, self.storage.get_items_version())
+
+        self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+
+        self.assertNotEqual(version, self.storage.get_items_version())
+
+        version = self.storage.get_items_version()
+        self.storage.forget_items()
+        self.assertNotEqual(version, self.storage.get_items_version())
+
+    def test_read_during_update(self):
+        """A read of the items that overlaps an update is not kept in the cache."""
+
+        item = self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        self.storage.items_cache.clear()
+        records = iter(self.storage.iterate_current_items())
+        self.assertEqual(item['id'], next(records)['id'])
+
+        self.storage.update_items(
+            [{'id': item['id'], 'fields': {'Reviewed At': '2018-10-17T10:00:00.000Z'}}])
+        list(records)
+
+        self.assertFalse(self.storage.is_fast())
+
+    def test_items_created_since(self):
+        """The new items are read in the order of their creation, without scanning the view."""
+
+        client = mock.MagicMock()
+        client.iterate.return_value = iter([])
+        airtable_storage = storage.AirtableStorage(client)
+
+        list(airtable_storage.iterate_items_created_since('2018-10-17T10:00:00.000Z'))
+
+        client.iterate.assert_called_once_with(
+            'Items', fields=('Category', 'Object', 'Creator', 'Created At'),
+            filter_by_formula='NOT(IS_BEFORE({Created At}, "2018-10-17T10:00:00.000Z"))',
+            sort_field='Created At')
+
+    def test_records_created_since(self):
+        """All the records of a table are read in the order of their creation."""
+
+        client = mock.MagicMock()
+        client.iterate.return_value = iter([])
+        airtable_storage = storage.AirtableStorage(client)
+
+        list(airtable_storage.iterate_records_created_since(
+            'Moods', '2018-10-17T10:00:00.000Z', fields=('Created At',)))
+        list(airtable_storage.iterate_records_created_since('Items', ''))
+        list(airtable_storage.iterate_records_created_since('Items', '2018"), TRUE()'))
+
+        self.assertEqual([
+            mock.call(
+                'Moods', fields=['Created At'],
+                filter_by_formula='NOT(IS_BEFORE({Created At}, "2018-10-17T10:00:00.000Z"))',
+                sort_field='Created At'),
+            mock.call('Items', fields=None, filter_by_formula=None, sort_field='Created At'),
+            mock.call(
+                'Items', fields=None,
+                filter_by_formula=r'NOT(IS_BEFORE({Created At}, "2018\"), TRUE()"))',
+                sort_field='Created At'),
+        ], client.iterate.call_args_list)
+        with self.assertRaises(ValueError):
+            airtable_storage.iterate_records_created_since('Mood Trend', '')
+
+    def test_mood_trend(self):
+        """Only the moods that were created since the last update are added to the trend."""
+
+        client = airtablemock.Airtable('retro-base-id')
+        client.create('Moods', {'Name': 'old'})
+        airtablemock.create_view('retro-base-id', 'Moods', 'Current View', 'Name != "old"')
+        airtablemock.create_empty_table('retro-base-id', 'Mood Trend')
+        client.create('Moods', {
+            'Name': 'Cyrille',
+            'How are you feeling at Bayes': "I'm happy",
+            'Created At': '2018-10-16T10:00:00.000Z',
+        })
+        self.storage.update_mood_trend()
+
+        client.create('Moods', {
+            'Name': 'Pascal',
+            'How are you feeling at Bayes': "I'm happy, \nI'm tired",
+            'How is your work going': 'I feel lost',
+            'Created At': '2018-10-17T10:00:00.000Z',
+        })
+        self.storage.update_mood_trend()
+        self.storage.update_mood_trend()
+
+        self.assertEqual(
+            [storage.MoodAggregate(
+                '2018-W42', 2, {"I'm happy": 2, "I'm tired": 1}, {'I feel lost': 1})],
+            self.storage.get_mood_trend(max_sprints=13))
+        self.assertEqual(1, len(client.get('Mood Trend')['records']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Configuration of the Slack teams served by a single deployment of the bot.
+
+Each tenant is a Slack team, or a channel of a team, with its own Slack token, webhook and storage:
+either an Airtable base or a local SQLite database. The resources used to serve a tenant, e.g. its
+Airtable client and caches, are only kept for the most recently active tenants.
+"""
+
+import collections
+import json
+import threading
+
+# The tenant that serves the teams and channels that are not configured explicitly.
+DEFAULT_TENANT_ID = ''
+
+_SLACK_FIELDS = ('slack_token', 'slack_webhook_url')
+_AIRTABLE_FIELDS = ('airtable_base_id', 'airtable_api_key')
+_TENANT_FIELDS = _SLACK_FIELDS + _AIRTABLE_FIELDS + ('sqlite_path', 'typeform_secret')
+
+TenantConfig = collections.namedtuple('TenantConfig', ('tenant_id',) + _TENANT_FIELDS)
+# Most tenants use Airtable, and do not receive the moods from Typeform directly.
+TenantConfig.__new__.__defaults__ = (None, None)
+
+
+def _get_missing_fields(fields):
+    required_fields = _SLACK_FIELDS + (() if fields.get('sqlite_path') else _AIRTABLE_FIELDS)
+    return [field for field in required_fields if not fields.get(field)]
+
+
+def parse_registry(tenants_json, defaults):
+    """Parse the config of all the tenants.
+
+    Args:
+        tenants_json: a JSON object of tenant configs keyed by Slack team ID, or by team and
+            channel IDs such as "T0123/C0456" for a channel that has its own base. Each config
+            has the fields of TenantConfig except the tenant_id. The Airtable fields are not
+            needed if the tenant sets a sqlite_path.
+        defaults: a dict of the fields to use when a tenant does not set them, e.g. an API key
+            shared by all the bases. If it has all the fields, it is also the config of the
+            default tenant.
+    Returns:
+        a dict of TenantConfig keyed by tenant ID.
+    Raises:
+        ValueError: if the JSON is invalid or a tenant lacks some fields.
+    """
+
+    configs = json.loads(tenants_json or '{}')
+    if not isinstance(configs, dict):
+        raise ValueError('Tenants should be a JSON object keyed by Slack team ID.')
+    if not _get_missing_fields(defaults):
+        configs = dict(configs, **{DEFAULT_TENANT_ID: {}})
+
+    registry = {}
+    for tenant_id, config in configs.items():
+        fields = {field: config.get(field) or defaults.get(field) for field in _TENANT_FIELDS}
+        missing_fields = _get_missing_fields(fields)
+        if missing_fields:
+            raise ValueError('Tenant "{}" lacks: {}'.format(tenant_id, ', '.join(missing_fields)))
+        registry[tenant_id] = TenantConfig(tenant_id=tenant_id, **fields)
+    return registry
+
+
+def find_tenant_id(registry, team_id, channel_id=None):
+    """Find the tenant serving a Slack channel.
+
+    Returns:
+        the ID of the most specific tenant: the channel's, the team's or the default one, or None
+        if none of them is configured.
+    """
+
+    for tenant_id in ('{}/{}'.format(team_id, channel_id), team_id, DEFAULT_TENANT_ID):
+        if tenant_id in registry:
+            return tenant_id
+    return None
+
+
+class LruPool(object):
+    """A pool of resources created on demand, that only keeps the most recently used ones."""
+
+    def __init__(self, factory, max_size, close=None):
+        """Create a pool.
+
+        Args:
+            factory: a function creating the resource of a key.
+            max_size: the number of resources to keep.
+            close: a function releasing a resource when it is dropped from the pool, e.g. to close
+                its database connection.
+        """
+
+        self._factory = factory
+        self._max_size = max_size
+        self._close = close
+        self._resources = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):  # pylint: disable=invalid-name
+        """Get the resource for a key, creating it if needed."""
+
+        evicted = []
+        with self._lock:
+            try:
+                self._resources.move_to_end(key)
+                return self._resources[key]
+            except KeyError:
+                pass
+            resource = self._factory(key)
+            self._resources[key] = resource
+            while len(self._resources) > self._max_size:
+                evicted.append(self._resources.popitem(last=False)[1])
+        # Outside of the lock, as closing a resource might take a while.
+        if self._close:
+            for evicted_resource in evicted:
+                self._close(evicted_resource)
+        return resource
+
+    def values(self):
+        """The resources in the pool, from the least to the most recently used."""
+
+        with self._lock:
+            return list(self._resources.values())
+
+    def clear(self):
+        """Drop all the resources."""
+
+        with self._lock:
+            self._resources.clear()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Test the configuration of the Slack teams served by the bot."""
+
+import json
+import unittest
+
+import mock
+
+import tenants
+
+_DEFAULTS = {
+    'slack_token': 'default-token',
+    'slack_webhook_url': 'https://slack/hook',
+    'airtable_base_id': 'default-base-id',
+    'airtable_api_key': 'api-key',
+}
+
+
+class RegistryTest(unittest.TestCase):
+    """Test the registry of tenants."""
+
+    def test_single_tenant(self):
+        """Without any other config, the env variables configure the default tenant."""
+
+        registry = tenants.parse_registry(None, _DEFAULTS)
+
+        self.assertEqual([tenants.DEFAULT_TENANT_ID], list(registry))
+        self.assertEqual('default-base-id', registry[''].airtable_base_id)
+        self.assertEqual('', tenants.find_tenant_id(registry, 'T1', 'C1'))
+
+    def test_many_tenants(self):
+        """Teams and channels can have their own config, using the defaults for missing fields."""
+
+        registry = tenants.parse_registry(json.dumps({
+            'T1': {'slack_token': 'team1-token', 'airtable_base_id': 'team1-base-id'},
+            'T1/C2': {'slack_token': 'team1-token', 'airtable_base_id': 'channel2-base-id'},
+        }), dict(_DEFAULTS, slack_token=None))
+
+        self.assertEqual(['T1', 'T1/C2'], sorted(registry))
+        self.assertEqual('api-key', registry['T1'].airtable_api_key)
+        self.assertEqual('T1', tenants.find_tenant_id(registry, 'T1', 'C1'))
+        self.assertEqual('T1/C2', tenants.find_tenant_id(registry, 'T1', 'C2'))
+        self.assertIsNone(tenants.find_tenant_id(registry, 'T2', 'C2'))
+
+    def test_missing_fields(self):
+        """A tenant needs all its fields."""
+
+        with self.assertRaisesRegex(ValueError, 'T1.*slack_token'):
+            tenants.parse_registry('{"T1": {"airtable_base_id": "base-id"}}', {})
+
+    def test_invalid_json(self):
+        """The registry must be a JSON object."""
+
+        with self.assertRaises(ValueError):
+            tenants.parse_registry('["T1"]', _DEFAULTS)
+        with self.assertRaises(ValueError):
+            tenants.parse_registry('{T1', _DEFAULTS)
+
+
+class LruPoolTest(unittest.TestCase):
+    """Test the pool of resources."""
+
+    def test_least_recently_used(self):
+        """The least recently used resources are dropped first."""
+
+        factory = mock.MagicMock(side_effect=lambda key: {'key': key})
+        pool = tenants.LruPool(factory, max_size=2)
+
+        first = pool.get('T1')
+        pool.get('T2')
+        self.assertIs(first, pool.get('T1'))
+        pool.get('T3')
+
+        self.assertEqual(['T1', 'T3'], [resource['key'] for resource in pool.values()])
+        self.assertEqual(3, factory.call_count)
+        pool.get('T2')
+        self.assertEqual(4, factory.call_count)
+
+    def test_close(self):
+        """The resources dropped from the pool are closed."""
+
+        close = mock.MagicMock()
+        pool = tenants.LruPool(lambda key: {'key': key}, max_size=1, close=close)
+
+        pool.get('T1')
+        close.assert_not_called()
+        pool.get('T2')
+
+        close.assert_called_once_with({'key': 'T1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
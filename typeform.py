@@ -0,0 +1,90 @@
+"""Read the mood check ins that Typeform sends to a webhook when a form is submitted.
+
+The questions of the form are matched to the fields of the Moods table by their "ref", set in the
+settings of each question in Typeform: see _FIELDS_BY_REF. The name of the person can also be a
+hidden field of the form.
+"""
+
+import base64
+import collections
+import datetime
+import hashlib
+import hmac
+
+_FIELDS_BY_REF = {
+    'name': 'Name',
+    'feeling': 'How are you feeling at Bayes',
+    'feeling_free_text': 'Feeling at bayes free text',
+    'work_status': 'How is your work going',
+    'work_status_free_text': 'How is your work going free text',
+}
+# How several choices are joined in a field, as the Typeform integration of Airtable does.
+_CHOICES_SEPARATOR = ', \n'
+
+# A submitted form: its token, unique to each submission, and the fields of its mood.
+MoodSubmission = collections.namedtuple('MoodSubmission', ('token', 'fields'))
+
+
+def is_signed(secret, body, signature):
+    """Check the signature of a webhook request, sent in its "Typeform-Signature" header.
+
+    Args:
+        secret: the secret set in the webhook settings of the form.
+        body: the raw body of the request, as bytes.
+        signature: the value of the header, or None if it is missing.
+    """
+
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    expected = 'sha256=' + base64.b64encode(digest).decode('ascii')
+    return hmac.compare_digest(expected, signature)
+
+
+def _get_answer_value(answer):
+    answer_type = answer.get('type')
+    if answer_type == 'choice':
+        choice = answer.get('choice') or {}
+        return choice.get('label') or choice.get('other') or ''
+    if answer_type == 'choices':
+        choices = answer.get('choices') or {}
+        labels = list(choices.get('labels') or [])
+        if choices.get('other'):
+            labels.append(choices['other'])
+        return _CHOICES_SEPARATOR.join(labels)
+    value = answer.get(answer_type)
+    return value if isinstance(value, str) else ''
+
+
+def _format_time(submitted_at):
+    try:
+        parsed = datetime.datetime.strptime(submitted_at[:19], '%Y-%m-%dT%H:%M:%S')
+    except (TypeError, ValueError):
+        parsed = datetime.datetime.utcnow()
+    return parsed.isoformat(timespec='milliseconds') + 'Z'
+
+
+def parse_submission(payload):
+    """Parse the JSON payload of a webhook request.
+
+    Returns:
+        a MoodSubmission.
+    Raises:
+        ValueError: if the payload is not a submitted form.
+    """
+
+    form_response = payload.get('form_response') if isinstance(payload, dict) else None
+    if not isinstance(form_response, dict) or not form_response.get('token'):
+        raise ValueError('Not a submitted form.')
+
+    fields = {}
+    hidden_name = (form_response.get('hidden') or {}).get('name')
+    if hidden_name:
+        fields['Name'] = hidden_name
+    for answer in form_response.get('answers') or []:
+        field = _FIELDS_BY_REF.get((answer.get('field') or {}).get('ref'))
+        value = _get_answer_value(answer)
+        if field and value:
+            fields[field] = value
+    fields['Created At'] = _format_time(form_response.get('submitted_at'))
+    return MoodSubmission(token=form_response['token'], fields=fields)
@@ -0,0 +1,92 @@
+"""Unit tests for the typeform module."""
+
+import base64
+import hashlib
+import hmac
+import json
+import unittest
+
+import typeform
+
+
+def sign(secret, body):
+    """Sign the body of a webhook request as Typeform does."""
+
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return 'sha256=' + base64.b64encode(digest).decode('ascii')
+
+
+def create_payload(token, name, feelings, work_status='', free_text=''):
+    """Create the payload of a submitted mood form, as Typeform sends it."""
+
+    answers = [
+        {'type': 'text', 'text': name, 'field': {'ref': 'name', 'type': 'short_text'}},
+        {
+            'type': 'choices',
+            'choices': {'labels': feelings},
+            'field': {'ref': 'feeling', 'type': 'multiple_choice'},
+        },
+        {'type': 'text', 'text': free_text, 'field': {'ref': 'feeling_free_text'}},
+    ]
+    if work_status:
+        answers.append({
+            'type': 'choice',
+            'choice': {'label': work_status},
+            'field': {'ref': 'work_status', 'type': 'multiple_choice'},
+        })
+    return {
+        'event_type': 'form_response',
+        'form_response': {
+            'token': token,
+            'submitted_at': '2018-10-17T10:00:00Z',
+            'answers': answers,
+        },
+    }
+
+
+class TypeformTestCase(unittest.TestCase):
+    """Unit tests for the parsing of the webhook requests."""
+
+    def test_is_signed(self):
+        """Only the requests signed with the secret are accepted."""
+
+        body = json.dumps(create_payload('token1', 'Pascal', ["I'm happy"])).encode('utf-8')
+
+        self.assertTrue(typeform.is_signed('secret', body, sign('secret', body)))
+        self.assertFalse(typeform.is_signed('secret', body, sign('other', body)))
+        self.assertFalse(typeform.is_signed('secret', body, None))
+        self.assertFalse(typeform.is_signed(None, body, sign('secret', body)))
+
+    def test_parse_submission(self):
+        """Answers are matched to the fields of the Moods table by their ref."""
+
+        submission = typeform.parse_submission(create_payload(
+            'token1', 'Pascal', ["I'm happy", "I'm tired"], work_status='I feel lost'))
+
+        self.assertEqual('token1', submission.token)
+        self.assertEqual({
+            'Name': 'Pascal',
+            'How are you feeling at Bayes': "I'm happy, \nI'm tired",
+            'How is your work going': 'I feel lost',
+            'Created At': '2018-10-17T10:00:00.000Z',
+        }, submission.fields)
+
+    def test_hidden_name(self):
+        """The name of the person can be a hidden field."""
+
+        payload = create_payload('token1', '', ["I'm happy"])
+        payload['form_response']['hidden'] = {'name': 'Cyrille'}
+
+        self.assertEqual('Cyrille', typeform.parse_submission(payload).fields['Name'])
+
+    def test_not_a_submission(self):
+        """Other payloads are rejected."""
+
+        with self.assertRaises(ValueError):
+            typeform.parse_submission({'event_type': 'form_response'})
+        with self.assertRaises(ValueError):
+            typeform.parse_submission(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""The reads and writes of the retrospective items during a single request.
+
+A request that reads the same items several times, or updates the same item several times, only
+reads them once and writes them together: the items that were read are kept in memory with the
+updates of the request applied, and the updates are merged by item until they are flushed.
+"""
+
+import collections
+import threading
+
+
+class UnitOfWork(object):
+    """The items read and the updates made by a request, to be flushed once at its end.
+
+    It can be used by several threads of the same request.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._lock = threading.Lock()
+        # Identity map of the items read during the request, by ID.
+        self._records = {}
+        self._current_item_ids = None
+        # Updates by item ID, in the order of their first update.
+        self._pending_fields = collections.OrderedDict()
+        self._written_fields = collections.defaultdict(dict)
+
+    def _get_record(self, item_id):
+        record = self._records[item_id]
+        fields = dict(record['fields'])
+        fields.update(self._written_fields.get(item_id, {}))
+        fields.update(self._pending_fields.get(item_id, {}))
+        return dict(record, fields=fields)
+
+    def get_current_items(self):
+        """Get the items of the current sprint, with the updates of this request.
+
+        The storage is only read the first time.
+        """
+
+        with self._lock:
+            if self._current_item_ids is not None:
+                return [self._get_record(item_id) for item_id in self._current_item_ids]
+        records = list(self._storage.iterate_current_items())
+        with self._lock:
+            if self._current_item_ids is None:
+                for record in records:
+                    self._records.setdefault(record['id'], record)
+                self._current_item_ids = [record['id'] for record in records]
+            return [self._get_record(item_id) for item_id in self._current_item_ids]
+
+    def update_item(self, item_id, fields):
+        """Update partially an item when the work is flushed."""
+
+        with self._lock:
+            self._pending_fields.setdefault(item_id, {}).update(fields)
+
+    def flush(self):
+        """Write all the pending updates, with a single update of each item.
+
+        Returns:
+            a dict of error messages keyed by the IDs of the items that could not be updated.
+        """
+
+        with self._lock:
+            pending_fields = self._pending_fields
+            self._pending_fields = collections.OrderedDict()
+        if not pending_fields:
+            return {}
+        errors = self._storage.update_items([
+            {'id': item_id, 'fields': fields} for item_id, fields in pending_fields.items()])
+        with self._lock:
+            for item_id, fields in pending_fields.items():
+                if item_id not in errors:
+                    self._written_fields[item_id].update(fields)
+        return errors
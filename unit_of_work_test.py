@@ -0,0 +1,71 @@
+"""Unit tests for the unit_of_work module."""
+
+import unittest
+
+import mock
+
+import storage
+import unit_of_work
+
+
+class UnitOfWorkTestCase(unittest.TestCase):
+    """Unit tests for the UnitOfWork class."""
+
+    def setUp(self):
+        super(UnitOfWorkTestCase, self).setUp()
+        self.storage = mock.MagicMock(wraps=storage.SqliteStorage(':memory:'))
+        self.coffee = self.storage.create_item({'Category': 'try', 'Object': 'More coffee'})
+        self.tea = self.storage.create_item({'Category': 'try', 'Object': 'Less tea'})
+        self.work = unit_of_work.UnitOfWork(self.storage)
+
+    def test_read_once(self):
+        """The items are only read once, and then include the updates of the request."""
+
+        self.assertEqual(2, len(self.work.get_current_items()))
+        self.work.update_item(self.coffee['id'], {'Committed ?': True})
+
+        items = self.work.get_current_items()
+
+        self.storage.iterate_current_items.assert_called_once_with()
+        self.assertEqual(
+            [('More coffee', True), ('Less tea', None)],
+            [(item['fields']['Object'], item['fields'].get('Committed ?')) for item in items])
+
+    def test_merged_updates(self):
+        """Several updates of the same item are written together, in a single flush."""
+
+        self.work.update_item(self.coffee['id'], {'Committed ?': True})
+        self.work.update_item(self.tea['id'], {'Reviewed At': '2018-10-17T10:00:00.000Z'})
+        self.work.update_item(self.coffee['id'], {'Reviewed At': '2018-10-17T10:00:00.000Z'})
+        self.storage.update_items.assert_not_called()
+
+        self.assertEqual({}, self.work.flush())
+        self.assertEqual({}, self.work.flush())
+
+        self.storage.update_items.assert_called_once_with([
+            {
+                'id': self.coffee['id'],
+                'fields': {'Committed ?': True, 'Reviewed At': '2018-10-17T10:00:00.000Z'},
+            },
+            {'id': self.tea['id'], 'fields': {'Reviewed At': '2018-10-17T10:00:00.000Z'}},
+        ])
+        self.assertEqual([], list(self.storage.iterate_current_items()))
+
+    def test_failed_update(self):
+        """The items that could not be updated keep their fields."""
+
+        self.work.get_current_items()
+        self.work.update_item(self.coffee['id'], {'Reviewed At': '2018-10-17T10:00:00.000Z'})
+        self.work.update_item(self.tea['id'], {'Reviewed At': '2018-10-17T10:00:00.000Z'})
+        self.storage.update_items.return_value = {self.coffee['id']: 'Record is locked'}
+
+        self.assertEqual([self.coffee['id']], list(self.work.flush()))
+
+        self.assertEqual(
+            ['More coffee'],
+            [item['fields']['Object'] for item in self.work.get_current_items()
+             if not item['fields'].get('Reviewed At')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,386 @@
+"""A write-behind queue for the items created in a slow storage, e.g. an Airtable base.
+
+New items are first written to a local SQLite database so that they can be acknowledged at once.
+A background task then creates them in the storage by batches of up to 10 records. Until then,
+they are listed with the current items and found as duplicates, with a temporary ID that can be
+used to update them. Once created, they are still listed, with the ID of their record, until the
+storage lists them: its cache of the current items may be older than the flush.
+
+On AWS Lambda, the database must be on a storage shared by all the containers, e.g. an EFS volume:
+the flush usually runs in another container, and a container's own disk is lost when it stops.
+Each flush claims the items it creates so that concurrent flushes do not create them twice. Items
+that might have been created by a request that failed are not created again: they are logged and
+left out, as creating them again could duplicate them.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+import airtable_client
+import request_timing
+import storage
+
+# Temporary IDs of the queued items, Airtable IDs start with "rec".
+_QUEUED_ID_PREFIX = 'queued'
+# Flushed items are kept for a while so that their temporary IDs can still be used, e.g. by the
+# buttons of a Slack message that was sent before the flush, and failed items to be checked.
+_FLUSHED_ITEMS_TTL_SECONDS = 7 * 24 * 3600
+# Items claimed by a flush that did not finish in that time, e.g. because its container was
+# stopped, are created by the next flush.
+_CLAIM_TTL_SECONDS = 120
+# Created items are listed from the queue for longer than the storage may cache its current items.
+_FLUSHED_ITEMS_LISTED_SECONDS = 600
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS queued_items (
+        id TEXT PRIMARY KEY,
+        fields TEXT NOT NULL,
+        category TEXT NOT NULL,
+        object_key TEXT NOT NULL,
+        record_id TEXT,
+        flushed_at REAL,
+        claim TEXT,
+        claimed_at REAL,
+        failed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS queued_items_by_object ON queued_items (category, object_key);
+    CREATE INDEX IF NOT EXISTS queued_items_by_record ON queued_items (record_id)
+        WHERE record_id IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS queued_items_by_date ON queued_items (flushed_at);
+    CREATE INDEX IF NOT EXISTS queued_items_by_failure ON queued_items (failed_at)
+        WHERE failed_at IS NOT NULL;
+'''
+
+
+def _is_queued_id(item_id):
+    return item_id.startswith(_QUEUED_ID_PREFIX)
+
+
+class WriteBehindStorage(storage.Storage):
+    """A storage that queues the new items locally before creating them in another storage."""
+
+    def __init__(self, inner_storage, path, schedule_flush=None):
+        """Queue the new items of a storage.
+
+        Args:
+            inner_storage: the storage where the items are eventually created.
+            path: the path of the SQLite database of the queue.
+            schedule_flush: a function called after an item is queued, to flush it soon, e.g. in
+                a background task, or None to only flush the items explicitly.
+        """
+
+        self._storage = inner_storage
+        self._schedule_flush = schedule_flush
+        # The connection is shared by the threads of the container, one query at a time.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # Counts the writes of this connection: the data version of SQLite only counts the others.
+        self._write_count = 0
+        # Held while the queued items are created, so that they are not updated meanwhile.
+        self._flush_lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def _query(self, query, params=()):
+        with request_timing.span('write-queue'), self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def _write(self, query, params_list):
+        try:
+            with request_timing.span('write-queue'), self._lock, self._connection:
+                self._write_count += 1
+                return self._connection.executemany(query, params_list).rowcount
+        except sqlite3.Error as error:
+            raise storage.StorageError('Could not write to the queue: {}'.format(error)) from error
+
+    def _get_queued_records(self):
+        """Get the queued items, and the recently created ones with the ID of their record."""
+
+        return [
+            {'id': row['record_id'] or row['id'], 'fields': json.loads(row['fields'])}
+            for row in self._query(
+                'SELECT id, fields, record_id FROM queued_items '
+                'WHERE (record_id IS NULL AND failed_at IS NULL) OR flushed_at > ? ORDER BY rowid',
+                (time.time() - _FLUSHED_ITEMS_LISTED_SECONDS,))]
+
+    def iterate_current_items(self):
+        # Queued items that were created while reading the storage are not listed twice.
+        queued_records = self._get_queued_records()
+        record_ids = set()
+        keys = set()
+        for record in self._storage.iterate_current_items():
+            record_ids.add(record['id'])
+            keys.add(storage.normalize_item_key(
+                record['fields'].get('Category', ''), record['fields'].get('Object', '')))
+            yield record
+        for record in queued_records:
+            fields = record['fields']
+            if record['id'] in record_ids or fields.get('Reviewed At'):
+                continue
+            if storage.normalize_item_key(
+                    fields.get('Category', ''), fields.get('Object', '')) in keys:
+                continue
+            yield record
+
+    def has_item(self, category, item_object):
+        category, object_key = storage.normalize_item_key(category, item_object)
+        rows = self._query(
+            'SELECT fields FROM queued_items WHERE category = ? AND object_key = ? '
+            'AND ((record_id IS NULL AND failed_at IS NULL) OR flushed_at > ?)',
+            (category, object_key, time.time() - _FLUSHED_ITEMS_LISTED_SECONDS))
+        if any(not json.loads(row['fields']).get('Reviewed At') for row in rows):
+            return True
+        return self._storage.has_item(category, item_object)
+
+    def iterate_items_created_since(self, created_at):
+        # Queued items are only found once they are created in the storage.
+        return self._storage.iterate_items_created_since(created_at)
+
+    def iterate_records_created_since(self, table, created_at, fields=None):
+        return self._storage.iterate_records_created_since(table, created_at, fields=fields)
+
+    def create_item(self, fields):
+        item_id = '{}{}'.format(_QUEUED_ID_PREFIX, uuid.uuid4().hex[:14])
+        category, object_key = storage.normalize_item_key(
+            fields.get('Category', ''), fields.get('Object', ''))
+        self._write(
+            'INSERT INTO queued_items (id, fields, category, object_key) VALUES (?, ?, ?, ?)',
+            [(item_id, json.dumps(fields), category, object_key)])
+        if self._schedule_flush:
+            self._schedule_flush()
+        return {'id': item_id, 'fields': dict(fields)}
+
+    def create_items(self, fields_list):
+        # Many items at once are already created by batches: no need to queue them.
+        return self._storage.create_items(fields_list)
+
+    def update_item(self, item_id, fields):
+        if not _is_queued_id(item_id):
+            record = self._storage.update_item(item_id, fields)
+            self._update_created_items([{'id': item_id, 'fields': fields}])
+            return record
+        try:
+            with self._flush_lock:
+                record = self._update_queued_item(item_id, fields)
+            if record:
+                return record
+            record_id = self._get_record_id(item_id)
+        except KeyError as error:
+            raise storage.StorageError(str(error)) from error
+        record = self._storage.update_item(record_id, fields)
+        self._update_created_items([{'id': record_id, 'fields': fields}])
+        return record
+
+    def _update_created_items(self, records):
+        """Update the fields of the created items, as they are still listed from the queue."""
+
+        try:
+            with request_timing.span('write-queue'), self._lock, self._connection:
+                for record in records:
+                    row = self._connection.execute(
+                        'SELECT fields FROM queued_items WHERE record_id = ?',
+                        (record['id'],)).fetchone()
+                    if not row:
+                        continue
+                    self._write_count += 1
+                    self._connection.execute(
+                        'UPDATE queued_items SET fields = ? WHERE record_id = ?',
+                        (json.dumps(dict(json.loads(row[0]), **record['fields'])), record['id']))
+        except sqlite3.Error as error:
+            raise storage.StorageError('Could not write to the queue: {}'.format(error)) from error
+
+    def _get_record_id(self, item_id):
+        rows = self._query('SELECT record_id FROM queued_items WHERE id = ?', (item_id,))
+        if not rows:
+            raise KeyError('Could not find queued item {}'.format(item_id))
+        return rows[0]['record_id']
+
+    def _update_queued_item(self, item_id, fields):
+        """Update an item that is still queued, with the flush lock held.
+
+        Returns:
+            the updated record, or None if the item was already created in the storage.
+        """
+
+        rows = self._query(
+            'SELECT fields, record_id, failed_at FROM queued_items WHERE id = ?', (item_id,))
+        if not rows:
+            raise KeyError('Could not find queued item {}'.format(item_id))
+        if rows[0]['failed_at']:
+            raise KeyError('Queued item {} might not have been created'.format(item_id))
+        if rows[0]['record_id']:
+            return None
+        # Not created yet: it will be created with the new fields, unless a flush in another
+        # container just created it.
+        new_fields = dict(json.loads(rows[0]['fields']), **fields)
+        if not self._write(
+                'UPDATE queued_items SET fields = ? WHERE id = ? AND record_id IS NULL',
+                [(json.dumps(new_fields), item_id)]):
+            return None
+        return {'id': item_id, 'fields': new_fields}
+
+    def update_items(self, records):
+        if not any(_is_queued_id(record['id']) for record in records):
+            errors = self._storage.update_items(records)
+            self._update_created_items(
+                [record for record in records if record['id'] not in errors])
+            return errors
+
+        errors = {}
+        created_records = []
+        queued_ids_by_record_id = {}
+        with self._flush_lock:
+            for record in records:
+                if not _is_queued_id(record['id']):
+                    created_records.append(record)
+                    continue
+                try:
+                    if self._update_queued_item(record['id'], record['fields']):
+                        continue
+                    record_id = self._get_record_id(record['id'])
+                except KeyError as error:
+                    errors[record['id']] = str(error)
+                    continue
+                queued_ids_by_record_id[record_id] = record['id']
+                created_records.append(dict(record, id=record_id))
+        created_errors = self._storage.update_items(created_records)
+        self._update_created_items(
+            [record for record in created_records if record['id'] not in created_errors])
+        errors.update({
+            queued_ids_by_record_id.get(record_id, record_id): error
+            for record_id, error in created_errors.items()})
+        return errors
+
+    def iterate_moods(self):
+        return self._storage.iterate_moods()
+
+    def create_mood(self, fields):
+        return self._storage.create_mood(fields)
+
+    def has_mood(self, fields):
+        return self._storage.has_mood(fields)
+
+    def get_mood_trend(self, max_sprints):
+        return self._storage.get_mood_trend(max_sprints)
+
+    def update_mood_trend(self):
+        self._storage.update_mood_trend()
+
+    def is_fast(self):
+        return self._storage.is_fast()
+
+    def forget_items(self, item_ids=None):
+        self._storage.forget_items(item_ids)
+
+    def expire_items(self):
+        self._storage.expire_items()
+
+    def get_items_version(self):
+        storage_version = self._storage.get_items_version()
+        if storage_version is None:
+            return None
+        with self._lock:
+            return storage_version, self._write_count, self._connection.execute(
+                'PRAGMA data_version').fetchone()[0]
+
+    def warm_up(self):
+        self.flush()
+        self._storage.warm_up()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+        self._storage.close()
+
+    def _claim_items(self):
+        """Claim the next items to create, so that the flushes of other containers skip them."""
+
+        claim = uuid.uuid4().hex
+        now = time.time()
+        # A single statement, so that two flushes cannot claim the same items.
+        self._write(
+            'UPDATE queued_items SET claim = ?, claimed_at = ? WHERE id IN ('
+            'SELECT id FROM queued_items WHERE record_id IS NULL AND failed_at IS NULL '
+            'AND (claimed_at IS NULL OR claimed_at < ?) ORDER BY rowid LIMIT ?)',
+            [(claim, now, now - _CLAIM_TTL_SECONDS, airtable_client.MAX_RECORDS_PER_REQUEST)])
+        return self._query(
+            'SELECT id, fields FROM queued_items WHERE claim = ? ORDER BY rowid', (claim,))
+
+    def _release_items(self, rows, records):
+        """Record the IDs of the created items, and release the others for the next flush.
+
+        The items that might have been created are marked as failed instead, and never released.
+
+        Returns:
+            the created records whose items were updated in another container while they were
+            created, with their new fields.
+        """
+
+        updated_records = []
+        try:
+            with request_timing.span('write-queue'), self._lock, self._connection:
+                self._write_count += 1
+                now = time.time()
+                for row, record in zip(rows, records):
+                    if record is storage.MAYBE_CREATED:
+                        logging.error(
+                            'Queued item %s might have been created, it is not created again: %s',
+                            row['id'], row['fields'])
+                        self._connection.execute(
+                            'UPDATE queued_items SET failed_at = ?, claim = NULL, '
+                            'claimed_at = NULL WHERE id = ?', (now, row['id']))
+                        continue
+                    if not record:
+                        self._connection.execute(
+                            'UPDATE queued_items SET claim = NULL, claimed_at = NULL '
+                            'WHERE id = ?', (row['id'],))
+                        continue
+                    self._connection.execute(
+                        'UPDATE queued_items SET record_id = ?, flushed_at = ?, claim = NULL '
+                        'WHERE id = ?', (record['id'], now, row['id']))
+                    fields = self._connection.execute(
+                        'SELECT fields FROM queued_items WHERE id = ?', (row['id'],)).fetchone()
+                    if fields and fields[0] != row['fields']:
+                        updated_records.append(
+                            {'id': record['id'], 'fields': json.loads(fields[0])})
+        except sqlite3.Error as error:
+            raise storage.StorageError('Could not write to the queue: {}'.format(error)) from error
+        return updated_records
+
+    @request_timing.instrumented
+    @airtable_client.background_priority()
+    def flush(self):
+        """Create the queued items in the storage, by batches.
+
+        Returns:
+            the number of items that could not be created and are still queued.
+        """
+
+        with self._flush_lock:
+            while True:
+                rows = self._claim_items()
+                if not rows:
+                    break
+                records = self._storage.create_items([json.loads(row['fields']) for row in rows])
+                updated_records = self._release_items(rows, records)
+                if updated_records:
+                    for record_id, error in self._storage.update_items(updated_records).items():
+                        logging.error('Could not update created item %s: %s', record_id, error)
+                if not all(records):
+                    # Try again at the next flush.
+                    break
+            self._write(
+                'DELETE FROM queued_items WHERE flushed_at < ? OR failed_at < ?',
+                [(time.time() - _FLUSHED_ITEMS_TTL_SECONDS,) * 2])
+            # The items that are being created by another flush are not left.
+            left_count = self._query(
+                'SELECT COUNT(*) FROM queued_items WHERE record_id IS NULL AND failed_at IS NULL '
+                'AND (claimed_at IS NULL OR claimed_at < ?)',
+                (time.time() - _CLAIM_TTL_SECONDS,))[0][0]
+        if left_count:
+            logging.warning('%d items could not be created and are still queued.', left_count)
+        return left_count
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""Test the write-behind queue of the new items."""
+
+from os import path
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from airtable import airtable
+import airtablemock
+import mock
+import requests
+
+import storage
+import write_queue
+
+
+class _AirtableWithBatchCreate(airtablemock.Airtable):
+    """Airtable mock client that also accepts multi-record creates."""
+
+    def __init__(self, *args, **kwargs):
+        super(_AirtableWithBatchCreate, self).__init__(*args, **kwargs)
+        self.batch_create_sizes = []
+        self.is_down = False
+
+    def batch_create(self, table_name, fields_list):
+        """Create several records in a single request."""
+
+        if self.is_down:
+            raise airtable.AirtableError('SERVICE_UNAVAILABLE', 'Airtable is down')
+        self.batch_create_sizes.append(len(fields_list))
+        return [self.create(table_name, fields) for fields in fields_list]
+
+    def create(self, table_name, data):
+        if self.is_down:
+            raise airtable.AirtableError('SERVICE_UNAVAILABLE', 'Airtable is down')
+        return super(_AirtableWithBatchCreate, self).create(table_name, data)
+
+
+class WriteBehindStorageTest(unittest.TestCase):
+    """Test the write-behind storage."""
+
+    def setUp(self):
+        super(WriteBehindStorageTest, self).setUp()
+        airtablemock.clear()
+        self.addCleanup(airtablemock.clear)
+        self.client = _AirtableWithBatchCreate('retro-base-id')
+        self.client.create('Items', {'Category': 'old'})
+        airtablemock.create_view('retro-base-id', 'Items', 'Current View', 'Category != "old"')
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.queue_path = path.join(folder, 'queue.sqlite')
+        self.storage = write_queue.WriteBehindStorage(
+            storage.AirtableStorage(self.client), self.queue_path)
+
+    def _get_airtable_objects(self):
+        return [
+            record['fields']['Object']
+            for record in self.client.iterate('Items', view='Current View')]
+
+    def test_queued_items(self):
+        """Queued items are listed and found as duplicates before they are created."""
+
+        item = self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+
+        self.assertTrue(item['id'].startswith('queued'))
+        self.assertEqual([], self._get_airtable_objects())
+        self.assertEqual([item], list(self.storage.iterate_current_items()))
+        self.assertTrue(self.storage.has_item('good', 'the  coffee'))
+
+        self.assertEqual(0, self.storage.flush())
+
+        self.assertEqual(['The coffee'], self._get_airtable_objects())
+        records = list(self.storage.iterate_current_items())
+        self.assertEqual(1, len(records), msg=records)
+        self.assertTrue(records[0]['id'].startswith('rec'))
+        self.assertTrue(self.storage.has_item('good', 'the coffee'))
+
+    def test_items_version(self):
+        """The version of the items changes when an item is queued and when it is created."""
+
+        list(self.storage.iterate_current_items())
+        version = self.storage.get_items_version()
+        self.assertIsNotNone(version)
+
+        self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        queued_version = self.storage.get_items_version()
+        self.assertNotEqual(version, queued_version)
+
+        self.storage.flush()
+        self.assertNotEqual(queued_version, self.storage.get_items_version())
+
+    def test_batches(self):
+        """Queued items are created by batches of 10."""
+
+        for index in range(23):
+            self.storage.create_item({'Category': 'good', 'Object': 'Item #{}'.format(index)})
+
+        self.storage.flush()
+
+        self.assertEqual([10, 10, 3], self.client.batch_create_sizes)
+        self.assertEqual(
+            ['Item #{}'.format(index) for index in range(23)], self._get_airtable_objects())
+
+    def test_update_queued_item(self):
+        """Queued items can be updated, before and after they are created."""
+
+        item = self.storage.create_item({'Category': 'try', 'Object': 'The tea'})
+        self.storage.update_item(item['id'], {'Committed ?': True})
+        self.storage.flush()
+        self.storage.update_item(item['id'], {'Completed At': '2018-10-17T10:00:00.000Z'})
+
+        records = list(self.client.iterate('Items', view='Current View'))
+        self.assertEqual(1, len(records), msg=records)
+        self.assertTrue(records[0]['fields'].get('Committed ?'))
+        self.assertTrue(records[0]['fields'].get('Completed At'))
+
+    def test_review_queued_items(self):
+        """Queued items can be reviewed with the others."""
+
+        created = self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        self.storage.flush()
+        queued = self.storage.create_item({'Category': 'good', 'Object': 'The tea'})
+        self.assertEqual(2, len(list(self.storage.iterate_current_items())))
+
+        errors = self.storage.update_items([
+            {'id': record_id, 'fields': {'Reviewed At': '2018-10-17T10:00:00.000Z'}}
+            for record_id in (created['id'], queued['id'], 'queuedUnknown')])
+
+        self.assertEqual(['queuedUnknown'], list(errors))
+        self.assertEqual([], list(self.storage.iterate_current_items()))
+        self.storage.flush()
+        records = list(self.client.iterate('Items', view='Current View'))
+        self.assertEqual(2, len(records), msg=records)
+        self.assertTrue(all(record['fields'].get('Reviewed At') for record in records))
+
+    def test_close(self):
+        """The queue is closed with the storage it queues for."""
+
+        inner_storage = mock.MagicMock()
+        queued_storage = write_queue.WriteBehindStorage(inner_storage, self.queue_path)
+
+        queued_storage.close()
+
+        inner_storage.close.assert_called_once_with()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            queued_storage.has_item('good', 'The coffee')
+
+    def test_durable(self):
+        """Items that could not be created are kept in the queue for the next flush."""
+
+        self.client.is_down = True
+        self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(1, self.storage.flush())
+        self.client.is_down = False
+
+        other_storage = write_queue.WriteBehindStorage(
+            storage.AirtableStorage(self.client), self.queue_path)
+        other_storage.warm_up()
+
+        self.assertEqual(['The coffee'], self._get_airtable_objects())
+
+    def test_schedule_flush(self):
+        """A flush is scheduled after each queued item."""
+
+        schedule_flush = mock.MagicMock()
+        scheduled_storage = write_queue.WriteBehindStorage(
+            storage.AirtableStorage(self.client), self.queue_path, schedule_flush=schedule_flush)
+        scheduled_storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+
+        schedule_flush.assert_called_once_with()
+        self.assertEqual([], self._get_airtable_objects())
+
+    def test_concurrent_flushes(self):
+        """Items that are being created by the flush of another container are skipped."""
+
+        other_storage = write_queue.WriteBehindStorage(
+            storage.AirtableStorage(self.client), self.queue_path)
+        self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        item = self.storage.create_item({'Category': 'try', 'Object': 'The tea'})
+        create_items = self.client.batch_create
+
+        def _create_while_flushing(table_name, fields_list):
+            self.assertEqual(0, other_storage.flush())
+            # Updated in another container while it is created.
+            other_storage.update_item(item['id'], {'Committed ?': True})
+            return create_items(table_name, fields_list)
+
+        with mock.patch.object(self.client, 'batch_create', side_effect=_create_while_flushing):
+            self.assertEqual(0, self.storage.flush())
+
+        records = list(self.client.iterate('Items', view='Current View'))
+        self.assertEqual(['The coffee', 'The tea'], [r['fields']['Object'] for r in records])
+        self.assertTrue(records[1]['fields'].get('Committed ?'))
+
+    def test_flushed_in_other_container(self):
+        """Items created by the flush of another container are listed before the cache expires."""
+
+        list(self.storage.iterate_current_items())
+        self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        other_storage = write_queue.WriteBehindStorage(
+            storage.AirtableStorage(self.client), self.queue_path)
+        self.assertEqual(0, other_storage.flush())
+
+        with mock.patch.object(self.client, 'iterate') as mock_iterate:
+            records = list(self.storage.iterate_current_items())
+            self.assertTrue(self.storage.has_item('good', 'the coffee'))
+        mock_iterate.assert_not_called()
+        record_ids = [record['id'] for record in self.client.iterate('Items', view='Current View')]
+        self.assertEqual(record_ids, [record['id'] for record in records])
+
+        other_storage.update_item(record_ids[0], {'Reviewed At': '2018-10-17T10:00:00.000Z'})
+        self.assertEqual([], list(self.storage.iterate_current_items()))
+
+    def test_maybe_created(self):
+        """Items that might have been created by a request that failed are not created again."""
+
+        item = self.storage.create_item({'Category': 'good', 'Object': 'The coffee'})
+        with mock.patch.object(
+                self.client, 'batch_create', side_effect=requests.Timeout('Read timed out')), \
+                self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(0, self.storage.flush())
+        self.assertIn(item['id'], logs.output[-1])
+
+        self.assertEqual(0, self.storage.flush())
+        self.assertEqual([], self._get_airtable_objects())
+        self.assertEqual([], list(self.storage.iterate_current_items()))
+        self.assertFalse(self.storage.has_item('good', 'the coffee'))
+        with self.assertRaises(storage.StorageError):
+            self.storage.update_item(item['id'], {'Committed ?': True})
+
+
+if __name__ == '__main__':
+    unittest.main()